@@ -66,7 +66,7 @@ def run_scenario(config: dict, scenario_name: str, dry_run: bool = False):
     
     try:
         # Import tutaj aby uniknąć błędów jeśli tylko listujemy
-        from remote_automation import RemoteController, OllamaVision, AutomationEngine
+        from remote_automation import RemoteController, OllamaVision, AutomationEngine, DEFAULT_MAX_EDGE
         
         # Konfiguracja połączenia
         conn_config = config.get('connection', {})
@@ -82,11 +82,16 @@ def run_scenario(config: dict, scenario_name: str, dry_run: bool = False):
         ollama_config = config.get('ollama', {})
         vision = OllamaVision(
             base_url=ollama_config.get('url', 'http://localhost:11434'),
-            model=ollama_config.get('model', 'llava:7b')
+            model=ollama_config.get('model', 'llava:7b'),
+            image_format=ollama_config.get('image_format', 'png'),
+            image_quality=ollama_config.get('image_quality', 90),
+            max_edge=ollama_config.get('max_edge', DEFAULT_MAX_EDGE)
         )
         
         # Wykonaj
-        engine = AutomationEngine(controller, vision)
+        engine = AutomationEngine(controller, vision, settle=config.get('settle', True),
+                                  cv_analysis_scale=config.get('cv', {}).get('analysis_scale', 1.0),
+                                  cv_parallel=config.get('cv', {}).get('parallel', False))
         engine.execute_dsl(script)
         
         print("\n✅ Scenariusz zakończony pomyślnie!")
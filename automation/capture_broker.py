@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Capture Broker - jeden producent screenshotów dla wielu konsumentów
+Silnik, nagrywanie i live monitor dzielą jedno przechwytywanie ekranu
+"""
+
+import threading
+import time
+from typing import Dict, Optional
+
+from frame import Frame
+
+
+class FrameSubscription:
+    """Subskrypcja klatek z własnym limitem FPS (semantyka "najnowsza klatka")"""
+
+    def __init__(self, broker: 'CaptureBroker', name: str, max_fps: Optional[float] = None):
+        self.broker = broker
+        self.name = name
+        self.max_fps = max_fps
+        self.last_frame_id = 0
+        self.last_delivery = 0.0
+        self.delivered = 0
+
+    def latest(self) -> Optional[Frame]:
+        """Najnowsza klatka bez czekania (None jeśli jeszcze nie ma żadnej)"""
+        frame, frame_id, _ = self.broker.latest()
+        if frame is not None:
+            self._mark_delivered(frame_id)
+        return frame
+
+    def get(self, timeout: float = 1.0) -> Optional[Frame]:
+        """
+        Czekaj na klatkę nowszą niż ostatnio odebrana, z limitem max_fps
+
+        Klatki, których subskrybent nie zdążył odebrać, są pomijane -
+        zawsze dostaje najnowszą.
+
+        Returns:
+            Klatka lub None po upływie timeout
+        """
+        deadline = time.time() + timeout
+
+        if self.max_fps:
+            wait = self.last_delivery + 1.0 / self.max_fps - time.time()
+            if wait > 0:
+                if wait > timeout:
+                    time.sleep(timeout)
+                    return None
+                time.sleep(wait)
+
+        frame, frame_id, _ = self.broker.wait_for_frame(self.last_frame_id, deadline - time.time())
+        if frame is not None:
+            self._mark_delivered(frame_id)
+        return frame
+
+    def close(self):
+        """Zakończ subskrypcję"""
+        self.broker.unsubscribe(self)
+
+    def _mark_delivered(self, frame_id: int):
+        self.last_frame_id = frame_id
+        self.last_delivery = time.time()
+        self.delivered += 1
+
+
+class CaptureBroker:
+    """
+    Właściciel przechwytywania ekranu dla jednego RemoteController
+
+    Jeden wątek przechwytuje ekran z zadaną częstotliwością (tylko gdy
+    są subskrybenci) i udostępnia najnowszą klatkę wszystkim konsumentom.
+    Żądania świeżej klatki (np. silnik po kliknięciu) budzą producenta
+    natychmiast zamiast czekać do kolejnego taktu.
+    """
+
+    def __init__(self, controller, fps: float = 10):
+        """
+        Args:
+            controller: RemoteController, z którego przechwytujemy ekran
+            fps: Maksymalna częstotliwość przechwytywania
+        """
+        self.controller = controller
+        self.fps = fps
+
+        self.subscriptions: Dict[str, FrameSubscription] = {}
+        self.capture_count = 0
+        self.error_count = 0
+
+        self._frame: Optional[Frame] = None
+        self._frame_id = 0
+        self._frame_time = 0.0
+
+        self._condition = threading.Condition()
+        self._capture_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._fresh_requests = 0
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Uruchom wątek producenta"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Zatrzymaj wątek producenta"""
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def subscribe(self, name: str, max_fps: Optional[float] = None) -> FrameSubscription:
+        """Dodaj konsumenta klatek (nazwa musi być unikalna)"""
+        subscription = FrameSubscription(self, name, max_fps)
+        with self._condition:
+            self.subscriptions[name] = subscription
+        self._wakeup.set()
+        return subscription
+
+    def unsubscribe(self, subscription: FrameSubscription):
+        """Usuń konsumenta klatek"""
+        with self._condition:
+            if self.subscriptions.get(subscription.name) is subscription:
+                del self.subscriptions[subscription.name]
+
+    def latest(self):
+        """
+        Returns:
+            (klatka, id klatki, czas przechwycenia) - klatka None jeśli brak
+        """
+        with self._condition:
+            return self._frame, self._frame_id, self._frame_time
+
+    def wait_for_frame(self, after_id: int, timeout: float):
+        """
+        Czekaj na klatkę o id większym niż `after_id`
+
+        Returns:
+            (klatka, id klatki, czas przechwycenia) - klatka None po upływie timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frame_id > after_id, max(0.0, timeout)):
+                return None, after_id, 0.0
+            return self._frame, self._frame_id, self._frame_time
+
+    def get_frame(self, max_age: float = 0.0, timeout: float = 10.0) -> Frame:
+        """
+        Klatka przechwycona nie wcześniej niż `max_age` sekund temu
+
+        Z max_age=0 (domyślnie) zwraca klatkę przechwyconą po wywołaniu -
+        tego potrzebuje silnik, żeby widzieć efekt poprzedniej akcji.
+        Gdy producent nie działa, przechwytuje synchronicznie.
+        """
+        requested_at = time.time()
+
+        with self._condition:
+            if self._frame is not None and max_age > 0 and self._frame_time >= requested_at - max_age:
+                return self._frame
+
+        if not self._running or self.controller.connection is None:
+            return self._capture_once()
+
+        with self._condition:
+            self._fresh_requests += 1
+            after_id = self._frame_id
+        self._wakeup.set()
+
+        try:
+            deadline = requested_at + timeout
+            while True:
+                frame, after_id, captured_at = self.wait_for_frame(after_id, deadline - time.time())
+                if frame is None:
+                    raise TimeoutError(f"Brak klatki z CaptureBroker po {timeout}s")
+                if captured_at >= requested_at:
+                    return frame
+        finally:
+            with self._condition:
+                self._fresh_requests -= 1
+
+    def stats(self) -> Dict:
+        """Statystyki przechwytywania"""
+        with self._condition:
+            return {
+                'captures': self.capture_count,
+                'errors': self.error_count,
+                'subscribers': {name: sub.delivered for name, sub in self.subscriptions.items()},
+            }
+
+    def _capture_once(self) -> Optional[Frame]:
+        """Przechwyć klatkę i opublikuj ją subskrybentom"""
+        with self._capture_lock:
+            captured_at = time.time()
+            frame = self.controller.capture_frame()
+
+        with self._condition:
+            self._frame = frame
+            self._frame_id += 1
+            self._frame_time = captured_at
+            self.capture_count += 1
+            self._condition.notify_all()
+        return frame
+
+    def _has_demand(self) -> bool:
+        with self._condition:
+            return bool(self.subscriptions) or self._fresh_requests > 0
+
+    def _capture_loop(self):
+        """Wątek producenta"""
+        frame_interval = 1.0 / self.fps
+
+        while self._running:
+            loop_start = time.time()
+
+            if not self._has_demand() or self.controller.connection is None:
+                # Nikt nie czeka na klatki (lub brak połączenia) - śpij do wybudzenia
+                self._wakeup.wait(timeout=frame_interval)
+                self._wakeup.clear()
+                continue
+
+            try:
+                self._capture_once()
+            except Exception as e:
+                self.error_count += 1
+                print(f"⚠️  CaptureBroker: błąd przechwytywania: {e}")
+
+            # Czekaj do następnego taktu (żądanie świeżej klatki budzi wcześniej)
+            elapsed = time.time() - loop_start
+            self._wakeup.wait(timeout=max(0, frame_interval - elapsed))
+            self._wakeup.clear()
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+CV Benchmark - szybkość i trafność CVDetector na korpusie screenshotów
+Każdy detektor na każdym obrazie: p50/p95/p99, przepustowość, trafienia
+względem zaznaczonych obszarów; wyniki w JSON do porównań między wersjami
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from cv_detection import CVDetector, CV_WORKERS
+
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.bmp')
+DETECTORS = ('detect_rectangles', 'detect_buttons', 'find_text_field', 'detect_dialog_box',
+             'find_unlock_button', 'template_match', 'find_template', 'find_templates', 'quick_analysis')
+MIN_IOU = 0.5                 # prostokąt trafia, gdy pokrywa się z zaznaczonym co najmniej tyle
+SYNTHETIC_TEMPLATE = 'templates/unlock_button.png'
+SYNTHETIC_ICON = 'templates/file_icon.png'    # drobny wzór - po pomniejszeniu score spada najbardziej
+ICON_SIZE = 48
+SYNTHETIC_SIZES = [(1280, 800), (1280, 720), (1920, 1080)]
+
+# Etykiety: <obraz>.json obok obrazu, np.
+# {"dialog": [x, y, w, h] | null, "text_field": [...] | null, "unlock": [...] | null,
+#  "buttons": [[x, y, w, h], ...], "rectangles": [[x, y, w, h], ...],
+#  "templates": {"templates/ok.png": [x, y, w, h] | null}}
+# Brak klucza = nie oceniaj; null = na obrazie nie ma elementu (wykrycie to błąd).
+# Ścieżki szablonów są względne do katalogu pliku etykiet.
+
+
+# ===== Korpus =====
+
+def load_corpus(corpus_dir: Path) -> List[Dict]:
+    """Obrazy korpusu (BGR) z etykietami z plików JSON obok nich (jeśli są)"""
+    samples = []
+    for path in sorted(corpus_dir.rglob('*')):
+        if path.suffix.lower() not in IMAGE_SUFFIXES or path.parent.name == 'templates':
+            continue
+        img = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        if img is None:
+            print(f"  ⚠️  Nie można wczytać: {path}")
+            continue
+        labels = None
+        label_path = path.with_suffix('.json')
+        if label_path.exists():
+            with open(label_path, 'r', encoding='utf-8') as f:
+                labels = json.load(f)
+        samples.append({'name': str(path.relative_to(corpus_dir)), 'dir': path.parent,
+                        'img': img, 'labels': labels})
+    return samples
+
+
+def generate_synthetic(output_dir: Path, count: int, seed: int = 0) -> int:
+    """
+    Wygeneruj syntetyczne pulpity z etykietami (deterministycznie dla danego seed)
+
+    Okna z paskiem tytułu i tekstem, przyciski na pulpicie, w większości
+    obrazów dialog logowania (pole tekstowe + Cancel/Unlock), czasem pusty
+    (czarny) ekran. Zapisuje też szablon przycisku Unlock i ikony o drobnym
+    wzorze (wstawianej w nieparzystym położeniu - najtrudniejszy przypadek
+    dla dopasowania coarse-to-fine).
+
+    Returns:
+        Liczba zapisanych obrazów
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / 'templates').mkdir(exist_ok=True)
+    cv2.imwrite(str(output_dir / SYNTHETIC_ICON), _synthetic_icon())
+    template_saved = False
+
+    for i in range(count):
+        rng = np.random.default_rng(seed + i)
+        width, height = SYNTHETIC_SIZES[int(rng.integers(len(SYNTHETIC_SIZES)))]
+        img, labels = _synthetic_screen(rng, width, height)
+
+        unlock = labels['unlock']
+        if unlock and not template_saved:
+            x, y, w, h = unlock
+            cv2.imwrite(str(output_dir / SYNTHETIC_TEMPLATE), img[y:y + h, x:x + w])
+            template_saved = True
+        labels['templates'] = {SYNTHETIC_TEMPLATE: unlock, SYNTHETIC_ICON: labels.pop('icon')}
+
+        name = f"synthetic_{seed + i:04d}"
+        cv2.imwrite(str(output_dir / f"{name}.png"), img)
+        with open(output_dir / f"{name}.json", 'w', encoding='utf-8') as f:
+            json.dump(labels, f, indent=2)
+    return count
+
+
+def _synthetic_icon() -> np.ndarray:
+    """Ikona z drobnym (2x2 px) wzorem - zawsze ta sama"""
+    rng = np.random.default_rng(2024)
+    cells = rng.integers(0, 2, (ICON_SIZE // 2, ICON_SIZE // 2, 1)).astype(np.uint8)
+    pattern = np.kron(cells, np.ones((2, 2, 1), np.uint8))
+    return np.where(pattern > 0, np.uint8(230), np.uint8(40)).repeat(3, axis=2)
+
+
+def _synthetic_screen(rng: np.random.Generator, width: int, height: int) -> Tuple[np.ndarray, Dict]:
+    """Jeden syntetyczny pulpit i jego etykiety"""
+    kind = rng.choice(['dialog', 'dialog', 'dialog', 'desktop', 'blank'], p=[0.25, 0.25, 0.2, 0.2, 0.1])
+    labels = {'dialog': None, 'text_field': None, 'unlock': None, 'icon': None, 'buttons': [], 'rectangles': []}
+    if kind == 'blank':
+        return np.zeros((height, width, 3), np.uint8), labels
+
+    background = tuple(int(c) for c in rng.integers(30, 110, 3))
+    img = np.full((height, width, 3), background, np.uint8)
+    cv2.rectangle(img, (0, height - 48), (width, height), (40, 40, 40), -1)
+
+    # Okna obok siebie (bez nakładania - etykieta to cały prostokąt okna)
+    columns = int(rng.integers(1, 4))
+    column_width = width // columns
+    for column in range(columns):
+        if rng.random() < 0.3:
+            continue
+        w = int(rng.integers(column_width // 2, column_width - 20))
+        h = int(rng.integers(height // 3, height - 160))
+        x = column * column_width + int(rng.integers(10, column_width - w - 5))
+        y = int(rng.integers(10, height - 60 - h))
+        cv2.rectangle(img, (x, y), (x + w - 1, y + h - 1), (235, 235, 235), -1)
+        cv2.rectangle(img, (x, y), (x + w - 1, y + 29), (120, 80, 50), -1)
+        for line in range(min(8, (h - 60) // 30)):
+            cv2.putText(img, f"Lorem ipsum dolor {line}", (x + 20, y + 70 + line * 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (30, 30, 30), 1)
+        labels['rectangles'].append([x, y, w, h])
+
+    # Przyciski na pasku zadań
+    for b in range(int(rng.integers(0, 3))):
+        x, y, w, h = 60 + b * 140, height - 44, 120, 40
+        cv2.rectangle(img, (x, y), (x + w - 1, y + h - 1), (90, 90, 90), -1)
+        cv2.rectangle(img, (x, y), (x + w - 1, y + h - 1), (200, 200, 200), 1)
+        cv2.putText(img, f"App {b}", (x + 30, y + 27), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+        labels['buttons'].append([x, y, w, h])
+
+    # Ikona nad dialogiem, w nieparzystym położeniu (przesunięta względem siatki pyrDown)
+    if rng.random() < 0.8:
+        x = 2 * int(rng.integers(5, (width - ICON_SIZE) // 2 - 5)) + 1
+        y = 2 * int(rng.integers(5, 50)) + 1
+        img[y:y + ICON_SIZE, x:x + ICON_SIZE] = _synthetic_icon()
+        labels['icon'] = [x, y, ICON_SIZE, ICON_SIZE]
+
+    if kind == 'dialog':
+        dw, dh = 500, 260
+        dx = (width - dw) // 2 + int(rng.integers(-80, 80))
+        dy = (height - dh) // 2 + int(rng.integers(-60, 60))
+        cv2.rectangle(img, (dx, dy), (dx + dw, dy + dh), (200, 200, 200), -1)
+        cv2.rectangle(img, (dx, dy), (dx + dw, dy + dh), (60, 60, 60), 2)
+        cv2.rectangle(img, (dx + 40, dy + 90), (dx + 460, dy + 125), (255, 255, 255), -1)
+        cv2.rectangle(img, (dx + 40, dy + 90), (dx + 460, dy + 125), (100, 100, 100), 1)
+        for bx, label in [(dx + 250, 'Cancel'), (dx + 370, 'Unlock')]:
+            cv2.rectangle(img, (bx, dy + 190), (bx + 100, dy + 230), (180, 120, 60), -1)
+            cv2.putText(img, label, (bx + 12, dy + 217), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+            labels['buttons'].append([bx, dy + 190, 101, 41])
+        labels['dialog'] = [dx, dy, dw + 1, dh + 1]
+        labels['text_field'] = [dx + 40, dy + 90, 421, 36]
+        labels['unlock'] = [dx + 370, dy + 190, 101, 41]
+        labels['rectangles'].append(labels['dialog'])
+    return img, labels
+
+
+# ===== Ocena trafności =====
+
+def _iou(a, b) -> float:
+    w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float(a[2] * a[3] + b[2] * b[3] - inter)
+
+
+def _inside(point, box) -> bool:
+    return (point is not None and box[0] <= point[0] < box[0] + box[2]
+            and box[1] <= point[1] < box[1] + box[3])
+
+
+def score_point(point, box) -> Tuple[int, int]:
+    """Punkt w zaznaczonym obszarze (box None = niczego nie powinno być)"""
+    if box is None:
+        return int(point is None), 1
+    return int(_inside(point, box)), 1
+
+
+def score_box(found, box) -> Tuple[int, int]:
+    """Prostokąt (x, y, w, h) pokrywający się z zaznaczonym (box None = niczego nie powinno być)"""
+    if box is None:
+        return int(found is None), 1
+    return int(found is not None and _iou(found, box) >= MIN_IOU), 1
+
+
+def score_recall(found: List, boxes: List) -> Tuple[int, int]:
+    """Ile zaznaczonych prostokątów ma wykryty odpowiednik"""
+    hits = sum(1 for box in boxes if any(_iou(rect, box) >= MIN_IOU for rect in found))
+    return hits, len(boxes)
+
+
+def _as_rect(item: Optional[Dict]):
+    return None if item is None else (item['x'], item['y'], item['width'], item['height'])
+
+
+def score(name: str, result, labels: Optional[Dict], template: Optional[str] = None) -> Tuple[int, int]:
+    """
+    Trafienia wyniku detektora względem etykiet obrazu
+
+    Returns:
+        (trafienia, ocenione) - (0, 0) gdy obraz nie ma etykiet dla tego detektora
+    """
+    if not labels:
+        return 0, 0
+    if name == 'detect_rectangles' and 'rectangles' in labels:
+        return score_recall(result, labels['rectangles'])
+    if name == 'detect_buttons' and 'buttons' in labels:
+        return score_recall([_as_rect(b) for b in result], labels['buttons'])
+    if name == 'find_text_field' and 'text_field' in labels:
+        return score_point(result, labels['text_field'])
+    if name == 'detect_dialog_box' and 'dialog' in labels:
+        return score_box(_as_rect(result), labels['dialog'])
+    if name == 'find_unlock_button' and 'unlock' in labels:
+        return score_point(result, labels['unlock'])
+    if name == 'template_match' and template in labels.get('templates', {}):
+        return score_point(result, labels['templates'][template])
+    if name == 'find_template' and template in labels.get('templates', {}):
+        return score_point(result['center'] if result else None, labels['templates'][template])
+    if name == 'find_templates' and 'templates' in labels:
+        hits = total = 0
+        for key, box in labels['templates'].items():
+            if key in result:
+                h, t = score_point(result[key], box)
+                hits, total = hits + h, total + t
+        return hits, total
+    if name == 'quick_analysis':
+        hits = total = 0
+        for key, field in (('dialog', 'dialog_center'), ('text_field', 'text_field_position'),
+                           ('unlock', 'unlock_button')):
+            if key in labels:
+                h, t = score_point(result[field], labels[key])
+                hits, total = hits + h, total + t
+        return hits, total
+    return 0, 0
+
+
+# ===== Pomiar =====
+
+def _calls(detector: CVDetector, sample: Dict) -> List[Tuple[str, Optional[str], Callable]]:
+    """Wywołania detektorów dla obrazu: (nazwa, szablon, funkcja)"""
+    img = sample['img']
+    calls = [
+        ('detect_rectangles', None, lambda: detector.detect_rectangles(img)),
+        ('detect_buttons', None, lambda: detector.detect_buttons(img)),
+        ('find_text_field', None, lambda: detector.find_text_field(img)),
+        ('detect_dialog_box', None, lambda: detector.detect_dialog_box(img)),
+        ('find_unlock_button', None, lambda: detector.find_unlock_button(img)),
+        ('quick_analysis', None, lambda: detector.quick_analysis(img)),
+    ]
+    templates = {}
+    for template in (sample['labels'] or {}).get('templates', {}):
+        path = sample['dir'] / template
+        if not path.exists():
+            print(f"  ⚠️  Brak szablonu {path} ({sample['name']})")
+            continue
+        path = templates[template] = str(path)
+        calls.append(('template_match', template, lambda path=path: detector.template_match(img, path)))
+        calls.append(('find_template', template, lambda path=path: detector.find_template(img, path)))
+    if templates:
+        def find_all():
+            # {szablon z etykiet: środek najlepszego trafienia lub None}
+            hits = {hit['template']: hit['center'] for hit in detector.find_templates(img, list(templates.values()))}
+            return {template: hits.get(path) for template, path in templates.items()}
+        calls.append(('find_templates', None, find_all))
+    return calls
+
+
+def percentile_stats(times_ms: List[float]) -> Dict:
+    """p50/p95/p99, średnia i przepustowość (wywołania/s w jednym wątku)"""
+    if not times_ms:
+        return {'calls': 0}
+    values = np.asarray(times_ms)
+    mean = float(values.mean())
+    return {
+        'calls': len(times_ms),
+        'mean_ms': round(mean, 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'max_ms': round(float(values.max()), 3),
+        'throughput_per_s': round(1000.0 / mean, 1) if mean > 0 else None,
+    }
+
+
+def run_benchmark(samples: List[Dict], detector: CVDetector, repeat: int = 5,
+                  detectors: Optional[List[str]] = None) -> Dict:
+    """
+    Zmierz wszystkie detektory na wszystkich obrazach
+
+    Każde wywołanie dostaje surowy obraz BGR, więc mierzy pełny koszt
+    pojedynczego detektora (także gray/krawędzie/kontury). Pierwsze
+    wywołanie na obrazie jest rozgrzewką (szablony, pamięć) i nie jest liczone.
+    """
+    selected = set(detectors or DETECTORS)
+    times = {name: [] for name in DETECTORS if name in selected}
+    hits = {name: [0, 0] for name in times}
+    misses = {name: [] for name in times}
+
+    start = time.perf_counter()
+    for sample in samples:
+        for name, template, call in _calls(detector, sample):
+            if name not in selected:
+                continue
+            result = call()
+            for _ in range(repeat):
+                t = time.perf_counter()
+                call()
+                times[name].append((time.perf_counter() - t) * 1000)
+            h, total = score(name, result, sample['labels'], template)
+            hits[name][0] += h
+            hits[name][1] += total
+            if h < total:
+                misses[name].append(sample['name'])
+    wall = time.perf_counter() - start
+
+    results = {}
+    for name in times:
+        stats = percentile_stats(times[name])
+        h, total = hits[name]
+        stats.update({
+            'hits': h,
+            'labelled': total,
+            'hit_rate': round(h / total, 4) if total else None,
+            'missed_images': misses[name][:20],
+        })
+        results[name] = stats
+    return {
+        'images': len(samples),
+        'labelled_images': sum(1 for s in samples if s['labels']),
+        'images_per_s': round(len(samples) * repeat / wall, 2) if wall > 0 else None,
+        'detectors': results,
+    }
+
+
+def environment(args) -> Dict:
+    """Wersja kodu i środowiska - żeby wyniki z różnych maszyn/wersji dało się odróżnić"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'cpu_count': os.cpu_count(),
+        'cv_workers': CV_WORKERS,
+        'analysis_scale': args.scale,
+        'parallel': args.parallel,
+        'repeat': args.repeat,
+    }
+
+
+# ===== Raport =====
+
+def print_report(report: Dict):
+    print(f"\n📊 CV Benchmark - {report['images']} obrazów "
+          f"({report['labelled_images']} z etykietami), {report['images_per_s']} obrazów/s")
+    print(f"  {'detektor':<20} {'p50':>8} {'p95':>8} {'p99':>8} {'/s':>8} {'trafienia':>14}")
+    for name, stats in report['detectors'].items():
+        if not stats['calls']:
+            print(f"  {name:<20} {'-':>8} {'-':>8} {'-':>8} {'-':>8} {'(brak danych)':>14}")
+            continue
+        rate = (f"{stats['hits']}/{stats['labelled']} ({stats['hit_rate']:.0%})"
+                if stats['labelled'] else '-')
+        print(f"  {name:<20} {stats['p50_ms']:>6.2f}ms {stats['p95_ms']:>6.2f}ms "
+              f"{stats['p99_ms']:>6.2f}ms {stats['throughput_per_s']:>8} {rate:>14}")
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Regresje względem poprzedniego wyniku
+
+    Returns:
+        Opisy regresji: p95 wolniejsze o więcej niż `tolerance` lub niższy hit rate
+    """
+    regressions = []
+    print(f"\n🔀 Porównanie z {baseline.get('environment', {}).get('commit') or 'poprzednim wynikiem'}:")
+    for name, stats in report['detectors'].items():
+        old = baseline.get('detectors', {}).get(name)
+        if not old or not old.get('calls') or not stats.get('calls'):
+            continue
+        change = stats['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0.0
+        line = f"  {name:<20} p95 {old['p95_ms']:.2f} → {stats['p95_ms']:.2f}ms ({change:+.0%})"
+        if change > tolerance:
+            regressions.append(f"{name}: p95 {change:+.0%}")
+            line += " ⚠️"
+        if stats.get('hit_rate') is not None and old.get('hit_rate') is not None:
+            line += f", trafienia {old['hit_rate']:.0%} → {stats['hit_rate']:.0%}"
+            if stats['hit_rate'] < old['hit_rate']:
+                regressions.append(f"{name}: hit rate {old['hit_rate']:.0%} → {stats['hit_rate']:.0%}")
+                line += " ⚠️"
+        print(line)
+    return regressions
+
+
+def main():
+    """Główna funkcja"""
+    parser = argparse.ArgumentParser(
+        description="Benchmark CVDetector: opóźnienia (p50/p95/p99), przepustowość i trafność na korpusie screenshotów"
+    )
+
+    parser.add_argument(
+        'corpus',
+        type=Path,
+        help='Katalog ze screenshotami (PNG/JPG, opcjonalnie etykiety <obraz>.json)'
+    )
+
+    parser.add_argument(
+        '--generate',
+        type=int,
+        default=0,
+        metavar='N',
+        help='Najpierw wygeneruj N syntetycznych pulpitów z etykietami do <corpus>/synthetic'
+    )
+
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed generatora syntetycznych obrazów'
+    )
+
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='Pomiary każdego detektora na obrazie (po rozgrzewce)'
+    )
+
+    parser.add_argument(
+        '--detectors',
+        nargs='+',
+        choices=DETECTORS,
+        help='Tylko wybrane detektory'
+    )
+
+    parser.add_argument(
+        '--scale',
+        type=float,
+        default=1.0,
+        help='analysis_scale detektora (jak cv.analysis_scale w config.yaml)'
+    )
+
+    parser.add_argument(
+        '--parallel',
+        action='store_true',
+        help='quick_analysis z równoległymi detektorami (jak cv.parallel)'
+    )
+
+    parser.add_argument(
+        '--output',
+        type=Path,
+        default=Path('/app/results/cv_benchmark'),
+        help='Plik JSON lub katalog wyników (domyślnie /app/results/cv_benchmark)'
+    )
+
+    parser.add_argument(
+        '--compare',
+        type=Path,
+        help='Poprzedni wynik JSON - wypisz różnice, kod wyjścia 1 przy regresji'
+    )
+
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.2,
+        help='Dopuszczalny wzrost p95 przy --compare (0.2 = 20%%)'
+    )
+
+    args = parser.parse_args()
+
+    if args.generate:
+        count = generate_synthetic(args.corpus / 'synthetic', args.generate, args.seed)
+        print(f"🧪 Wygenerowano {count} syntetycznych obrazów w {args.corpus / 'synthetic'}")
+
+    if not args.corpus.is_dir():
+        print(f"❌ Katalog nie istnieje: {args.corpus}")
+        return 1
+    samples = load_corpus(args.corpus)
+    if not samples:
+        print(f"❌ Brak obrazów w {args.corpus}")
+        return 1
+
+    print(f"⏱️  {len(samples)} obrazów x {args.repeat} pomiarów...")
+    detector = CVDetector(args.scale, parallel=args.parallel)
+    report = run_benchmark(samples, detector, args.repeat, args.detectors)
+    report['environment'] = environment(args)
+    print_report(report)
+
+    output = args.output
+    if output.suffix != '.json':
+        output = output / f"cv_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Wyniki: {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ Regresje: {', '.join(regressions)}")
+            return 1
+        print("\n✅ Bez regresji")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
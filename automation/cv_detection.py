@@ -8,22 +8,327 @@ import cv2
 import numpy as np
 from PIL import Image
 import io
-from typing import List, Tuple, Optional, Dict
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Dict, Sequence
+
+from frame import Frame
+from template_library import TemplateLibrary, frame_pyramid
+
+CV_WORKERS = min(4, os.cpu_count() or 1)  # wątki wspólnej puli CV
+
+TILED_MIN_PIXELS = 2560 * 1440  # od tej wielkości klatki krawędzie są liczone pasami w puli
+TILE_OVERLAP = 16               # wiersze zakładki pasów (blur + Canny + zapas na histerezę)
+TILE_BORDER = 4                 # wiersze przy cięciu pasa zniekształcone przez blur/Sobel
+
+_cv_pool: Optional[ThreadPoolExecutor] = None
+_cv_pool_lock = threading.Lock()
+_cv_thread = threading.local()
+
+
+def _mark_cv_worker():
+    _cv_thread.worker = True
+
+
+def get_cv_pool() -> ThreadPoolExecutor:
+    """Wspólna pula wątków dla dopasowań/detektorów (OpenCV zwalnia GIL)"""
+    global _cv_pool
+    with _cv_pool_lock:
+        if _cv_pool is None:
+            _cv_pool = ThreadPoolExecutor(max_workers=CV_WORKERS, thread_name_prefix='cv',
+                                          initializer=_mark_cv_worker)
+        return _cv_pool
+
+
+def in_cv_pool() -> bool:
+    """Czy kod działa w wątku wspólnej puli (wtedy nie wolno czekać na jej zadania)"""
+    return getattr(_cv_thread, 'worker', False)
+
+
+def canny_edges(gray: np.ndarray) -> np.ndarray:
+    """Krawędzie używane przez wszystkie detektory: GaussianBlur 5x5 + Canny (50, 150)"""
+    return cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+
+
+def frame_edges(gray: np.ndarray) -> np.ndarray:
+    """
+    canny_edges całej klatki - na bardzo dużych ekranach pasami we wspólnej puli
+    
+    Wynik jest identyczny z canny_edges: histereza Canny nie jest lokalna,
+    więc sąsiednie pasy muszą zgadzać się w zakładce, inaczej klatka jest
+    liczona jeszcze raz w całości.
+    """
+    height, width = gray.shape[:2]
+    strips = min(CV_WORKERS, height // (4 * TILE_OVERLAP))
+    if height * width < TILED_MIN_PIXELS or strips < 2 or in_cv_pool():
+        return canny_edges(gray)
+    
+    bounds = [height * i // strips for i in range(strips + 1)]
+    
+    def strip(i: int) -> Tuple[int, np.ndarray]:
+        y1 = max(0, bounds[i] - TILE_OVERLAP)
+        return y1, canny_edges(gray[y1:min(height, bounds[i + 1] + TILE_OVERLAP)])
+    
+    parts = list(get_cv_pool().map(strip, range(strips)))
+    for i in range(1, strips):
+        (top_y, top), (bottom_y, bottom) = parts[i - 1], parts[i]
+        y1 = bounds[i] - TILE_OVERLAP + TILE_BORDER
+        y2 = bounds[i] + TILE_OVERLAP - TILE_BORDER
+        if not np.array_equal(top[y1 - top_y:y2 - top_y], bottom[y1 - bottom_y:y2 - bottom_y]):
+            return canny_edges(gray)
+    
+    edges = np.empty_like(gray)
+    for i, (y, part) in enumerate(parts):
+        edges[bounds[i]:bounds[i + 1]] = part[bounds[i] - y:bounds[i + 1] - y]
+    return edges
+
+
+Rect = Tuple[int, int, int, int]
+
+REFINE_MAX_SIDE = 400  # większe propozycje nie są doprecyzowywane (błąd kilku px jest pomijalny)
+REFINE_MIN_IOU = 0.5   # prostokąt z pełnej rozdzielczości musi pokrywać się z propozycją
+
+
+class AnalysisContext:
+    """
+    Wyniki pośrednie analizy jednej klatki, liczone raz i współdzielone
+    
+    Grayscale, krawędzie (GaussianBlur + Canny), kontury i ich prostokąty
+    są liczone leniwie przy pierwszym użyciu. Detektory filtrują wspólne
+    wyniki zamiast każdy osobno konwertować i przetwarzać cały obraz.
+    
+    Przy `scale` < 1 statystyki (diagnostyka, is_screen_blank) i propozycje
+    prostokątów są liczone na pomniejszonym obrazie; propozycje do
+    REFINE_MAX_SIDE px są doprecyzowywane w pełnej rozdzielczości w małym
+    oknie wokół nich. Współrzędne są zawsze w pełnej rozdzielczości.
+    """
+    
+    def __init__(self, img: np.ndarray, gray: Optional[np.ndarray] = None,
+                 edges: Optional[np.ndarray] = None, bright: Optional[np.ndarray] = None,
+                 edge_rects: Optional[List[Rect]] = None,
+                 bright_rects: Optional[List[Rect]] = None, scale: float = 1.0):
+        """
+        Args:
+            img: Obraz BGR
+            gray, edges, bright, edge_rects, bright_rects: Już policzone
+                wyniki pośrednie (np. z IncrementalDetector) - None = licz leniwie
+            scale: Skala analizy (1.0 = pełna rozdzielczość, 0.5, 0.25)
+        """
+        if not 0 < scale <= 1:
+            raise ValueError(f"Skala analizy musi być w (0, 1]: {scale}")
+        self.img = img
+        self.scale = scale
+        self._small_gray = None
+        self._small_edges = None
+        self._gray = gray
+        self._edges = edges
+        self._bright = bright
+        self._edge_rects = edge_rects
+        self._bright_rects = bright_rects
+        self._dialog = None  # (dialog lub None,) - krotka, żeby zapamiętać też brak dialogu
+        self._pyramid: List[np.ndarray] = []
+        self._pyramid_lock = threading.Lock()
+        # Detektory mogą działać równolegle (quick_analysis parallel) - każdy wynik liczony raz
+        self._locks = {name: threading.Lock() for name in
+                       ('_gray', '_small_gray', '_edges', '_small_edges', '_bright',
+                        '_edge_rects', '_bright_rects', '_dialog')}
+    
+    @classmethod
+    def from_frame(cls, frame: Frame, scale: float = 1.0) -> 'AnalysisContext':
+        """Kontekst z klatki - używa jej zapamiętanych widoków BGR i grayscale"""
+        return cls(frame.bgr, frame.gray, scale=scale)
+    
+    @property
+    def shape(self):
+        return self.img.shape
+    
+    def _once(self, name: str, compute):
+        """Wartość atrybutu `name`, przy pierwszym użyciu liczona przez compute() (raz, także z wielu wątków)"""
+        value = getattr(self, name)
+        if value is None:
+            with self._locks[name]:
+                value = getattr(self, name)
+                if value is None:
+                    value = compute()
+                    setattr(self, name, value)
+        return value
+    
+    @property
+    def gray(self) -> np.ndarray:
+        return self._once('_gray', lambda: cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY))
+    
+    @property
+    def small_gray(self) -> np.ndarray:
+        """Grayscale w skali analizy (przy scale 1.0 - gray)"""
+        if self.scale == 1.0:
+            return self.gray
+        return self._once('_small_gray', self._resize_gray)
+    
+    def _resize_gray(self) -> np.ndarray:
+        height, width = self.gray.shape[:2]
+        size = (max(1, int(round(width * self.scale))), max(1, int(round(height * self.scale))))
+        return cv2.resize(self.gray, size, interpolation=cv2.INTER_AREA)
+    
+    @property
+    def edges(self) -> np.ndarray:
+        """Krawędzie Canny (50, 150) po rozmyciu 5x5"""
+        return self._once('_edges', lambda: frame_edges(self.gray))
+    
+    @property
+    def small_edges(self) -> np.ndarray:
+        """Krawędzie w skali analizy (przy scale 1.0 - edges)"""
+        if self.scale == 1.0:
+            return self.edges
+        # INTER_AREA już wygładza - blur 5x5 na pomniejszonym obrazie zlewałby sąsiednie kontury
+        return self._once('_small_edges',
+                          lambda: cv2.Canny(cv2.GaussianBlur(self.small_gray, (3, 3), 0), 50, 150))
+    
+    def edge_count(self) -> int:
+        """Liczba pikseli krawędzi w przeliczeniu na pełną rozdzielczość"""
+        count = cv2.countNonZero(self.small_edges)
+        # Długość krawędzi skaluje się liniowo z rozdzielczością
+        return count if self.scale == 1.0 else int(round(count / self.scale))
+    
+    @property
+    def edge_rects(self) -> List[Rect]:
+        """Prostokąty otaczające zewnętrzne kontury krawędzi (w kolejności konturów)"""
+        if self.scale == 1.0:
+            return self._once('_edge_rects', lambda: _contour_rects(self.edges))
+        return self._once('_edge_rects', lambda: self._refined_proposals(self.small_edges, self._edges_in))
+    
+    @property
+    def bright(self) -> np.ndarray:
+        """Maska jasnych obszarów (gray > 200)"""
+        return self._once('_bright', lambda: cv2.threshold(self.gray, 200, 255, cv2.THRESH_BINARY)[1])
+    
+    @property
+    def bright_rects(self) -> List[Rect]:
+        """Prostokąty otaczające jasne obszary (gray > 200) - kandydaci na pola tekstowe"""
+        if self.scale == 1.0:
+            return self._once('_bright_rects', lambda: _contour_rects(self.bright))
+        return self._once('_bright_rects', lambda: self._refined_proposals(
+            cv2.threshold(self.small_gray, 200, 255, cv2.THRESH_BINARY)[1], self._bright_in))
+    
+    # ===== Propozycje w skali analizy + doprecyzowanie w pełnej rozdzielczości =====
+    
+    def _refined_proposals(self, small_binary: np.ndarray, full_binary_in) -> List[Rect]:
+        """
+        Prostokąty konturów z pomniejszonej maski, przeliczone na pełną rozdzielczość
+        
+        Propozycje do REFINE_MAX_SIDE px są zastępowane najlepiej pokrywającym
+        się prostokątem konturu z maski w pełnej rozdzielczości, policzonej
+        tylko w oknie wokół propozycji (`full_binary_in(x1, y1, x2, y2)`).
+        """
+        contours, _ = cv2.findContours(small_binary, cv2.RETR_EXTERNAL,
+                                       cv2.CHAIN_APPROX_SIMPLE)
+        height, width = self.gray.shape[:2]
+        inverse = 1.0 / self.scale
+        pad = int(np.ceil(2 * inverse)) + 1
+        
+        rects = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            rect = (int(x * inverse), int(y * inverse),
+                    int(np.ceil(w * inverse)), int(np.ceil(h * inverse)))
+            if max(rect[2], rect[3]) <= REFINE_MAX_SIDE:
+                x1, y1 = max(0, rect[0] - pad), max(0, rect[1] - pad)
+                x2, y2 = min(width, rect[0] + rect[2] + pad), min(height, rect[1] + rect[3] + pad)
+                window, _ = cv2.findContours(full_binary_in(x1, y1, x2, y2), cv2.RETR_EXTERNAL,
+                                             cv2.CHAIN_APPROX_SIMPLE)
+                best, best_iou = None, REFINE_MIN_IOU
+                for candidate in window:
+                    cx, cy, cw, ch = cv2.boundingRect(candidate)
+                    refined = (cx + x1, cy + y1, cw, ch)
+                    iou = _rect_iou(rect, refined)
+                    if iou >= best_iou:
+                        best, best_iou = refined, iou
+                rect = best or rect
+            rects.append(rect)
+        return rects
+    
+    def _edges_in(self, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+        """Krawędzie pełnej rozdzielczości w oknie (liczone z marginesem na brzegi blur/Canny)"""
+        height, width = self.gray.shape[:2]
+        margin = 4
+        cx1, cy1 = max(0, x1 - margin), max(0, y1 - margin)
+        cx2, cy2 = min(width, x2 + margin), min(height, y2 + margin)
+        edges = canny_edges(self.gray[cy1:cy2, cx1:cx2])
+        return np.ascontiguousarray(edges[y1 - cy1:y2 - cy1, x1 - cx1:x2 - cx1])
+    
+    def _bright_in(self, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+        """Maska jasności pełnej rozdzielczości w oknie"""
+        _, bright = cv2.threshold(self.gray[y1:y2, x1:x2], 200, 255, cv2.THRESH_BINARY)
+        return bright
+    
+    def pyramid(self, level: int) -> np.ndarray:
+        """Grayscale pomniejszony pyrDown `level` razy (poziom 0 = gray) - dla dopasowania szablonów"""
+        if level >= len(self._pyramid):
+            with self._pyramid_lock:
+                if level >= len(self._pyramid):
+                    self._pyramid = frame_pyramid(self.gray, level)
+        return self._pyramid[level]
+    
+    def crop(self, x: int, y: int, w: int, h: int) -> 'AnalysisContext':
+        """
+        Kontekst fragmentu - obraz i gray są wycinkami (bez przeliczania)
+        
+        Krawędzie są liczone od nowa na wycinku: ramka wycinanego obszaru
+        (np. dialogu) nie może zostać konturem zasłaniającym jego wnętrze.
+        """
+        return AnalysisContext(
+            self.img[y:y+h, x:x+w],
+            self._gray[y:y+h, x:x+w] if self._gray is not None else None,
+            scale=self.scale
+        )
+
+
+def _contour_rects(binary: np.ndarray) -> List[Rect]:
+    """Prostokąty otaczające zewnętrzne kontury maski (w kolejności konturów)"""
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [cv2.boundingRect(contour) for contour in contours]
+
+
+def _rect_iou(a: Rect, b: Rect) -> float:
+    """Intersection over union prostokątów (x, y, w, h)"""
+    w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float(a[2] * a[3] + b[2] * b[3] - inter)
+
 
 class CVDetector:
     """Computer Vision detector dla automatyzacji"""
     
-    def __init__(self):
+    def __init__(self, analysis_scale: float = 1.0, parallel: bool = False):
+        """
+        Args:
+            analysis_scale: Skala analizy (1.0 = pełna rozdzielczość; 0.5 lub 0.25
+                dla dużych ekranów - diagnostyka i propozycje prostokątów na
+                pomniejszonym obrazie, doprecyzowanie w pełnej rozdzielczości)
+            parallel: quick_analysis uruchamia detektory równolegle we
+                wspólnej puli wątków (wyniki identyczne jak szeregowo)
+        """
+        if not 0 < analysis_scale <= 1:
+            raise ValueError(f"analysis_scale musi być w (0, 1]: {analysis_scale}")
+        self.analysis_scale = analysis_scale
+        self.parallel = parallel
         self.last_screenshot = None
         self.debug = False
+        self.templates = TemplateLibrary()  # szablony wczytywane raz (unieważniane po mtime)
     
     def set_debug(self, debug: bool):
         """Włącz debug mode - zapisuje pośrednie obrazy"""
         self.debug = debug
     
     def screenshot_to_cv(self, screenshot_data) -> np.ndarray:
-        """Konwertuj screenshot PIL/bytes do OpenCV format"""
-        if isinstance(screenshot_data, bytes):
+        """Konwertuj screenshot Frame/PIL/bytes do OpenCV format"""
+        if isinstance(screenshot_data, Frame):
+            # Widok BGR liczony raz na klatkę
+            img = screenshot_data.bgr
+        elif isinstance(screenshot_data, bytes):
             # Z bytes
             nparr = np.frombuffer(screenshot_data, np.uint8)
             img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
@@ -37,55 +342,69 @@ class CVDetector:
         self.last_screenshot = img
         return img
     
-    def detect_edges(self, img: np.ndarray, low_threshold: int = 50, 
+    def context(self, img, scale: Optional[float] = None) -> AnalysisContext:
+        """
+        Kontekst analizy dla obrazu BGR, klatki Frame lub istniejącego kontekstu
+        
+        Wszystkie detektory przyjmują każdą z tych form - przekazanie jednego
+        kontekstu do kilku detektorów sprawia, że przetwarzanie obrazu
+        (gray, blur, Canny, kontury) odbywa się tylko raz.
+        
+        Args:
+            img: Obraz BGR, Frame lub AnalysisContext (zwracany bez zmian)
+            scale: Skala analizy (None = analysis_scale detektora)
+        """
+        if isinstance(img, AnalysisContext):
+            return img
+        scale = self.analysis_scale if scale is None else scale
+        if isinstance(img, Frame):
+            return AnalysisContext.from_frame(img, scale)
+        return AnalysisContext(img, scale=scale)
+    
+    def detect_edges(self, img, low_threshold: int = 50, 
                      high_threshold: int = 150) -> np.ndarray:
         """
         Wykryj krawędzie używając Canny edge detection
         
         Args:
-            img: Obraz wejściowy
+            img: Obraz wejściowy (lub AnalysisContext)
             low_threshold: Dolny próg Canny
             high_threshold: Górny próg Canny
             
         Returns:
             Obraz z krawędziami (binary)
         """
-        # Konwertuj do grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Blur dla redukcji szumu
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        
-        # Canny edge detection
-        edges = cv2.Canny(blurred, low_threshold, high_threshold)
+        ctx = self.context(img)
+        if (low_threshold, high_threshold) == (50, 150):
+            # Domyślne progi - krawędzie współdzielone w kontekście
+            edges = ctx.edges
+        else:
+            blurred = cv2.GaussianBlur(ctx.gray, (5, 5), 0)
+            edges = cv2.Canny(blurred, low_threshold, high_threshold)
         
         if self.debug:
             cv2.imwrite('/app/results/debug_edges.png', edges)
         
         return edges
     
-    def detect_rectangles(self, img: np.ndarray, 
+    def detect_rectangles(self, img, 
                           min_area: int = 1000) -> List[Tuple[int, int, int, int]]:
         """
         Wykryj prostokąty (okna, dialogi, przyciski)
         
         Args:
-            img: Obraz wejściowy
+            img: Obraz wejściowy (lub AnalysisContext)
             min_area: Minimalna powierzchnia prostokąta
             
         Returns:
             Lista prostokątów: [(x, y, width, height), ...]
         """
-        edges = self.detect_edges(img)
-        
-        # Znajdź kontury
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, 
-                                       cv2.CHAIN_APPROX_SIMPLE)
+        ctx = self.context(img)
+        if self.debug:
+            self.detect_edges(ctx)
         
         rectangles = []
-        for contour in contours:
-            # Aproksymuj kontur do prostokąta
-            x, y, w, h = cv2.boundingRect(contour)
+        for (x, y, w, h) in ctx.edge_rects:
             area = w * h
             
             if area >= min_area:
@@ -98,14 +417,14 @@ class CVDetector:
         rectangles.sort(key=lambda r: r[2] * r[3], reverse=True)
         
         if self.debug:
-            debug_img = img.copy()
+            debug_img = ctx.img.copy()
             for (x, y, w, h) in rectangles[:10]:  # Rysuj top 10
                 cv2.rectangle(debug_img, (x, y), (x+w, y+h), (0, 255, 0), 2)
             cv2.imwrite('/app/results/debug_rectangles.png', debug_img)
         
         return rectangles
     
-    def find_window_center(self, img: np.ndarray) -> Optional[Tuple[int, int]]:
+    def find_window_center(self, img) -> Optional[Tuple[int, int]]:
         """
         Znajdź centrum najbardziej widocznego okna
         
@@ -123,7 +442,7 @@ class CVDetector:
         
         return None
     
-    def detect_buttons(self, img: np.ndarray) -> List[Dict]:
+    def detect_buttons(self, img) -> List[Dict]:
         """
         Wykryj przyciski (małe prostokąty z tekstem)
         
@@ -155,24 +474,15 @@ class CVDetector:
         
         return buttons
     
-    def find_text_field(self, img: np.ndarray) -> Optional[Tuple[int, int]]:
+    def find_text_field(self, img) -> Optional[Tuple[int, int]]:
         """
         Znajdź pole tekstowe (input field)
         
         Returns:
             (x, y) centrum pola lub None
         """
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
         # Pola tekstowe często są białe lub jasne
-        _, thresh = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY)
-        
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, 
-                                       cv2.CHAIN_APPROX_SIMPLE)
-        
-        for contour in contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            
+        for (x, y, w, h) in self.context(img).bright_rects:
             # Pole tekstowe: szerokie, niskie
             if w > 100 and 20 < h < 60:
                 aspect_ratio = w / float(h)
@@ -181,11 +491,15 @@ class CVDetector:
         
         return None
     
-    def template_match(self, img: np.ndarray, template_path: str, 
+    def template_match(self, img, template_path: str, 
                        threshold: float = 0.8) -> Optional[Tuple[int, int]]:
         """
         Znajdź lokalizację szablonu na obrazie
         
+        Dopasowanie w kolorze (BGR) w pełnej rozdzielczości, jak dotąd -
+        z biblioteki pochodzi tylko wczytany raz plik szablonu. Szybsze
+        dopasowanie grayscale coarse-to-fine: find_template.
+        
         Args:
             img: Obraz do przeszukania
             template_path: Ścieżka do obrazu szablonu
@@ -195,37 +509,117 @@ class CVDetector:
             (x, y) centrum znalezionego szablonu lub None
         """
         try:
-            template = cv2.imread(template_path)
-            if template is None:
+            try:
+                template = self.templates.get(template_path).color
+            except FileNotFoundError:
                 return None
             
-            # Template matching
-            result = cv2.matchTemplate(img, template, cv2.TM_CCOEFF_NORMED)
-            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-            
-            if max_val >= threshold:
-                # Znaleziono
-                h, w = template.shape[:2]
-                center_x = max_loc[0] + w // 2
-                center_y = max_loc[1] + h // 2
-                return (center_x, center_y)
+            match = self.match_template(self.context(img).img, template, threshold)
+            if match:
+                return match['center']
         
         except Exception as e:
             print(f"Template matching error: {e}")
         
         return None
     
-    def detect_dialog_box(self, img: np.ndarray) -> Optional[Dict]:
+    def find_template(self, img, template_path: str, threshold: float = 0.8,
+                      scales: Sequence[float] = (1.0,)) -> Optional[Dict]:
+        """
+        Znajdź szablon z biblioteki (grayscale, coarse-to-fine)
+        
+        Plik szablonu jest czytany raz i ponownie tylko po zmianie mtime.
+        Klatka jest przeszukiwana na poziomie piramidy 1/2 lub 1/4,
+        a pozycja doprecyzowana w pełnej rozdzielczości.
+        
+        Args:
+            img: Obraz, Frame lub AnalysisContext
+            template_path: Ścieżka do obrazu szablonu
+            threshold: Próg dopasowania (0-1)
+            scales: Skale szablonu (np. [0.8, 1.0, 1.25] gdy UI ma inne DPI)
+            
+        Returns:
+            {'x', 'y', 'width', 'height', 'center', 'score', 'scale'} lub None
+            
+        Raises:
+            FileNotFoundError: Brak pliku szablonu
+        """
+        return self.templates.match(self.context(img), template_path, threshold, scales)
+    
+    def find_templates(self, img, template_paths: Sequence[str], threshold: float = 0.8,
+                       scales: Sequence[float] = (1.0,), max_hits: int = 1,
+                       overlap: float = 0.3) -> List[Dict]:
+        """
+        Znajdź kilka szablonów naraz (np. OK / Unlock / Login / Continue)
+        
+        Jeden przebieg po klatce: gray i piramida liczone raz, szablony
+        dopasowywane równolegle we wspólnej puli wątków, nakładające się
+        trafienia usuwane przez non-max suppression.
+        
+        Args:
+            img: Obraz, Frame lub AnalysisContext
+            template_paths: Ścieżki obrazów szablonów
+            threshold: Próg dopasowania (0-1)
+            scales: Skale szablonów
+            max_hits: Maks. liczba trafień jednego szablonu
+            overlap: Maks. IoU dwóch zachowanych trafień
+            
+        Returns:
+            Lista trafień od najlepszego: {'template', 'x', 'y', 'width',
+            'height', 'center', 'score', 'scale'}
+            
+        Raises:
+            FileNotFoundError: Brak pliku któregoś szablonu
+        """
+        executor = get_cv_pool() if len(template_paths) > 1 else None
+        return self.templates.match_all(self.context(img), template_paths, threshold,
+                                        scales, max_hits, overlap, executor)
+    
+    def match_template(self, img: np.ndarray, template: np.ndarray,
+                       threshold: float = 0.8) -> Optional[Dict]:
+        """
+        Dopasuj wczytany szablon (BGR lub grayscale - jak obraz) do obrazu
+        
+        Returns:
+            {'x', 'y', 'width', 'height', 'center', 'score'} najlepszego
+            dopasowania lub None, jeśli score < threshold
+        """
+        h, w = template.shape[:2]
+        if h > img.shape[0] or w > img.shape[1]:
+            return None
+        
+        result = cv2.matchTemplate(img, template, cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        
+        if not np.isfinite(max_val) or max_val < threshold:
+            return None
+        return {
+            'x': max_loc[0],
+            'y': max_loc[1],
+            'width': w,
+            'height': h,
+            'center': (max_loc[0] + w // 2, max_loc[1] + h // 2),
+            'score': float(max_val)
+        }
+    
+    def detect_dialog_box(self, img) -> Optional[Dict]:
         """
         Wykryj dialog box (okno logowania, alert, etc.)
         
         Returns:
             Słownik z informacjami o dialogu lub None
         """
-        rectangles = self.detect_rectangles(img, min_area=10000)
+        ctx = self.context(img)
+        # find_unlock_button / find_text_field też pytają o dialog - liczony raz na klatkę
+        return ctx._once('_dialog', lambda: (self._find_dialog(ctx),))[0]
+    
+    def _find_dialog(self, ctx: AnalysisContext) -> Optional[Dict]:
+        """Pierwszy prostokąt w centrum ekranu, mniejszy niż 80% ekranu (bez zapamiętywania)"""
+        rectangles = self.detect_rectangles(ctx, min_area=10000)
         
-        height, width = img.shape[:2]
+        height, width = ctx.shape[:2]
         
+        dialog = None
         for (x, y, w, h) in rectangles:
             # Dialog jest zazwyczaj w centrum i nie zajmuje całego ekranu
             center_x = x + w // 2
@@ -237,7 +631,7 @@ class CVDetector:
                 
                 # I nie jest za duży (dialog vs full window)
                 if w < width * 0.8 and h < height * 0.8:
-                    return {
+                    dialog = {
                         'x': x,
                         'y': y,
                         'width': w,
@@ -245,27 +639,28 @@ class CVDetector:
                         'center': (center_x, center_y),
                         'area': w * h
                     }
+                    break
         
-        return None
+        return dialog
     
-    def find_unlock_button(self, img: np.ndarray) -> Optional[Tuple[int, int]]:
+    def find_unlock_button(self, img) -> Optional[Tuple[int, int]]:
         """
         Znajdź przycisk Unlock/Login/OK w dialogu
         
         Returns:
             (x, y) centrum przycisku lub None
         """
-        dialog = self.detect_dialog_box(img)
+        ctx = self.context(img)
+        dialog = self.detect_dialog_box(ctx)
         if not dialog:
             return None
         
         # Szukaj przycisków w obszarze dialogu
         dx, dy, dw, dh = dialog['x'], dialog['y'], dialog['width'], dialog['height']
         
-        # Wytnij obszar dialogu
-        dialog_img = img[dy:dy+dh, dx:dx+dw]
-        
-        buttons = self.detect_buttons(dialog_img)
+        # Wytnij obszar dialogu - obraz i gray bez kopiowania, krawędzie liczone od nowa
+        # na wycinku (ramka dialogu nie może zasłonić konturów przycisków)
+        buttons = self.detect_buttons(ctx.crop(dx, dy, dw, dh))
         
         if buttons:
             # Weź dolny prawy przycisk (zazwyczaj OK/Unlock)
@@ -279,28 +674,29 @@ class CVDetector:
         
         return None
     
-    def is_screen_blank(self, img: np.ndarray, threshold: int = 30) -> bool:
+    def is_screen_blank(self, img, threshold: int = 30) -> bool:
         """
         Sprawdź czy ekran jest pusty/czarny/zablokowany
         
         Args:
-            img: Obraz wejściowy
+            img: Obraz wejściowy (lub AnalysisContext)
             threshold: Próg jasności (0-255)
             
         Returns:
             True jeśli ekran jest prawie całkowicie czarny
         """
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        mean_brightness = np.mean(gray)
+        # Statystyki globalne - wystarczy obraz w skali analizy
+        gray = self.context(img).small_gray
+        mean_brightness = cv2.mean(gray)[0]
         
         # Sprawdź czy większość pikseli jest ciemna
-        dark_pixels = np.sum(gray < threshold)
+        dark_pixels = np.count_nonzero(gray < threshold)
         total_pixels = gray.size
         dark_ratio = dark_pixels / total_pixels
         
         return mean_brightness < threshold and dark_ratio > 0.9
     
-    def get_screen_diagnostics(self, img: np.ndarray) -> Dict:
+    def get_screen_diagnostics(self, img) -> Dict:
         """
         Diagnostyka ekranu - co może być nie tak?
         
@@ -314,18 +710,19 @@ class CVDetector:
             'edge_count': 0,
             'possible_issue': None
         }
+        ctx = self.context(img)
         
         # Sprawdź jasność
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        mean_brightness = np.mean(gray)
+        mean_brightness = cv2.mean(ctx.small_gray)[0]
         diagnostics['mean_brightness'] = float(mean_brightness)
         
         # Sprawdź czy ekran jest pusty
-        diagnostics['is_blank'] = self.is_screen_blank(img)
+        diagnostics['is_blank'] = self.is_screen_blank(ctx)
         
         # Policz krawędzie (content detection)
-        edges = self.detect_edges(img)
-        edge_count = np.sum(edges > 0)
+        if self.debug:
+            self.detect_edges(ctx)
+        edge_count = ctx.edge_count()
         diagnostics['edge_count'] = int(edge_count)
         
         # Określ czy jest content
@@ -345,13 +742,28 @@ class CVDetector:
         
         return diagnostics
     
-    def quick_analysis(self, img: np.ndarray) -> Dict:
+    def quick_analysis(self, img, parallel: Optional[bool] = None) -> Dict:
         """
         Szybka analiza obrazu (milisekundy!)
         
+        Jeden przebieg: gray, krawędzie i kontury są liczone raz
+        (AnalysisContext), a każdy detektor filtruje wspólne wyniki.
+        
+        Args:
+            img: Obraz, Frame lub AnalysisContext
+            parallel: Detektory równolegle we wspólnej puli wątków
+                (None = ustawienie detektora)
+        
         Returns:
             Słownik z wynikami detekcji
         """
+        ctx = self.context(img)
+        parallel = self.parallel if parallel is None else parallel
+        if parallel and CV_WORKERS > 1 and not self.debug and not in_cv_pool():
+            found = self._run_parallel(ctx)
+        else:
+            found = {name: detector(ctx) for name, detector in self._quick_detectors()}
+        
         results = {
             'has_dialog': False,
             'dialog_center': None,
@@ -365,36 +777,63 @@ class CVDetector:
         }
         
         # Dodaj diagnostykę
-        results['diagnostics'] = self.get_screen_diagnostics(img)
+        results['diagnostics'] = found['diagnostics']
         
         # Wykryj dialog
-        dialog = self.detect_dialog_box(img)
+        dialog = found['dialog']
         if dialog:
             results['has_dialog'] = True
             results['dialog_center'] = dialog['center']
         
         # Wykryj przyciski
-        buttons = self.detect_buttons(img)
+        buttons = found['buttons']
         if buttons:
             results['has_buttons'] = True
             results['button_positions'] = [b['center'] for b in buttons]
         
         # Wykryj pole tekstowe
-        text_field = self.find_text_field(img)
+        text_field = found['text_field']
         if text_field:
             results['has_text_field'] = True
             results['text_field_position'] = text_field
         
         # Policz okna
-        rectangles = self.detect_rectangles(img, min_area=5000)
-        results['window_count'] = len(rectangles)
+        results['window_count'] = len(found['windows'])
         
         # Znajdź przycisk Unlock
-        unlock_btn = self.find_unlock_button(img)
+        unlock_btn = found['unlock']
         if unlock_btn:
             results['unlock_button'] = unlock_btn
         
         return results
+    
+    def _quick_detectors(self) -> List[Tuple[str, object]]:
+        """Detektory quick_analysis: (nazwa wyniku, funkcja kontekstu)"""
+        return [
+            ('diagnostics', self.get_screen_diagnostics),
+            ('dialog', self.detect_dialog_box),
+            ('buttons', self.detect_buttons),
+            ('text_field', self.find_text_field),
+            ('windows', lambda ctx: self.detect_rectangles(ctx, min_area=5000)),
+            ('unlock', self.find_unlock_button),
+        ]
+    
+    def _run_parallel(self, ctx: AnalysisContext) -> Dict:
+        """
+        Detektory quick_analysis we wspólnej puli wątków
+        
+        Pole tekstowe (maska jasności) startuje od razu; krawędzie liczy
+        wątek wywołujący (na dużych ekranach pasami w tej samej puli),
+        a dopiero potem startują detektory, które z nich korzystają -
+        żaden wątek puli nie czeka na inne zadania puli.
+        """
+        pool = get_cv_pool()
+        detectors = dict(self._quick_detectors())
+        futures = {'text_field': pool.submit(detectors.pop('text_field'), ctx)}
+        ctx.small_edges  # krawędzie przed detektorami, które na nie czekają
+        for name, detector in detectors.items():
+            futures[name] = pool.submit(detector, ctx)
+        return {name: future.result() for name, future in futures.items()}
 
 
 # Przykład użycia
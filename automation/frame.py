@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Frame - jedna klatka ekranu współdzielona przez wszystkich konsumentów
+Jeden bufor pikseli RGB + leniwie liczone (i zapamiętane) widoki PIL/BGR/gray
+"""
+
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+THUMBNAIL_SCALE = 4  # miniatura do porównywania klatek: 1/4 szerokości i wysokości
+
+
+class Frame:
+    """
+    Klatka ekranu z jednym buforem pikseli
+
+    Bufor RGB (numpy, HxWx3, uint8) jest tylko do odczytu - klatka może
+    trafić jednocześnie do silnika, CVDetector, nagrywania i live monitora.
+    Widoki BGR, grayscale i PIL są liczone przy pierwszym użyciu i
+    zapamiętywane, więc każda konwersja odbywa się co najwyżej raz
+    niezależnie od liczby konsumentów. Kto chce rysować po klatce,
+    musi najpierw zrobić kopię (np. frame.bgr.copy()).
+    """
+
+    def __init__(self, rgb: np.ndarray, info: Optional[Dict] = None):
+        """
+        Args:
+            rgb: Piksele RGB (H, W, 3) uint8
+            info: Metadane klatki (frame_sequence, region, ...)
+        """
+        self._rgb = _readonly(rgb)
+        self.info: Dict = dict(info or {})
+
+        self._pil: Optional[Image.Image] = None
+        self._bgr: Optional[np.ndarray] = None
+        self._gray: Optional[np.ndarray] = None
+        self._thumbnail: Optional[np.ndarray] = None
+        self._digest: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_pil(cls, image: Image.Image, info: Optional[Dict] = None) -> 'Frame':
+        """Klatka z obrazu PIL (obraz PIL zostaje zapamiętany jako widok)"""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        frame = cls(np.asarray(image), {**image.info, **(info or {})})
+        frame._pil = image
+        return frame
+
+    @classmethod
+    def from_bgr(cls, bgr: np.ndarray, info: Optional[Dict] = None) -> 'Frame':
+        """Klatka z obrazu OpenCV (BGR)"""
+        frame = cls(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), info)
+        frame._bgr = _readonly(bgr)
+        return frame
+
+    @property
+    def rgb(self) -> np.ndarray:
+        """Bufor RGB (H, W, 3) - bez kopiowania"""
+        return self._rgb
+
+    @property
+    def bgr(self) -> np.ndarray:
+        """Widok BGR dla OpenCV (liczony raz)"""
+        if self._bgr is None:
+            with self._lock:
+                if self._bgr is None:
+                    self._bgr = _readonly(cv2.cvtColor(self._rgb, cv2.COLOR_RGB2BGR))
+        return self._bgr
+
+    @property
+    def gray(self) -> np.ndarray:
+        """Widok grayscale (liczony raz)"""
+        if self._gray is None:
+            with self._lock:
+                if self._gray is None:
+                    self._gray = _readonly(cv2.cvtColor(self._rgb, cv2.COLOR_RGB2GRAY))
+        return self._gray
+
+    @property
+    def pil(self) -> Image.Image:
+        """Obraz PIL (tworzony raz, z kopią metadanych w image.info)"""
+        if self._pil is None:
+            with self._lock:
+                if self._pil is None:
+                    image = Image.fromarray(self._rgb, 'RGB')
+                    image.info.update(self.info)
+                    self._pil = image
+        return self._pil
+
+    @property
+    def thumbnail(self) -> np.ndarray:
+        """Pomniejszony (1/THUMBNAIL_SCALE) obraz grayscale do szybkiego porównywania klatek"""
+        if self._thumbnail is None:
+            width = max(1, self.width // THUMBNAIL_SCALE)
+            height = max(1, self.height // THUMBNAIL_SCALE)
+            thumbnail = cv2.resize(self.gray, (width, height), interpolation=cv2.INTER_AREA)
+            with self._lock:
+                self._thumbnail = _readonly(thumbnail)
+        return self._thumbnail
+
+    def digest(self) -> str:
+        """Dokładny hash pikseli (blake2b) - identyczne klatki mają identyczny hash"""
+        if self._digest is None:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(f"{self.width}x{self.height}".encode())
+            h.update(np.ascontiguousarray(self._rgb).data)
+            self._digest = h.hexdigest()
+        return self._digest
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """Rozmiar (width, height) - jak PIL.Image.size"""
+        return (self._rgb.shape[1], self._rgb.shape[0])
+
+    @property
+    def width(self) -> int:
+        return self._rgb.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self._rgb.shape[0]
+
+    def crop(self, x: int, y: int, width: int, height: int) -> 'Frame':
+        """
+        Fragment klatki (x, y, w, h) jako nowa klatka
+
+        Piksele nie są kopiowane (widok numpy), a już policzone widoki
+        BGR/gray są przycinane zamiast liczone od nowa. Obszar jest
+        zapisywany w info['region'] we współrzędnych całego ekranu.
+        """
+        offset_x, offset_y = self.info.get('region', (0, 0, 0, 0))[:2]
+        frame = Frame(self._rgb[y:y + height, x:x + width], self.info)
+        frame.info['region'] = (offset_x + x, offset_y + y, frame.width, frame.height)
+        if self._bgr is not None:
+            frame._bgr = self._bgr[y:y + height, x:x + width]
+        if self._gray is not None:
+            frame._gray = self._gray[y:y + height, x:x + width]
+        return frame
+
+
+def frame_difference(a: Frame, b: Frame, pixel_threshold: int = 12) -> float:
+    """
+    Ułamek pikseli miniatury, które różnią się między klatkami
+
+    Args:
+        a, b: Porównywane klatki (ten sam obszar ekranu)
+        pixel_threshold: Minimalna różnica jasności (0-255) liczona jako zmiana
+
+    Returns:
+        0.0 (identyczne) ... 1.0 (wszystko się zmieniło)
+    """
+    if a.size != b.size:
+        return 1.0
+    diff = cv2.absdiff(a.thumbnail, b.thumbnail)
+    return float(np.count_nonzero(diff > pixel_threshold)) / diff.size
+
+
+def _readonly(array: np.ndarray) -> np.ndarray:
+    """Widok tylko do odczytu - bufor jest współdzielony między konsumentami"""
+    if not array.flags.writeable:
+        return array
+    view = array.view()
+    view.setflags(write=False)
+    return view
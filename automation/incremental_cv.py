@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Incremental CV - detekcja przeliczana tylko w zmienionych kafelkach
+Krawędzie, maski i kontury poprzedniej klatki są poprawiane tam, gdzie zmieniły się piksele
+"""
+
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from cv_detection import AnalysisContext, CVDetector, canny_edges, frame_edges
+from frame import Frame
+
+Rect = Tuple[int, int, int, int]
+ContourItem = Tuple[Tuple[int, int], Rect]  # ((y, x) pierwszego punktu konturu, prostokąt)
+
+TILE_SIZE = 32               # kafelek porównywania klatek (px)
+EDGE_MARGIN = 4              # zmiana piksela zmienia krawędzie w promieniu ~4 px (blur 5x5, Sobel, NMS)
+CANNY_CONTEXT = 8            # dodatkowy kontekst wokół przeliczanego fragmentu (brzegi blur/Canny)
+MAX_GROW_STEPS = 8           # ile razy obszar może urosnąć przez histerezę, zanim pełne przeliczenie
+MAX_CHANGED_FRACTION = 0.3   # powyżej tego ułamka zmienionych kafelków - pełne przeliczenie
+MAX_STREAMS = 4              # ile niezależnych obszarów (region kroku) pamiętać naraz
+
+
+class IncrementalDetector:
+    """
+    Detekcja CV kosztująca tyle, ile zmieniło się na ekranie
+
+    Dla każdego obszaru (pełny ekran lub `region` kroku) pamiętany jest
+    stan poprzedniej klatki: gray, krawędzie Canny, maska jasnych obszarów
+    i listy konturów. Nowa klatka jest porównywana kafelkami TILE_SIZE;
+    w zmienionych kafelkach krawędzie i maska są liczone od nowa, a kontury
+    tylko w obszarach, których dotyczy zmiana (razem z konturami, które je
+    przecinają). Pozostałe kontury przechodzą z poprzedniej klatki bez
+    zmian, w tej samej kolejności co w cv2.findContours - detektory
+    CVDetector dają więc te same wyniki co przy pełnym przeliczeniu.
+
+    Migający kursor czy spinner to kilka kafelków zamiast całego ekranu.
+    """
+
+    def __init__(self, detector: Optional[CVDetector] = None, tile_size: int = TILE_SIZE,
+                 max_changed_fraction: float = MAX_CHANGED_FRACTION):
+        """
+        Args:
+            detector: CVDetector uruchamiany na przygotowanym kontekście
+            tile_size: Rozmiar kafelka porównywania klatek
+            max_changed_fraction: Ułamek zmienionych kafelków, od którego
+                pełne przeliczenie jest tańsze
+        """
+        self.detector = detector or CVDetector()
+        self.tile_size = tile_size
+        self.max_changed_fraction = max_changed_fraction
+        self._streams: 'OrderedDict[tuple, Dict]' = OrderedDict()
+        self.last_update: Dict = {}
+        self.stats = {'full': 0, 'incremental': 0, 'unchanged': 0, 'changed_tiles': 0, 'tiles': 0}
+
+    def reset(self):
+        """Zapomnij poprzednie klatki (następna analiza będzie pełna)"""
+        self._streams.clear()
+
+    def quick_analysis(self, img) -> Dict:
+        """CVDetector.quick_analysis na kontekście przygotowanym przyrostowo"""
+        return self.detector.quick_analysis(self.context(img))
+
+    def context(self, img) -> AnalysisContext:
+        """
+        AnalysisContext klatki z krawędziami i konturami poprawionymi tylko w zmienionych kafelkach
+
+        Args:
+            img: Frame (zalecane - region z info['region'] rozróżnia obszary)
+                 lub obraz BGR
+        """
+        if isinstance(img, Frame):
+            bgr, gray = img.bgr, img.gray
+            region = img.info.get('region')
+        else:
+            bgr = img.img if isinstance(img, AnalysisContext) else img
+            gray = img.gray if isinstance(img, AnalysisContext) else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            region = None
+        key = (tuple(region) if region else None, gray.shape)
+
+        state = self._streams.get(key)
+        if state is not None:
+            self._streams.move_to_end(key)
+            if isinstance(img, Frame) and state['source'] is img:  # ta sama (niezmienna) klatka
+                return self._report(state, 'unchanged', 0)
+            changed = self._changed_tiles(gray, state['gray'])
+            count = int(np.count_nonzero(changed))
+            if count == 0:
+                state['source'] = img
+                state['context'] = AnalysisContext(bgr, gray, state['edges'], state['bright'],
+                                                   state['context'].edge_rects, state['context'].bright_rects)
+                return self._report(state, 'unchanged', 0)
+            if count <= changed.size * self.max_changed_fraction and self._update(state, img, bgr, gray, changed):
+                return self._report(state, 'incremental', count)
+
+        state = self._full(img, bgr, gray)
+        self._streams[key] = state
+        self._streams.move_to_end(key)
+        while len(self._streams) > MAX_STREAMS:
+            self._streams.popitem(last=False)
+        return self._report(state, 'full', None)
+
+    # ===== Pełne i przyrostowe przeliczenie =====
+
+    def _full(self, source, bgr: np.ndarray, gray: np.ndarray) -> Dict:
+        edges = frame_edges(gray)
+        _, bright = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY)
+        state = {
+            'source': source,
+            'gray': gray,
+            'edges': edges,
+            'bright': bright,
+            'edge_items': contour_items(edges),
+            'bright_items': contour_items(bright),
+        }
+        state['context'] = self._make_context(state, bgr)
+        return state
+
+    def _update(self, state: Dict, source, bgr: np.ndarray, gray: np.ndarray, changed: np.ndarray) -> bool:
+        """
+        Popraw stan tylko w zmienionych kafelkach
+
+        Returns:
+            False jeśli zmiana rozlała się za szeroko (trzeba pełnego przeliczenia)
+        """
+        height, width = gray.shape[:2]
+        runs = _tile_runs(changed, self.tile_size, width, height)
+
+        # Krawędzie: zmiana piksela działa w promieniu EDGE_MARGIN (+ histereza, patrz _update_edges)
+        edge_update = _update_edges(gray, state['edges'], [_grow(run, EDGE_MARGIN) for run in runs])
+        if edge_update is None:
+            return False
+        edges, edge_dirty = edge_update
+        # Kontury: obszary zmienionych krawędzi + kontury, które ich dotykają
+        edge_regions, edge_kept = expand_regions(state['edge_items'], edge_dirty, width, height)
+
+        # Kopia - poprzednia maska może być jeszcze używana przez wcześniejszy kontekst
+        bright = state['bright'].copy()
+
+        # Maska jasności zależy tylko od piksela - wystarczą zmienione kafelki
+        for (x, y, w, h) in runs:
+            _, bright[y:y + h, x:x + w] = cv2.threshold(gray[y:y + h, x:x + w], 200, 255, cv2.THRESH_BINARY)
+        bright_regions, bright_kept = expand_regions(state['bright_items'], runs, width, height)
+
+        state.update({
+            'source': source,
+            'gray': gray,
+            'edges': edges,
+            'bright': bright,
+            'edge_items': recount_contours(edges, edge_kept, edge_regions),
+            'bright_items': recount_contours(bright, bright_kept, bright_regions),
+        })
+        state['context'] = self._make_context(state, bgr)
+        return True
+
+    @staticmethod
+    def _make_context(state: Dict, bgr: np.ndarray) -> AnalysisContext:
+        return AnalysisContext(
+            bgr, state['gray'], state['edges'], state['bright'],
+            [rect for _, rect in state['edge_items']],
+            [rect for _, rect in state['bright_items']]
+        )
+
+    def _changed_tiles(self, gray: np.ndarray, previous: np.ndarray) -> np.ndarray:
+        """Macierz (wiersze x kolumny kafelków) - True gdzie zmienił się choć jeden piksel"""
+        tile = self.tile_size
+        height, width = gray.shape[:2]
+        changed = np.zeros((-(-height // tile), -(-width // tile)), dtype=bool)
+
+        diff = cv2.absdiff(gray, previous)
+        x, y, w, h = cv2.boundingRect(diff)  # prostokąt niezerowych pikseli - zwykle mały
+        if w == 0 or h == 0:
+            return changed
+
+        # Tylko kafelki w obrębie zmian
+        r1, r2 = y // tile, (y + h - 1) // tile + 1
+        c1, c2 = x // tile, (x + w - 1) // tile + 1
+        block = diff[r1 * tile:r2 * tile, c1 * tile:c2 * tile]
+        rows = np.arange(0, block.shape[0], tile)
+        cols = np.arange(0, block.shape[1], tile)
+        changed[r1:r2, c1:c2] = np.maximum.reduceat(np.maximum.reduceat(block, rows, axis=0), cols, axis=1) > 0
+        return changed
+
+    def _report(self, state: Dict, mode: str, changed_tiles: Optional[int]) -> AnalysisContext:
+        height, width = state['gray'].shape[:2]
+        tiles = -(-height // self.tile_size) * -(-width // self.tile_size)
+        self.stats[mode] += 1
+        self.stats['tiles'] += tiles
+        self.stats['changed_tiles'] += tiles if changed_tiles is None else changed_tiles
+        self.last_update = {'mode': mode, 'changed_tiles': changed_tiles, 'tiles': tiles}
+        return state['context']
+
+
+def contour_items(binary: np.ndarray, offset_x: int = 0, offset_y: int = 0) -> List[ContourItem]:
+    """Zewnętrzne kontury jako ((y, x) pierwszego punktu, prostokąt) - w kolejności cv2.findContours"""
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    items = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        first_x, first_y = contour[0][0]
+        items.append(((int(first_y) + offset_y, int(first_x) + offset_x), (x + offset_x, y + offset_y, w, h)))
+    return items
+
+
+def _update_edges(gray: np.ndarray, previous: np.ndarray,
+                  dirty: List[Rect]) -> Optional[Tuple[np.ndarray, List[Rect]]]:
+    """
+    Przelicz krawędzie Canny w obszarach zmian
+
+    Histereza może włączyć słabe krawędzie poza obszarem (nowa silna
+    krawędź podtrzymuje łańcuch, który wcześniej nie był krawędzią).
+    Dlatego pas o szerokości CANNY_CONTEXT - EDGE_MARGIN wokół obszaru
+    jest porównywany z poprzednią mapą - każda różnica powiększa obszar
+    i obliczenia są powtarzane.
+
+    Returns:
+        (krawędzie, przeliczone obszary) lub None, gdy obszar rósł więcej
+        niż MAX_GROW_STEPS razy
+    """
+    height, width = gray.shape[:2]
+    band = CANNY_CONTEXT - EDGE_MARGIN
+    for _ in range(MAX_GROW_STEPS):
+        regions = _merge_rects(dirty, width, height)
+        patches = []
+        grown = []
+        for (x, y, w, h) in regions:
+            cx1, cy1 = max(0, x - CANNY_CONTEXT), max(0, y - CANNY_CONTEXT)
+            cx2, cy2 = min(width, x + w + CANNY_CONTEXT), min(height, y + h + CANNY_CONTEXT)
+            patch = canny_edges(gray[cy1:cy2, cx1:cx2])
+            patches.append((patch, cx1, cy1))
+
+            bx1, by1 = max(0, x - band), max(0, y - band)
+            bx2, by2 = min(width, x + w + band), min(height, y + h + band)
+            diff = patch[by1 - cy1:by2 - cy1, bx1 - cx1:bx2 - cx1] != previous[by1:by2, bx1:bx2]
+            diff[y - by1:y - by1 + h, x - bx1:x - bx1 + w] = False  # sam obszar może się różnić
+            if diff.any():
+                ys, xs = np.nonzero(diff)
+                grown.append(_grow((bx1 + int(xs.min()), by1 + int(ys.min()),
+                                    int(xs.max() - xs.min()) + 1, int(ys.max() - ys.min()) + 1), EDGE_MARGIN))
+
+        if not grown:
+            # Kopia - poprzednia mapa może być jeszcze używana przez wcześniejszy kontekst
+            edges = previous.copy()
+            for (x, y, w, h), (patch, cx1, cy1) in zip(regions, patches):
+                edges[y:y + h, x:x + w] = patch[y - cy1:y - cy1 + h, x - cx1:x - cx1 + w]
+            return edges, regions
+        dirty = regions + grown
+    return None
+
+
+def expand_regions(items: List[ContourItem], dirty: List[Rect],
+                   width: int, height: int) -> Tuple[List[Rect], List[ContourItem]]:
+    """
+    Obszary do przeliczenia: zmiany powiększone o kontury, które ich dotykają
+
+    Powiększanie trwa aż do ustalenia - wtedy każdy kontur poprzedniej
+    klatki leży w całości w którymś obszarze albo w ogóle go nie dotyka,
+    więc findContours na wycinku obszaru daje te same kontury co na
+    całym obrazie.
+
+    Returns:
+        (obszary, kontury spoza obszarów - przechodzą bez zmian)
+    """
+    regions = [_clip(_grow(rect, 1), width, height) for rect in dirty]
+    absorbed = [False] * len(items)
+
+    changed = True
+    while changed:
+        changed = False
+        regions = _merge_rects(regions, width, height)
+        for i, (_, rect) in enumerate(items):
+            if absorbed[i]:
+                continue
+            touching = _grow(rect, 1)
+            for j, region in enumerate(regions):
+                if _intersects(touching, region):
+                    regions[j] = _union(region, rect)
+                    absorbed[i] = True
+                    changed = True
+                    break
+
+    kept = [item for item, gone in zip(items, absorbed) if not gone]
+    return regions, kept
+
+
+def recount_contours(binary: np.ndarray, kept: List[ContourItem], regions: List[Rect]) -> List[ContourItem]:
+    """
+    Kontury spoza obszarów + kontury policzone na wycinkach obszarów
+
+    cv2.findContours zwraca kontury malejąco po (y, x) pierwszego punktu,
+    więc po sortowaniu kolejność jest taka sama jak przy pełnym przeliczeniu.
+    """
+    result = list(kept)
+    for (x, y, w, h) in regions:
+        result.extend(contour_items(binary[y:y + h, x:x + w], x, y))
+    result.sort(key=lambda item: item[0], reverse=True)
+    return result
+
+
+def _tile_runs(changed: np.ndarray, tile: int, width: int, height: int) -> List[Rect]:
+    """Zmienione kafelki połączone w poziome odcinki (x, y, w, h)"""
+    runs = []
+    for row in range(changed.shape[0]):
+        cols = np.flatnonzero(changed[row])
+        if cols.size == 0:
+            continue
+        starts = [cols[0]]
+        ends = []
+        for prev, col in zip(cols[:-1], cols[1:]):
+            if col != prev + 1:
+                ends.append(prev)
+                starts.append(col)
+        ends.append(cols[-1])
+        y = row * tile
+        h = min(height, y + tile) - y
+        for start, end in zip(starts, ends):
+            x = int(start) * tile
+            runs.append((x, y, min(width, (int(end) + 1) * tile) - x, h))
+    return runs
+
+
+def _grow(rect: Rect, margin: int) -> Rect:
+    return (rect[0] - margin, rect[1] - margin, rect[2] + 2 * margin, rect[3] + 2 * margin)
+
+
+def _clip(rect: Rect, width: int, height: int) -> Rect:
+    x1, y1 = max(0, rect[0]), max(0, rect[1])
+    x2, y2 = min(width, rect[0] + rect[2]), min(height, rect[1] + rect[3])
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+def _intersects(a: Rect, b: Rect) -> bool:
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+def _union(a: Rect, b: Rect) -> Rect:
+    x1, y1 = min(a[0], b[0]), min(a[1], b[1])
+    x2, y2 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+def _merge_rects(rects: List[Rect], width: int, height: int) -> List[Rect]:
+    """Scal nachodzące/stykające się prostokąty (wycinek nie może przeciąć konturu)"""
+    merged = [_clip(rect, width, height) for rect in rects]
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        for rect in merged:
+            for i, other in enumerate(result):
+                if _intersects(_grow(rect, 1), other):
+                    result[i] = _union(other, rect)
+                    changed = True
+                    break
+            else:
+                result.append(rect)
+        merged = result
+    return merged
@@ -21,7 +21,8 @@ import traceback
 sys.path.insert(0, str(Path(__file__).parent))
 
 try:
-    from remote_automation import RemoteController, OllamaVision, AutomationEngine
+    from remote_automation import RemoteController, OllamaVision, AutomationEngine, DEFAULT_MAX_EDGE
+    from capture_broker import CaptureBroker
     REMOTE_AVAILABLE = True
 except ImportError:
     REMOTE_AVAILABLE = False
@@ -35,7 +36,10 @@ current_step = 0
 scenario_steps = []
 scenario_config = {}  # Connection + ollama config
 live_controller = None
+live_broker = None  # CaptureBroker shared by the live preview and the engine
+live_subscription = None
 live_screenshot = None
+live_screenshot_sequence = 0  # numer klatki framebuffera dla live_screenshot
 screenshot_lock = Lock()
 monitoring_active = False
 automation_engine = None
@@ -72,14 +76,16 @@ def load_scenario(yaml_path: str, scenario_name: str):
         scenario_steps = data['scenarios'][scenario_name]
         scenario_config = {
             'connection': data.get('connection', {}),
-            'ollama': data.get('ollama', {})
+            'ollama': data.get('ollama', {}),
+            'settle': data.get('settle', True),
+            'cv': data.get('cv', {})
         }
         return True
     return False
 
-def capture_vnc_screenshot():
-    """Capture screenshot from VNC"""
-    global live_controller, live_screenshot, screenshot_lock
+def capture_vnc_screenshot(screen=None):
+    """Capture screenshot from VNC (or encode a frame already received from the broker)"""
+    global live_controller, live_screenshot, live_screenshot_sequence, screenshot_lock
     
     if not REMOTE_AVAILABLE:
         print("[Monitor] Cannot capture screenshot: REMOTE_AVAILABLE=False")
@@ -90,23 +96,37 @@ def capture_vnc_screenshot():
         return None
     
     try:
-        print("[Monitor] Capturing screenshot...")
-        screen = live_controller.capture_screen()
+        if screen is None:
+            # Ekran się nie zmienił - nie kodujemy ponownie tego samego JPEG
+            if live_screenshot and not live_controller.has_changed_since(live_screenshot_sequence):
+                return live_screenshot
+            
+            print("[Monitor] Capturing screenshot...")
+            if live_broker:
+                screen = live_broker.get_frame()
+            else:
+                screen = live_controller.capture_frame()
         
         if screen is None:
             print("[Monitor] Screenshot capture returned None")
             return None
         
-        # Convert PIL to bytes for streaming
-        img_io = io.BytesIO()
-        screen.save(img_io, 'JPEG', quality=85)
-        img_io.seek(0)
+        sequence = screen.info.get('frame_sequence', 0)
+        if live_screenshot and sequence and sequence == live_screenshot_sequence:
+            return live_screenshot
+        
+        # Convert to JPEG bytes for streaming
+        ok, jpeg = cv2.imencode('.jpg', screen.bgr, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if not ok:
+            print("[Monitor] JPEG encoding failed")
+            return None
         
-        screenshot_data = img_io.getvalue()
+        screenshot_data = jpeg.tobytes()
         print(f"[Monitor] Screenshot captured successfully ({len(screenshot_data)} bytes)")
         
         with screenshot_lock:
             live_screenshot = screenshot_data
+            live_screenshot_sequence = sequence
         
         return live_screenshot
     except Exception as e:
@@ -120,6 +140,12 @@ def screenshot_worker():
     
     while monitoring_active:
         if live_controller and live_controller.connection:
+            if live_subscription:
+                # Latest broker frame (subscription is capped at 1 FPS)
+                screen = live_subscription.get(timeout=2)
+                if screen is not None:
+                    capture_vnc_screenshot(screen)
+                continue
             capture_vnc_screenshot()
         time.sleep(1)  # 1 FPS
 
@@ -182,7 +208,7 @@ def get_steps():
 @app.route('/api/connect')
 def connect_vnc():
     """Connect to VNC"""
-    global live_controller, monitoring_active
+    global live_controller, live_broker, live_subscription, monitoring_active
     
     if not REMOTE_AVAILABLE:
         add_log('error', 'Remote automation not available')
@@ -198,6 +224,11 @@ def connect_vnc():
         )
         live_controller.connect()
         
+        # One capture producer shared by the preview and the automation engine
+        live_broker = CaptureBroker(live_controller, fps=2)
+        live_subscription = live_broker.subscribe('live_preview', max_fps=1)
+        live_broker.start()
+        
         # Start screenshot worker
         monitoring_active = True
         thread = Thread(target=screenshot_worker, daemon=True)
@@ -213,11 +244,16 @@ def connect_vnc():
 @app.route('/api/disconnect')
 def disconnect_vnc():
     """Disconnect from VNC"""
-    global live_controller, monitoring_active
+    global live_controller, live_broker, live_subscription, monitoring_active
     
     add_log('info', 'Disconnecting from VNC...')
     monitoring_active = False
     
+    if live_broker:
+        live_broker.stop()
+        live_broker = None
+        live_subscription = None
+    
     if live_controller:
         try:
             live_controller.disconnect()
@@ -343,9 +379,15 @@ def execute_step(step_index):
                 ollama_config = scenario_config.get('ollama', {})
                 vision = OllamaVision(
                     base_url=ollama_config.get('url', 'http://ollama:11434'),
-                    model=ollama_config.get('model', 'llava:7b')
+                    model=ollama_config.get('model', 'llava:7b'),
+                    image_format=ollama_config.get('image_format', 'png'),
+                    image_quality=ollama_config.get('image_quality', 90),
+                    max_edge=ollama_config.get('max_edge', DEFAULT_MAX_EDGE)
                 )
-                automation_engine = AutomationEngine(live_controller, vision, enable_recording=False)
+                automation_engine = AutomationEngine(live_controller, vision, enable_recording=False, capture_broker=live_broker,
+                                                     settle=scenario_config.get('settle', True),
+                                                     cv_analysis_scale=scenario_config.get('cv', {}).get('analysis_scale', 1.0),
+                                                     cv_parallel=scenario_config.get('cv', {}).get('parallel', False))
                 add_log('success', 'Automation engine initialized')
             except Exception as e:
                 add_log('error', f'Failed to initialize engine: {str(e)}')
@@ -429,9 +471,15 @@ def execute_all():
                 ollama_config = scenario_config.get('ollama', {})
                 vision = OllamaVision(
                     base_url=ollama_config.get('url', 'http://ollama:11434'),
-                    model=ollama_config.get('model', 'llava:7b')
+                    model=ollama_config.get('model', 'llava:7b'),
+                    image_format=ollama_config.get('image_format', 'png'),
+                    image_quality=ollama_config.get('image_quality', 90),
+                    max_edge=ollama_config.get('max_edge', DEFAULT_MAX_EDGE)
                 )
-                automation_engine = AutomationEngine(live_controller, vision, enable_recording=False)
+                automation_engine = AutomationEngine(live_controller, vision, enable_recording=False, capture_broker=live_broker,
+                                                     settle=scenario_config.get('settle', True),
+                                                     cv_analysis_scale=scenario_config.get('cv', {}).get('analysis_scale', 1.0),
+                                                     cv_parallel=scenario_config.get('cv', {}).get('parallel', False))
                 add_log('success', 'Automation engine initialized')
             
             # Execute all steps
@@ -9,6 +9,7 @@ import io
 import time
 import json
 import requests
+from requests.adapters import HTTPAdapter
 import sys
 import os
 import threading
@@ -28,11 +29,22 @@ import re
 # Import CV Detection module
 try:
     from cv_detection import CVDetector
+    from incremental_cv import IncrementalDetector
     CV_AVAILABLE = True
 except ImportError:
     CV_AVAILABLE = False
     print("⚠️  cv_detection not available")
 
+from capture_broker import CaptureBroker
+from frame import Frame, frame_difference
+from vision_cache import VisionCache, image_digest, MISS
+from smart_locator import SmartLocator
+
+# Lokalna kopia framebuffera VNC (aktualizacje przyrostowe)
+from vnc_framebuffer import rects_intersect, VNCDOTOOL_AVAILABLE as FRAMEBUFFER_MIRROR_AVAILABLE
+if FRAMEBUFFER_MIRROR_AVAILABLE:
+    from vnc_framebuffer import MirroringVNCFactory
+
 # Try to import pynput, but don't fail if it's not available
 try:
     from pynput.mouse import Button, Controller as MouseController
@@ -41,59 +53,438 @@ try:
 except ImportError:
     PYNPUT_AVAILABLE = False
 
+def _clamp_region(region: tuple, size: tuple) -> tuple:
+    """Przycina obszar (x, y, w, h) do granic ekranu o rozmiarze (width, height)"""
+    x, y, w, h = region
+    width, height = size
+    x = max(0, min(int(x), width - 1))
+    y = max(0, min(int(y), height - 1))
+    w = max(1, min(int(w), width - x))
+    h = max(1, min(int(h), height - y))
+    return (x, y, w, h)
+
+
+def parse_region(spec) -> Optional[tuple]:
+    """
+    Parsuje obszar z kroku DSL
+    
+    Akceptuje słownik {x, y, width, height} (lub w/h) albo listę [x, y, w, h].
+    
+    Returns:
+        (x, y, w, h) lub None jeśli nie podano
+    """
+    if spec is None:
+        return None
+    if isinstance(spec, dict):
+        try:
+            x, y = spec['x'], spec['y']
+            w = spec.get('width', spec.get('w'))
+            h = spec.get('height', spec.get('h'))
+        except KeyError as e:
+            raise ValueError(f"Region wymaga pola {e}: {spec}")
+        values = (x, y, w, h)
+    elif isinstance(spec, (list, tuple)) and len(spec) == 4:
+        values = tuple(spec)
+    else:
+        raise ValueError(f"Nieprawidłowy region: {spec} (oczekiwano {{x, y, width, height}} lub [x, y, w, h])")
+    
+    if any(v is None for v in values):
+        raise ValueError(f"Niepełny region: {spec}")
+    x, y, w, h = (int(v) for v in values)
+    if w <= 0 or h <= 0:
+        raise ValueError(f"Region musi mieć dodatnie wymiary: {spec}")
+    return (x, y, w, h)
+
+
+# Domyślna polityka oczekiwania po akcjach wejścia (settle):
+# czekaj aż ekran nie zmienia się przez `stable` s, ale nie dłużej niż `max` s
+DEFAULT_SETTLE = {'stable': 0.3, 'max': 2.0, 'threshold': 0.0001, 'region': None}
+
+# Akcje wysyłające wejście do zdalnego pulpitu - po nich domyślnie czekamy na stabilizację
+INPUT_ACTIONS = {'connect', 'click', 'click_position', 'find_and_click', 'type', 'key'}
+
+
+def parse_settle(spec, base: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Parsuje politykę settle (scenariusz lub krok DSL)
+    
+    Akceptuje:
+        None        - bez zmian (zwraca `base`)
+        false / 0   - nie czekaj
+        true        - polityka `base` (lub DEFAULT_SETTLE)
+        liczba      - maksymalny czas czekania w sekundach
+        słownik     - {stable, max, threshold, region} nadpisujące `base`
+    
+    Returns:
+        Słownik polityki lub None (bez czekania)
+    """
+    if spec is None:
+        return base
+    if spec is False or spec == 0:
+        return None
+    
+    policy = dict(base or DEFAULT_SETTLE)
+    if spec is True:
+        return policy
+    if isinstance(spec, (int, float)):
+        if spec < 0:
+            raise ValueError(f"Settle nie może być ujemny: {spec}")
+        policy['max'] = float(spec)
+        return policy
+    if isinstance(spec, dict):
+        unknown = set(spec) - set(DEFAULT_SETTLE)
+        if unknown:
+            raise ValueError(f"Nieznane pola settle: {', '.join(sorted(unknown))}")
+        policy.update(spec)
+        return policy
+    raise ValueError(f"Nieprawidłowy settle: {spec} (oczekiwano true/false, liczby lub {{stable, max, threshold, region}})")
+
+
+# Pula połączeń HTTP do Ollama: jedna sesja keep-alive na endpoint (base_url),
+# współdzielona przez wszystkie instancje OllamaVision w procesie
+OLLAMA_POOL_SIZE = 8
+_http_sessions: Dict[str, requests.Session] = {}
+_http_sessions_lock = threading.Lock()
+
+
+def get_http_session(base_url: str, pool_size: int = OLLAMA_POOL_SIZE) -> requests.Session:
+    """
+    Sesja HTTP z pulą połączeń keep-alive dla danego endpointu
+    
+    Połączenia TCP są używane ponownie między zapytaniami i wątkami.
+    Gdy wszystkie `pool_size` połączeń jest zajętych, kolejne wywołanie
+    czeka na wolne (pool_block) zamiast otwierać jednorazowe połączenie -
+    przy równoległych scenariuszach nie wyczerpujemy portów efemerycznych.
+    """
+    key = base_url.rstrip('/')
+    with _http_sessions_lock:
+        session = _http_sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_sessions[key] = session
+        return session
+
+
+# Formaty obrazu wysyłanego do modelu vision: format -> (nazwa PIL, obsługuje quality)
+IMAGE_FORMATS = {'png': ('PNG', False), 'jpeg': ('JPEG', True), 'jpg': ('JPEG', True), 'webp': ('WEBP', True)}
+
+# Domyślny dłuższy bok obrazu dla modelu vision (1280x800 -> 1024x640, drobny tekst wciąż czytelny)
+DEFAULT_MAX_EDGE = 1024
+
+
+# Schemat odpowiedzi find_element dla structured output Ollama (`format`)
+FIND_ELEMENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "found": {"type": "boolean"},
+        "x": {"type": "integer"},
+        "y": {"type": "integer"},
+        "confidence": {"type": "integer", "minimum": 0, "maximum": 100},
+    },
+    "required": ["found", "x", "y", "confidence"],
+}
+
+# Fragmenty błędu 400, którym Ollama < 0.5 odrzuca schemat w `format` (przyjmuje tylko "json").
+# Inne błędy 400 (zły prompt, za duży obraz) nie wyłączają structured output.
+SCHEMA_UNSUPPORTED_ERRORS = ('cannot unmarshal', 'invalid format', 'schema')
+
+
+def _parse_json_object(text: str) -> Optional[Dict]:
+    """Obiekt JSON z odpowiedzi modelu (cała odpowiedź lub pierwszy {...} w tekście)"""
+    try:
+        result = json.loads(text)
+    except ValueError:
+        json_match = re.search(r'\{[^}]+\}', text)
+        if not json_match:
+            return None
+        try:
+            result = json.loads(json_match.group())
+        except ValueError:
+            return None
+    return result if isinstance(result, dict) else None
+
+
+# Pozycje zwracane przez drugą próbę find_element
+POSITION_KEYWORDS = ['TOP-LEFT', 'TOP-RIGHT', 'BOTTOM-LEFT', 'BOTTOM-RIGHT', 'CENTER', 'NOT-FOUND']
+
+
+def _yes_no_complete(text: str) -> bool:
+    """
+    Czy odpowiedź zaczyna się pełnym słowem YES lub NO
+    
+    Tylko pierwsze słowo - w prozie ("There is no error dialog, so YES")
+    "no" nie jest odpowiedzią, więc taki tekst odbieramy do końca.
+    """
+    return re.match(r'\W*(yes|no)\b(?=\W)', text, re.IGNORECASE) is not None
+
+
+def _json_complete(text: str) -> bool:
+    """Czy odpowiedź zawiera już zamknięty obiekt JSON (z uwzględnieniem stringów)"""
+    start = text.find('{')
+    if start < 0:
+        return False
+    depth = 0
+    in_string = escaped = False
+    for char in text[start:]:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return True
+    return False
+
+
+def _position_complete(text: str) -> bool:
+    """Czy odpowiedź zawiera już pełne słowo pozycji (TOP-LEFT, CENTER, ...)"""
+    upper = text.upper()
+    return any(re.search(rf'\b{keyword}(?=[^\w-])', upper) for keyword in POSITION_KEYWORDS)
+
+
+# Wzorce kompletnej odpowiedzi - po ich wykryciu przerywamy generowanie
+ANSWER_PATTERNS = {
+    'yes_no': _yes_no_complete,
+    'json': _json_complete,
+    'position': _position_complete,
+}
+
+
 class OllamaVision:
     """Integracja z Ollama do analizy obrazu"""
     
-    def __init__(self, base_url: str = "http://localhost:11434", model: str = "llava:7b"):
-        self.base_url = base_url
+    def __init__(self, base_url: str = "http://localhost:11434", model: str = "llava:7b",
+                 pool_size: int = OLLAMA_POOL_SIZE, stream: bool = True, cache=True,
+                 image_format: str = 'png', image_quality: int = 90, max_edge: Optional[int] = DEFAULT_MAX_EDGE,
+                 structured_output: bool = True):
+        """
+        Args:
+            base_url: Adres API Ollama
+            model: Model vision (llava:7b, moondream, ...)
+            pool_size: Maks. liczba połączeń keep-alive do Ollama
+            stream: Odbieraj odpowiedź strumieniowo i przerywaj generowanie,
+                gdy odpowiedź jest kompletna (patrz ANSWER_PATTERNS)
+            cache: True (domyślny VisionCache), własny VisionCache lub False
+            image_format: Format wysyłanego obrazu: png (domyślnie, bezstratnie), jpeg lub webp
+            image_quality: Jakość JPEG/WebP (1-100)
+            max_edge: Maks. dłuższy bok wysyłanego obrazu w pikselach (None = bez skalowania)
+            structured_output: Wymuszaj odpowiedź find_element zgodną ze schematem JSON
+                (Ollama >= 0.5; starsze wersje dostają format "json")
+        """
+        image_format = image_format.lower()
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Nieobsługiwany format obrazu: {image_format} (dostępne: png, jpeg, webp)")
+        if max_edge is not None and max_edge <= 0:
+            raise ValueError(f"max_edge musi być dodatnie: {max_edge}")
+        
+        self.base_url = base_url.rstrip('/')
         self.model = model
+        self.stream = stream
+        self.session = get_http_session(self.base_url, pool_size)
+        self.cache = VisionCache() if cache is True else (cache or None)
+        self.image_format = image_format
+        self.image_quality = image_quality
+        self.max_edge = max_edge
+        self.structured_output = structured_output
+    
+    def prepare_image(self, image) -> tuple:
+        """
+        Obraz w rozmiarze wysyłanym do modelu
+        
+        Returns:
+            (obraz PIL, skala) - skala = rozmiar wysłany / oryginalny (1.0 bez skalowania)
+        """
+        if isinstance(image, Frame):
+            image = image.pil
+        width, height = image.size
+        if not self.max_edge or max(width, height) <= self.max_edge:
+            return image, 1.0
+        
+        scale = self.max_edge / max(width, height)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return image.resize(size, Image.BILINEAR, reducing_gap=2.0), scale
     
     def encode_image(self, image: Image.Image) -> str:
-        """Konwertuje obraz PIL do base64"""
+        """Koduje obraz do base64 zgodnie z polityką (format, jakość, max_edge)"""
+        image, _ = self.prepare_image(image)
+        pil_format, lossy = IMAGE_FORMATS[self.image_format]
+        if lossy and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        
         buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
+        if lossy:
+            image.save(buffered, format=pil_format, quality=self.image_quality)
+        else:
+            image.save(buffered, format=pil_format)
         return base64.b64encode(buffered.getvalue()).decode()
     
-    def analyze_screen(self, image: Image.Image, prompt: str) -> str:
-        """Analizuje screenshot z promptem"""
+    def _cache_key(self, image: Image.Image, prompt: str, *variant) -> Optional[str]:
+        """Klucz cache lub None (cache wyłączony / własna funkcja expect)"""
+        if self.cache is None or any(callable(part) for part in variant):
+            return None
+        digest = image.digest() if isinstance(image, Frame) else image_digest(image)
+        # Odpowiedź zależy też od tego, jak obraz został zakodowany
+        model = f"{self.model}|{self.image_format}:{self.image_quality}:{self.max_edge}"
+        variant = '|'.join(json.dumps(part, sort_keys=True) for part in variant if part)
+        return self.cache.make_key(digest, model, prompt, variant)
+    
+    def analyze_screen(self, image: Image.Image, prompt: str, expect: Optional[str] = None,
+                       use_cache: bool = True, format=None) -> str:
+        """
+        Analizuje screenshot z promptem
+        
+        Args:
+            image: Screenshot (PIL lub Frame - Frame ma zapamiętany hash dla cache)
+            prompt: Pytanie do modelu
+            expect: Oczekiwany kształt odpowiedzi ('yes_no', 'json', 'position'
+                lub funkcja tekst -> bool). W trybie stream generowanie jest
+                przerywane, gdy tylko odpowiedź jest kompletna.
+            use_cache: Czy korzystać z cache odpowiedzi (ten sam ekran + prompt)
+            format: Structured output Ollama - "json" lub schemat JSON odpowiedzi
+        """
+        key = self._cache_key(image, prompt, expect, format) if use_cache else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not MISS:
+                print(f"⚡ Odpowiedź Ollama z cache ({self.model})")
+                return cached
+        
+        result = self._generate(image, prompt, expect, format)
+        if key:
+            self.cache.put(key, result)
+        return result
+    
+    def _generate(self, image: Image.Image, prompt: str, expect, format=None) -> str:
+        """Zapytanie do Ollama /api/generate (bez cache)"""
         print(f"🤖 Wysyłam zapytanie do Ollama ({self.model})...")
         print(f"   Timeout: 120s - to może chwilę potrwać...")
         
         img_b64 = self.encode_image(image)
         
+        is_complete = ANSWER_PATTERNS[expect] if isinstance(expect, str) else expect
+        stream = self.stream and is_complete is not None
+        
         payload = {
             "model": self.model,
             "prompt": prompt,
             "images": [img_b64],
-            "stream": False
+            "stream": stream
         }
+        if format:
+            payload["format"] = format
         
         start_time = time.time()
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/generate",
                 json=payload,
-                timeout=120
+                timeout=120,
+                stream=stream
             )
             
-            elapsed = time.time() - start_time
-            print(f"   ✓ Odpowiedź otrzymana po {elapsed:.1f}s")
+            if (response.status_code == 400 and isinstance(format, dict)
+                    and any(error in response.text.lower() for error in SCHEMA_UNSUPPORTED_ERRORS)):
+                # Starsza Ollama (< 0.5) nie przyjmuje schematu - tylko format "json"
+                print("   ⚠️  Ollama nie obsługuje schematu JSON, używam format=\"json\"")
+                response.close()
+                self.structured_output = False
+                return self._generate(image, prompt, expect, "json")
             
-            if response.status_code == 200:
-                return response.json()["response"]
-            else:
+            if response.status_code != 200:
                 raise Exception(f"Ollama error: {response.text}")
+            
+            if not stream:
+                result = response.json()["response"]
+                elapsed = time.time() - start_time
+                print(f"   ✓ Odpowiedź otrzymana po {elapsed:.1f}s")
+                return result
+            
+            return self._read_stream(response, is_complete, start_time)
         except requests.exceptions.Timeout:
             raise Exception(f"Ollama timeout po 120s - model może nie być pobrany lub Ollama nie działa")
         except requests.exceptions.ConnectionError:
             raise Exception(f"Nie można połączyć z Ollama ({self.base_url}) - sprawdź czy usługa działa")
     
+    def _read_stream(self, response: requests.Response, is_complete, start_time: float,
+                     timeout: float = 120) -> str:
+        """
+        Czyta odpowiedź strumieniową token po tokenie
+        
+        Gdy `is_complete(tekst)` zwróci True, zamyka połączenie - Ollama
+        przerywa wtedy generowanie, a reszta odpowiedzi nie jest potrzebna.
+        """
+        text = ''
+        tokens = 0
+        stopped_early = False
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise Exception(f"Ollama error: {chunk['error']}")
+                text += chunk.get('response', '')
+                tokens += 1
+                if chunk.get('done'):
+                    break
+                if is_complete(text):
+                    stopped_early = True
+                    break
+                if time.time() - start_time > timeout:
+                    raise requests.exceptions.Timeout()
+        finally:
+            # Zamknięcie niedoczytanej odpowiedzi zrywa połączenie = anulowanie generowania
+            response.close()
+        
+        elapsed = time.time() - start_time
+        if stopped_early:
+            print(f"   ✓ Odpowiedź otrzymana po {elapsed:.1f}s (przerwano po {tokens} tokenach)")
+        else:
+            print(f"   ✓ Odpowiedź otrzymana po {elapsed:.1f}s")
+        return text
+    
     def find_element(self, image: Image.Image, element_desc: str) -> Optional[Dict]:
         """Znajduje element na ekranie i zwraca współrzędne"""
+        key = self._cache_key(image, element_desc, 'find_element')
+        if key:
+            cached = self.cache.get(key)
+            if cached is not MISS:
+                print(f"⚡ Pozycja elementu z cache ({self.model})")
+                return cached
+        
+        result = self._find_element(image, element_desc)
+        if key and result is not None:
+            # "Nie znaleziono" tylko w pamięci - na dysku przetrwałoby 24h
+            self.cache.put(key, result, persist=bool(result.get('found')))
+        return result
+    
+    def _find_element(self, image: Image.Image, element_desc: str) -> Optional[Dict]:
+        """
+        Szukanie elementu przez model (bez cache)
+        
+        Returns:
+            {'found', 'x', 'y', 'confidence'} lub None, gdy odpowiedzi modelu
+            nie da się odczytać (brak JSON-a, brak `found`, złe współrzędne)
+        """
         width, height = image.size
         
+        # Model widzi obraz po skalowaniu (max_edge) - współrzędne przeliczamy z powrotem
+        sent, scale = self.prepare_image(image)
+        sent_width, sent_height = sent.size
+        
         # Pierwsza próba - dokładne współrzędne
-        prompt = f"""Analyze this screenshot (size: {width}x{height} pixels) and locate: {element_desc}
+        prompt = f"""Analyze this screenshot (size: {sent_width}x{sent_height} pixels) and locate: {element_desc}
 
 Look carefully at the entire screen. If you can see this element, estimate its center position in pixels.
 
@@ -101,25 +492,33 @@ Respond ONLY with JSON format:
 {{"found": true, "x": <pixel_x>, "y": <pixel_y>, "confidence": <0-100>}}
 
 If not visible, respond:
-{{"found": false}}
+{{"found": false, "x": 0, "y": 0, "confidence": 0}}
 
 Example responses:
 {{"found": true, "x": 150, "y": 80, "confidence": 90}}
-{{"found": false}}"""
+{{"found": false, "x": 0, "y": 0, "confidence": 0}}"""
         
-        response = self.analyze_screen(image, prompt)
+        response = self.analyze_screen(
+            sent, prompt, expect='json', use_cache=False,
+            format=FIND_ELEMENT_SCHEMA if self.structured_output else "json"
+        )
         
-        # Wyciągnij JSON z odpowiedzi
-        try:
-            json_match = re.search(r'\{[^}]+\}', response)
-            if json_match:
-                result = json.loads(json_match.group())
-                if result.get('found'):
-                    return result
-        except:
-            pass
-        
-        # Druga próba - użyj opisu pozycji jeśli nie znaleziono dokładnych współrzędnych
+        # Odpowiedź jest JSON-em zgodnym ze schematem (regex tylko dla starszych wersji Ollama)
+        result = _parse_json_object(response)
+        if result is None or 'found' not in result:
+            print(f"   ⚠️  Nieczytelna odpowiedź find_element: {response[:200]!r}")
+            return None
+        if result['found']:
+            try:
+                # Współrzędne obrazu wysłanego -> współrzędne ekranu
+                result['x'] = min(width - 1, max(0, round(float(result['x']) / scale)))
+                result['y'] = min(height - 1, max(0, round(float(result['y']) / scale)))
+                return result
+            except (KeyError, TypeError, ValueError):
+                print(f"   ⚠️  find_element: found bez poprawnych współrzędnych: {result}")
+                return None
+        
+        # Druga próba - tylko gdy model jawnie odpowiedział, że elementu nie ma (found: false)
         prompt2 = f"""Look at this screenshot. Can you see: {element_desc}?
 
 Answer with ONLY:
@@ -132,7 +531,7 @@ Answer with ONLY:
 
 One word only."""
         
-        response2 = self.analyze_screen(image, prompt2).strip().upper()
+        response2 = self.analyze_screen(sent, prompt2, expect='position', use_cache=False).strip().upper()
         
         # Mapuj pozycje na współrzędne
         position_map = {
@@ -145,7 +544,8 @@ One word only."""
         
         for pos_name, (x, y) in position_map.items():
             if pos_name in response2:
-                return {"found": True, "x": x, "y": y, "confidence": 60}
+                # Środek ćwiartki, nie pozycja elementu
+                return {"found": True, "x": x, "y": y, "confidence": 60, "approximate": True}
         
         return {"found": False}
 
@@ -159,6 +559,9 @@ class RemoteController:
         self.port = port
         self.connection = None
         self.kwargs = kwargs
+        self._framebuffer_fallback_warned = False
+        self.frame_sequence = 0  # numer klatki ostatniego screenshota (mirror)
+        self._last_frame = (None, None)  # (mirror, klatka) - ostatni pełny zrzut
         
     def connect(self):
         """Nawiązuje połączenie"""
@@ -175,9 +578,55 @@ class RemoteController:
         """Połączenie VNC przez vncdotool"""
         import vncdotool.api as vnc
         password = self.kwargs.get('password', '')
-        self.connection = vnc.connect(f"{self.host}::{self.port}", password=password)
+        
+        if FRAMEBUFFER_MIRROR_AVAILABLE and self.kwargs.get('framebuffer_mirror', True):
+            self.connection = vnc.connect(
+                f"{self.host}::{self.port}",
+                password=password,
+                factory_class=MirroringVNCFactory
+            )
+        else:
+            self.connection = vnc.connect(f"{self.host}::{self.port}", password=password)
         print(f"✓ Connected to VNC: {self.host}:{self.port}")
     
+    @property
+    def framebuffer(self):
+        """FramebufferMirror aktywnego połączenia VNC (None jeśli niedostępny)"""
+        if self.protocol != "vnc" or not self.connection:
+            return None
+        factory = getattr(self.connection, 'factory', None)
+        return getattr(factory, 'mirror', None)
+    
+    def changes_since(self, sequence: int) -> Optional[List[tuple]]:
+        """
+        Prostokąty (x, y, w, h) zmienione od klatki `sequence`
+        
+        Returns:
+            Lista prostokątów (pusta = brak zmian) lub None gdy nie wiadomo
+            (brak mirrora lub za stara klatka) - traktuj jak cały ekran
+        """
+        mirror = self.framebuffer
+        if mirror is None:
+            return None
+        return mirror.changes_since(sequence)
+    
+    def has_changed_since(self, sequence: int, region: Optional[tuple] = None) -> bool:
+        """
+        Czy ekran (lub obszar x, y, w, h) zmienił się od klatki `sequence`
+        
+        Returns:
+            True także wtedy, gdy nie wiadomo (brak mirrora, za stara klatka)
+        """
+        mirror = self.framebuffer
+        if mirror is None:
+            return True
+        if region is None:
+            return mirror.has_changed_since(sequence)
+        rects = mirror.changes_since(sequence)
+        if rects is None:
+            return True
+        return any(rects_intersect(rect, region) for rect in rects)
+    
     def _connect_rdp(self):
         """Połączenie RDP przez xfreerdp"""
         username = self.kwargs.get('username', '')
@@ -254,33 +703,128 @@ class RemoteController:
     
     def capture_screen(self) -> Image.Image:
         """Przechwytuje screenshot"""
+        return self.capture_frame().pil
+    
+    def capture_region(self, x: int, y: int, width: int, height: int) -> Image.Image:
+        """
+        Przechwytuje tylko wybrany obszar ekranu (region of interest)
+        
+        Obszar jest przycinany do granic ekranu; faktycznie użyty prostokąt
+        (x, y, w, h) jest zapisany w image.info['region'].
+        """
+        return self.capture_frame((x, y, width, height)).pil
+    
+    def capture_frame(self, region: Optional[tuple] = None) -> Frame:
+        """
+        Przechwytuje klatkę (Frame) - cały ekran lub obszar (x, y, w, h)
+        
+        Frame trzyma jeden bufor pikseli i udostępnia widoki PIL/BGR/gray
+        liczone co najwyżej raz - bez powtarzania konwersji PIL -> OpenCV.
+        """
         if self.protocol == "vnc" and self.connection:
-            import tempfile
-            import os
-            
-            # Użyj tymczasowego pliku, który zostanie automatycznie usunięty
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-                tmp_path = tmp.name
-            
             try:
-                self.connection.captureScreen(tmp_path)
-                # Wczytaj obraz do pamięci i zamknij plik
-                with Image.open(tmp_path) as img:
-                    # Skopiuj obraz do pamięci, aby móc zamknąć plik
-                    screenshot = img.copy()
-                return screenshot
-            finally:
-                # Usuń tymczasowy plik
-                try:
-                    os.unlink(tmp_path)
-                except Exception:
-                    pass
+                return self._capture_vnc_framebuffer(region)
+            except Exception as e:
+                # Fallback: zapis przez plik tymczasowy (wolniejszy, ale zawsze działa)
+                if not self._framebuffer_fallback_warned:
+                    print(f"⚠️  Bezpośredni odczyt framebuffera niedostępny ({e}), używam pliku tymczasowego")
+                    self._framebuffer_fallback_warned = True
+                return Frame.from_pil(self._capture_vnc_tempfile(region))
         else:
             if ImageGrab:
-                return ImageGrab.grab()
+                if region:
+                    x, y, w, h = region
+                    return Frame.from_pil(ImageGrab.grab(bbox=(x, y, x + w, y + h)), {'region': region})
+                return Frame.from_pil(ImageGrab.grab())
             else:
                 # Create a dummy image if ImageGrab is not available
-                return Image.new('RGB', (800, 600), color='black')
+                if region:
+                    return Frame.from_pil(Image.new('RGB', (region[2], region[3]), color='black'), {'region': region})
+                return Frame.from_pil(Image.new('RGB', (800, 600), color='black'))
+    
+    def _capture_vnc_framebuffer(self, region: Optional[tuple] = None) -> Frame:
+        """
+        Odczytuje framebuffer klienta vncdotool bezpośrednio z pamięci
+        
+        Bez zapisu na dysk i bez kodowania/dekodowania PNG - kopiuje piksele
+        klienta do tablicy numpy w wątku reaktora Twisted, żeby nie czytać
+        bufora w trakcie nakładania kolejnej aktualizacji. Gdy działa
+        FramebufferMirror, bufor jest już aktualny i nie trzeba prosić
+        serwera o pełny ekran. Dla `region` kopiowany jest tylko ten obszar.
+        
+        Jeśli od poprzedniego pełnego zrzutu nie przyszła żadna aktualizacja
+        (ten sam numer klatki), zwracany jest ten sam obiekt Frame - razem z
+        już policzonymi widokami i hashem.
+        """
+        from twisted.internet import reactor
+        from twisted.internet.threads import blockingCallFromThread
+        
+        mirror = self.framebuffer
+        if mirror is None or mirror.sequence == 0:
+            self.connection.refreshScreen(False)
+        
+        protocol = getattr(self.connection, 'protocol', None)
+        if protocol is None:
+            raise RuntimeError("brak aktywnego protokołu VNC")
+        
+        last_mirror, last_frame = self._last_frame
+        
+        def copy_screen():
+            screen = protocol.screen
+            if screen is None:
+                return None, 0, None
+            sequence = mirror.sequence if mirror else 0
+            if (region is None and sequence and last_mirror is mirror
+                    and last_frame.info['frame_sequence'] == sequence):
+                return last_frame, sequence, None
+            if screen.mode != 'RGB':
+                screen = screen.convert('RGB')
+            if region is None:
+                return np.asarray(screen), sequence, None
+            box = _clamp_region(region, screen.size)
+            x, y, w, h = box
+            return np.asarray(screen.crop((x, y, x + w, y + h))), sequence, box
+        
+        pixels, self.frame_sequence, box = blockingCallFromThread(reactor, copy_screen)
+        if pixels is None:
+            raise RuntimeError("framebuffer VNC jest pusty")
+        if isinstance(pixels, Frame):
+            return pixels  # Ekran bez zmian od poprzedniego zrzutu
+        
+        info = {'frame_sequence': self.frame_sequence}
+        if box:
+            info['region'] = box
+        frame = Frame(pixels, info)
+        if region is None and mirror is not None:
+            self._last_frame = (mirror, frame)
+        return frame
+    
+    def _capture_vnc_tempfile(self, region: Optional[tuple] = None) -> Image.Image:
+        """Przechwytuje screenshot VNC przez plik tymczasowy PNG (fallback)"""
+        import tempfile
+        
+        # Użyj tymczasowego pliku, który zostanie automatycznie usunięty
+        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
+            tmp_path = tmp.name
+        
+        try:
+            if region:
+                self.connection.captureRegion(tmp_path, *region)
+            else:
+                self.connection.captureScreen(tmp_path)
+            # Wczytaj obraz do pamięci i zamknij plik
+            with Image.open(tmp_path) as img:
+                # Skopiuj obraz do pamięci, aby móc zamknąć plik
+                screenshot = img.copy()
+            if region:
+                screenshot.info['region'] = region
+            return screenshot
+        finally:
+            # Usuń tymczasowy plik
+            try:
+                os.unlink(tmp_path)
+            except Exception:
+                pass
     
     def disconnect(self):
         """Rozłącza połączenie"""
@@ -325,12 +869,23 @@ class RemoteController:
                 self.connection = None
 
 
+# Warunki akcji wait_for
+WAIT_FOR_CONDITIONS = ['dialog', 'no_dialog', 'text_field', 'unlock_button', 'buttons', 'content', 'blank', 'expected']
+
+# smart_click: ile sekund czekać na reakcję ekranu po kliknięciu w zapamiętany wycinek
+LEARNED_CLICK_TIMEOUT = 2.0
+
+
 class AutomationEngine:
     """Silnik automatyzacji z DSL"""
     
-    def __init__(self, controller: RemoteController, vision: OllamaVision, enable_recording: bool = False, debug_mode: bool = False):
+    def __init__(self, controller: RemoteController, vision: OllamaVision, enable_recording: bool = False, debug_mode: bool = False, capture_broker: Optional[CaptureBroker] = None, settle=True, cv_analysis_scale: float = 1.0, cv_parallel: bool = False, recording_options: Optional[Dict] = None):
         self.controller = controller
         self.vision = vision
+        self.capture_broker = capture_broker
+        self._owns_capture_broker = False
+        self.settle = parse_settle(settle)  # Polityka czekania po akcjach (patrz parse_settle)
+        self.settle_stats = {'steps': 0, 'total': 0.0, 'timeouts': 0}
         self.variables = {}
         self.enable_recording = enable_recording
         self.recorder = None
@@ -342,15 +897,22 @@ class AutomationEngine:
         
         # Initialize CV Detector
         if CV_AVAILABLE:
-            self.cv_detector = CVDetector()
+            self.cv_detector = CVDetector(cv_analysis_scale, parallel=cv_parallel)
             self.cv_detector.set_debug(debug_mode)
+            # Powtarzane cv_detect / wait_for liczą tylko zmienione kafelki ekranu (przy pełnej skali analizy)
+            self.cv_incremental = IncrementalDetector(self.cv_detector)
         else:
             self.cv_detector = None
+            self.cv_incremental = None
+        
+        # Kaskada szablon → CV → VLM dla akcji smart_click
+        self.locator = SmartLocator(self.cv_detector, vision)
         
         if enable_recording:
             try:
                 from screen_recorder import ScreenRecorder
-                self.recorder = ScreenRecorder()
+                # Opcje ScreenRecorder z sekcji `recording:` konfiguracji (fps, change_aware, ...)
+                self.recorder = ScreenRecorder(**(recording_options or {}))
             except ImportError as e:
                 print(f"⚠️  screen_recorder nie jest dostępny (brak cv2?), nagrywanie wyłączone")
                 print(f"   Błąd importu: {e}")
@@ -358,6 +920,11 @@ class AutomationEngine:
             except Exception as e:
                 print(f"⚠️  Błąd inicjalizacji screen_recorder: {e}")
                 self.enable_recording = False
+        
+        # Nagrywanie i kroki scenariusza dzielą jedno przechwytywanie ekranu
+        if self.enable_recording and self.recorder and self.capture_broker is None:
+            self.capture_broker = CaptureBroker(controller, fps=self.recorder.fps)
+            self._owns_capture_broker = True
     
     def log(self, message: str, level: str = "INFO"):
         """Loguje wiadomość z timestampem"""
@@ -370,10 +937,302 @@ class AutomationEngine:
         }.get(level, "•")
         print(f"[{timestamp}] {prefix} {message}")
     
-    def save_screenshot(self, name: str, screen: Image.Image = None):
-        """Zapisuje screenshot z timestampem"""
+    def capture_frame(self, region: Optional[tuple] = None) -> Frame:
+        """
+        Klatka przez CaptureBroker (jeśli działa) lub bezpośrednio z kontrolera
+        
+        Args:
+            region: Opcjonalny obszar (x, y, w, h) - zwracany jest tylko ten fragment
+        """
+        if self.capture_broker and self.capture_broker.running:
+            frame = self.capture_broker.get_frame()
+            if region is None:
+                return frame
+            return frame.crop(*_clamp_region(region, frame.size))
+        return self.controller.capture_frame(region)
+    
+    def capture_screen(self, region: Optional[tuple] = None) -> Image.Image:
+        """Screenshot jako PIL.Image (patrz capture_frame)"""
+        return self.capture_frame(region).pil
+    
+    @staticmethod
+    def _to_screen(point, frame):
+        """Przelicza punkt (x, y) z klatki obszaru na współrzędne całego ekranu"""
+        if point is None:
+            return None
+        region = frame.info.get('region')
+        if not region:
+            return tuple(point)
+        return (point[0] + region[0], point[1] + region[1])
+    
+    def _cv_context(self, frame, scale: Optional[float] = None):
+        """Kontekst CV klatki: przyrostowy (pełna skala) lub pomniejszony (analysis_scale < 1)"""
+        scale = self.cv_detector.analysis_scale if scale is None else float(scale)
+        if scale < 1.0:
+            return self.cv_detector.context(frame, scale=scale)
+        return self.cv_incremental.context(frame)
+    
+    def _cv_analysis_mode(self, ctx) -> str:
+        """Opis sposobu ostatniej analizy CV do logu (skala lub tryb przyrostowy)"""
+        if ctx.scale < 1.0:
+            return f"scale {ctx.scale}"
+        update = self.cv_incremental.last_update
+        if update['mode'] == 'incremental':
+            return f"incremental: {update['changed_tiles']}/{update['tiles']} tiles changed"
+        return update['mode']
+    
+    def _offset_cv_results(self, results: Dict, frame) -> Dict:
+        """Przelicza pozycje z quick_analysis obszaru na współrzędne całego ekranu"""
+        if not frame.info.get('region'):
+            return results
+        results['dialog_center'] = self._to_screen(results.get('dialog_center'), frame)
+        results['button_positions'] = [self._to_screen(p, frame) for p in results.get('button_positions', [])]
+        results['text_field_position'] = self._to_screen(results.get('text_field_position'), frame)
+        results['unlock_button'] = self._to_screen(results.get('unlock_button'), frame)
+        return results
+    
+    def _next_frame(self, reference: Frame, region: Optional[tuple], timeout: float,
+                    interval: float = 0.1, since: Optional[int] = None) -> Optional[Frame]:
+        """
+        Następna klatka obszaru, która może różnić się od `reference`
+        
+        Z FramebufferMirror czeka na aktualizację RFB dotykającą obszaru
+        (bez odpytywania i bez przechwytywania niezmienionego ekranu);
+        bez mirrora - polling co `interval` sekund, klatki identyczne
+        z `reference` (ten sam hash pikseli) są pomijane.
+        
+        `since` to numer ostatnio sprawdzonej klatki (domyślnie `reference`) -
+        czekając kolejny raz na tę samą referencję, przekaż numer poprzednio
+        zwróconej klatki, inaczej już widziana zmiana (np. kursor poniżej
+        progu) zwraca klatkę od razu.
+        
+        Returns:
+            Nowa klatka lub None, jeśli w ciągu `timeout` nic się nie zmieniło
+        """
+        if timeout <= 0:
+            return None
+        
+        mirror = self.controller.framebuffer
+        sequence = since or reference.info.get('frame_sequence')
+        if mirror is None or not sequence:
+            deadline = time.time() + timeout
+            while True:
+                time.sleep(max(0.0, min(interval, deadline - time.time())))
+                frame = self.capture_frame(region)
+                if frame.digest() != reference.digest():
+                    return frame
+                if time.time() >= deadline:
+                    return None
+        
+        box = reference.info.get('region', region)
+        deadline = time.time() + timeout
+        seen = sequence
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not mirror.wait_for_update(seen, remaining):
+                return None
+            if self.controller.has_changed_since(sequence, box):
+                return self.capture_frame(region)
+            # Zmiana poza obserwowanym obszarem - czekaj dalej
+            seen = mirror.sequence
+    
+    def wait_for_change(self, region: Optional[tuple] = None, timeout: float = 10.0,
+                        threshold: float = 0.0001, interval: float = 0.1,
+                        reference: Optional[Frame] = None) -> tuple:
+        """
+        Czekaj aż ekran (lub obszar) się zmieni
+        
+        Args:
+            region: Obszar (x, y, w, h) lub None dla całego ekranu
+            timeout: Maksymalny czas czekania (s)
+            threshold: Minimalny ułamek zmienionych pikseli miniatury (0-1) -
+                domyślny próg pomija migający kursor tekstowy
+            interval: Co ile sekund sprawdzać ekran (gdy brak FramebufferMirror)
+            reference: Klatka odniesienia (np. sprzed kliknięcia) - domyślnie bieżący ekran
+        
+        Returns:
+            (czy_zmienił_się, czas_czekania_s)
+        """
+        start = time.time()
+        if reference is None:
+            reference = self.capture_frame(region)
+        seen = None  # ostatnio sprawdzona klatka - czekaj na nowszą, nie na zmianę od referencji
+        
+        while True:
+            remaining = timeout - (time.time() - start)
+            frame = self._next_frame(reference, region, remaining, interval, since=seen)
+            if frame is None:
+                return False, time.time() - start
+            if frame_difference(reference, frame) > threshold:
+                return True, time.time() - start
+            seen = frame.info.get('frame_sequence')
+    
+    def wait_for_stable(self, region: Optional[tuple] = None, stable: float = 0.5,
+                        timeout: float = 10.0, threshold: float = 0.0001,
+                        interval: float = 0.1) -> tuple:
+        """
+        Czekaj aż ekran (lub obszar) przestanie się zmieniać przez `stable` sekund
+        
+        Returns:
+            (czy_ustabilizowany, czas_czekania_s)
+        """
+        start = time.time()
+        last = self.capture_frame(region)
+        stable_since = start
+        
+        while True:
+            now = time.time()
+            if now - stable_since >= stable:
+                return True, now - start
+            if now - start >= timeout:
+                return False, now - start
+            
+            window = min(stable - (now - stable_since), timeout - (now - start))
+            frame = self._next_frame(last, region, window, interval)
+            if frame is None:
+                continue
+            if frame_difference(last, frame) > threshold:
+                stable_since = time.time()
+            last = frame
+
+    def settle_after_step(self, step: Dict, input_sent: bool) -> Optional[float]:
+        """
+        Czekanie po kroku zgodnie z polityką settle
+        
+        Po akcjach wejścia czeka aż ekran się ustabilizuje (maks. `max` s),
+        po akcjach niezmieniających ekranu nie czeka wcale - chyba że krok
+        ma własne pole `settle`.
+        
+        Returns:
+            Faktyczny czas czekania w sekundach lub None (bez czekania)
+        """
+        if 'settle' in step:
+            policy = parse_settle(step['settle'], self.settle)
+        else:
+            policy = self.settle if input_sent else None
+        if not policy or policy['max'] <= 0:
+            return None
+        
+        try:
+            stable, waited = self.wait_for_stable(
+                parse_region(policy.get('region')),
+                stable=min(policy['stable'], policy['max']),
+                timeout=policy['max'],
+                threshold=policy['threshold']
+            )
+        except Exception as e:
+            self.log(f"Settle skipped: {e}", "ERROR")
+            return None
+        
+        self.settle_stats['steps'] += 1
+        self.settle_stats['total'] += waited
+        if not stable:
+            self.settle_stats['timeouts'] += 1
+        print(f"  ⏱️  Settle: {waited:.2f}s{'' if stable else ' (max reached, screen still changing)'}")
+        return waited
+    
+    def _mark_step_end(self, open_step: Optional[tuple], error: Optional[str] = None):
+        """
+        Znacznik końca kroku w nagraniu (indeks kroków ScreenRecorder)
+        
+        Status: 'error' - wyjątek, 'failed' - krok dopisał błąd do self.errors,
+        'ok' - w pozostałych przypadkach.
+        """
+        if open_step is None or not self.recorder:
+            return
+        index, errors_before = open_step
+        if error:
+            status = 'error'
+        elif len(self.errors) > errors_before:
+            status, error = 'failed', self.errors[-1]
+        else:
+            status = 'ok'
+        self.recorder.mark_step_end(index, status, error)
+    
+    def _check_condition(self, condition: str, frame: Frame, step: Dict):
+        """
+        Sprawdza warunek akcji wait_for na klatce
+        
+        Returns:
+            (czy_spełniony, wartość) - wartość to np. pozycja elementu
+        """
+        if condition == 'expected':
+            response = self.vision.analyze_screen(
+                frame,
+                f"Check if the screen shows: {step.get('expected')}. Answer only YES or NO.",
+                expect='yes_no'
+            )
+            return 'yes' in response.lower(), response.strip()
+        
+        if not CV_AVAILABLE or not self.cv_detector:
+            raise RuntimeError("CV Detection not available")
+        
+        img = self._cv_context(frame)
+        if condition == 'dialog':
+            dialog = self.cv_detector.detect_dialog_box(img)
+            return dialog is not None, self._to_screen(dialog['center'], frame) if dialog else None
+        if condition == 'no_dialog':
+            return self.cv_detector.detect_dialog_box(img) is None, None
+        if condition == 'text_field':
+            position = self.cv_detector.find_text_field(img)
+            return position is not None, self._to_screen(position, frame)
+        if condition == 'unlock_button':
+            position = self.cv_detector.find_unlock_button(img)
+            return position is not None, self._to_screen(position, frame)
+        if condition == 'buttons':
+            buttons = self.cv_detector.detect_buttons(img)
+            return bool(buttons), [self._to_screen(b['center'], frame) for b in buttons]
+        if condition == 'content':
+            return not self.cv_detector.is_screen_blank(img), None
+        if condition == 'blank':
+            return self.cv_detector.is_screen_blank(img), None
+        
+        raise ValueError(f"Unknown wait_for condition: {condition} "
+                         f"(available: {', '.join(WAIT_FOR_CONDITIONS)})")
+    
+    def wait_for(self, condition: str, step: Dict, region: Optional[tuple] = None,
+                 timeout: float = 10.0, interval: float = 0.25,
+                 threshold: float = 0.0001) -> tuple:
+        """
+        Czekaj aż warunek będzie spełniony
+        
+        Warunek jest sprawdzany od nowa tylko po zmianie ekranu (obszaru)
+        większej niż `threshold` względem ostatnio sprawdzonej klatki - także
+        bez FramebufferMirror (polling co `interval` s), więc warunek AI nie
+        jest wysyłany do modelu dla niezmienionego ekranu ani migającego kursora.
+        
+        Returns:
+            (czy_spełniony, wartość, czas_czekania_s)
+        """
+        start = time.time()
+        frame = self.capture_frame(region)
+        seen = None  # ostatnio pobrana klatka - czekaj na nowszą (patrz _next_frame)
+        
+        while True:
+            met, value = self._check_condition(condition, frame, step)
+            if met:
+                return True, value, time.time() - start
+            
+            remaining = timeout - (time.time() - start)
+            next_frame = None
+            while next_frame is None and remaining > 0:
+                candidate = self._next_frame(frame, region, remaining, interval, since=seen)
+                remaining = timeout - (time.time() - start)
+                if candidate is None:
+                    continue
+                seen = candidate.info.get('frame_sequence')
+                if frame_difference(frame, candidate) > threshold:
+                    next_frame = candidate
+            if next_frame is None:
+                return False, None, time.time() - start
+            frame = next_frame
+    
+    def save_screenshot(self, name: str, screen=None):
+        """Zapisuje screenshot (PIL.Image lub Frame) z timestampem"""
         if screen is None:
-            screen = self.controller.capture_screen()
+            screen = self.capture_frame()
+        if isinstance(screen, Frame):
+            screen = screen.pil
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"{timestamp}_{self.step_counter:03d}_{name}.png"
@@ -383,36 +1242,328 @@ class AutomationEngine:
         self.log(f"Screenshot saved: {filepath.name}", "DEBUG")
         return str(filepath)
     
-    def execute_dsl(self, script: List[Dict], scenario_name: str = "test"):
-        """Wykonuje skrypt DSL"""
-        recording_stats = {}
+    def _start_capture(self, scenario_name: str):
+        """
+        Uruchom CaptureBroker (jeśli należy do silnika) i nagrywanie (jeśli włączone)
         
-        self.log(f"Starting scenario: {scenario_name}", "INFO")
-        if self.debug_mode:
-            self.log("Debug mode ENABLED - saving screenshots", "DEBUG")
+        Returns:
+            Subskrypcja nagrywania w CaptureBroker lub None
+        """
+        recorder_subscription = None
+        if self._owns_capture_broker:
+            self.capture_broker.start()
         
         # Rozpocznij nagrywanie jeśli włączone
         if self.enable_recording and self.recorder:
             try:
+                capture_func = self.controller.capture_frame
+                if self.capture_broker:
+                    recorder_subscription = self.capture_broker.subscribe('recorder', max_fps=self.recorder.fps)
+                    capture_func = recorder_subscription.latest
                 self.recorder.start_recording(
                     scenario_name, 
-                    self.controller.capture_screen
+                    capture_func
                 )
             except Exception as e:
                 print(f"⚠️  Nie można rozpocząć nagrywania: {e}")
+        return recorder_subscription
+    
+    def _stop_capture(self, recorder_subscription) -> Dict:
+        """
+        Zatrzymaj nagrywanie i CaptureBroker (patrz _start_capture)
+        
+        Returns:
+            Statystyki nagrania (pusty słownik bez nagrywania)
+        """
+        recording_stats = {}
+        # Zatrzymaj nagrywanie jeśli było aktywne
+        if self.enable_recording and self.recorder:
+            try:
+                recording_stats = self.recorder.stop_recording()
+            except Exception as e:
+                print(f"⚠️  Błąd zatrzymania nagrywania: {e}")
+        
+        if recorder_subscription:
+            recorder_subscription.close()
+        if self._owns_capture_broker:
+            self.capture_broker.stop()
+        return recording_stats
+    
+    def _log_scenario_stats(self):
+        """Podsumowanie scenariusza: czas settle, poziomy smart_click, cache vision"""
+        if self.settle_stats['steps']:
+            self.log(
+                f"Settle: {self.settle_stats['total']:.2f}s total in {self.settle_stats['steps']} steps"
+                f" ({self.settle_stats['timeouts']} reached max)", "INFO"
+            )
         
+        locator_calls = {tier: stats for tier, stats in self.locator.stats.items() if stats['calls']}
+        if locator_calls:
+            self.log("Smart locator: " + ", ".join(
+                f"{tier} {stats['hits']}/{stats['calls']} hits, {stats['time_ms']:.0f}ms"
+                for tier, stats in locator_calls.items()
+            ), "INFO")
+        
+        if self.vision.cache:
+            cache_stats = self.vision.cache.stats()
+            if cache_stats['hits_memory'] + cache_stats['hits_disk'] + cache_stats['misses']:
+                self.log(
+                    f"Vision cache: {cache_stats['hits_memory']} memory hits, {cache_stats['hits_disk']} disk hits,"
+                    f" {cache_stats['misses']} misses (hit rate {cache_stats['hit_rate']:.0%})", "INFO"
+                )
+    
+    # ===== Akcje DSL =====
+    
+    def _action_wait_for_change(self, step: Dict):
+        """Akcja wait_for_change - czekaj na dowolną zmianę ekranu (obszaru)"""
+        region = parse_region(step.get('region'))
+        timeout = step.get('timeout', 10)
+        changed, waited = self.wait_for_change(
+            region,
+            timeout=timeout,
+            threshold=step.get('threshold', 0.0001),
+            interval=step.get('interval', 0.1)
+        )
+        if changed:
+            print(f"  ✓ Screen changed after {waited:.2f}s")
+        else:
+            error_msg = f"Screen did not change within {timeout}s"
+            print(f"  ✗ {error_msg}")
+            self.errors.append(error_msg)
+    
+    def _action_wait_for_stable(self, step: Dict):
+        """Akcja wait_for_stable - czekaj aż ekran (obszar) przestanie się zmieniać"""
+        region = parse_region(step.get('region'))
+        stable, waited = self.wait_for_stable(
+            region,
+            stable=step.get('stable', 0.5),
+            timeout=step.get('timeout', 10),
+            threshold=step.get('threshold', 0.0001),
+            interval=step.get('interval', 0.1)
+        )
+        if stable:
+            print(f"  ✓ Screen stable after {waited:.2f}s")
+        else:
+            # Ekran nadal się zmienia (np. animacja) - nie traktujemy jako błąd
+            print(f"  ⚠️  Screen still changing after {waited:.2f}s")
+    
+    def _action_wait_for(self, step: Dict):
+        """Akcja wait_for - czekaj na warunek CV lub AI"""
+        condition = step.get('condition', 'expected' if step.get('expected') else None)
+        timeout = step.get('timeout', 10)
+        met, value, waited = self.wait_for(
+            condition,
+            step,
+            region=parse_region(step.get('region')),
+            timeout=timeout,
+            interval=step.get('interval', 0.25),
+            threshold=step.get('threshold', 0.0001)
+        )
+        if met:
+            print(f"  ✓ Condition '{condition}' met after {waited:.2f}s")
+            var_name = step.get('save_to')
+            if var_name:
+                self.variables[var_name] = value
+        else:
+            error_msg = f"Condition '{condition}' not met within {timeout}s"
+            print(f"  ✗ {error_msg}")
+            self.errors.append(error_msg)
+    
+    def _action_smart_click(self, step: Dict) -> bool:
+        """
+        Akcja smart_click - kaskada szablon → CV → VLM (patrz SmartLocator)
+        
+        Returns:
+            Czy kliknięto (wejście wysłane - po kroku czekamy na settle)
+        """
+        element = step.get('element')
+        region = parse_region(step.get('region'))
+        templates = step.get('template', [])
+        print(f"  Locating: {element}")
+        
+        clicked = False
+        # Druga próba tylko po usunięciu zapamiętanego wycinka, w który kliknięcie nic nie zmieniło
+        for attempt in range(2):
+            frame = self.capture_frame(region)
+            result = self.locator.locate(
+                frame,
+                element,
+                templates=[templates] if isinstance(templates, str) else templates,
+                cv=step.get('cv'),
+                threshold=step.get('threshold', 0.8),
+                min_confidence=step.get('min_confidence', 0.6),
+                use_vlm=step.get('vlm', True),
+                learn=step.get('learn', True)
+            )
+            for tier, elapsed in result['timings'].items():
+                print(f"    {tier}: {elapsed:.1f}ms")
+            
+            if not result['found']:
+                error_msg = f"Element not found: {element}"
+                print(f"  ✗ {error_msg} (tiers: {', '.join(result['timings'])})")
+                self.errors.append(error_msg)
+                break
+            
+            x, y = self._to_screen((result['x'], result['y']), frame)
+            print(f"  ✓ Found at ({x}, {y}) by {result['tier']} - confidence: {result['confidence']:.2f}")
+            if step.get('click', True):
+                self.controller.click(x, y)
+                clicked = True
+                if result['learned'] and not self.wait_for_change(
+                        region, timeout=LEARNED_CLICK_TIMEOUT, reference=frame)[0]:
+                    print("  ⚠️  Click on learned template changed nothing - forgetting it and locating again")
+                    self.locator.forget(element)
+                    continue
+            var_name = step.get('save_to')
+            if var_name:
+                self.variables[var_name] = (x, y)
+                self.variables[f"{var_name}_tier"] = result['tier']
+            break
+        return clicked
+    
+    def _action_cv_find_template(self, step: Dict) -> bool:
+        """
+        Akcja cv_find_template - ikona/przycisk z pliku szablonu (bez AI)
+        
+        Returns:
+            Czy kliknięto (wejście wysłane - po kroku czekamy na settle)
+        """
+        if not CV_AVAILABLE or not self.cv_detector:
+            print("  ⚠️  CV Detection not available")
+            return False
+        
+        template_path = step.get('template')
+        scales = step.get('scales', [1.0])
+        frame = self.capture_frame(parse_region(step.get('region')))
+        
+        start = time.time()
+        try:
+            match = self.cv_detector.find_template(
+                frame,
+                template_path,
+                threshold=step.get('threshold', 0.8),
+                scales=scales if isinstance(scales, (list, tuple)) else [scales]
+            )
+        except FileNotFoundError as e:
+            print(f"  ✗ {e}")
+            self.errors.append(str(e))
+            return False
+        elapsed = (time.time() - start) * 1000  # ms
+        clicked = False
+        
+        if match:
+            position = self._to_screen(match['center'], frame)
+            print(f"  ✓ Template {template_path} found at {position} "
+                  f"(score: {match['score']:.2f}, scale: {match['scale']}) in {elapsed:.1f}ms")
+            
+            # Auto-click jeśli nie podano click=false
+            if step.get('click', True):
+                self.controller.click(position[0], position[1])
+                clicked = True
+                print("  ✓ Clicked template")
+            
+            var_name = step.get('save_to')
+            if var_name:
+                self.variables[var_name] = position
+        else:
+            error_msg = f"Template not found on screen: {template_path}"
+            print(f"  ✗ {error_msg} ({elapsed:.1f}ms)")
+            self.errors.append(error_msg)
+        return clicked
+    
+    def _action_cv_find_templates(self, step: Dict) -> bool:
+        """
+        Akcja cv_find_templates - kilka szablonów w jednym przebiegu
+        
+        Returns:
+            Czy kliknięto (wejście wysłane - po kroku czekamy na settle)
+        """
+        if not CV_AVAILABLE or not self.cv_detector:
+            print("  ⚠️  CV Detection not available")
+            return False
+        
+        template_paths = step.get('templates', [])
+        if isinstance(template_paths, str):
+            template_paths = [template_paths]
+        scales = step.get('scales', [1.0])
+        frame = self.capture_frame(parse_region(step.get('region')))
+        
+        start = time.time()
+        try:
+            hits = self.cv_detector.find_templates(
+                frame,
+                template_paths,
+                threshold=step.get('threshold', 0.8),
+                scales=scales if isinstance(scales, (list, tuple)) else [scales],
+                max_hits=step.get('max_hits', 1),
+                overlap=step.get('overlap', 0.3)
+            )
+        except FileNotFoundError as e:
+            print(f"  ✗ {e}")
+            self.errors.append(str(e))
+            return False
+        elapsed = (time.time() - start) * 1000  # ms
+        clicked = False
+        
+        print(f"  ✓ {len(hits)} hits for {len(template_paths)} templates in {elapsed:.1f}ms")
+        for hit in hits:
+            # Wszystkie współrzędne trafienia w układzie całego ekranu (nie obszaru)
+            hit['center'] = self._to_screen(hit['center'], frame)
+            hit['x'], hit['y'] = self._to_screen((hit['x'], hit['y']), frame)
+            print(f"    {hit['template']} at {hit['center']} (score: {hit['score']:.2f})")
+        
+        if hits:
+            best = hits[0]
+            
+            # Auto-click najlepszego trafienia jeśli nie podano click=false
+            if step.get('click', True):
+                self.controller.click(best['center'][0], best['center'][1])
+                clicked = True
+                print(f"  ✓ Clicked {best['template']}")
+            
+            var_name = step.get('save_to')
+            if var_name:
+                self.variables[var_name] = best['center']
+                self.variables[f"{var_name}_template"] = best['template']
+                self.variables[f"{var_name}_hits"] = [
+                    {'template': hit['template'], 'position': hit['center'], 'score': hit['score']}
+                    for hit in hits
+                ]
+        else:
+            error_msg = f"None of the templates found on screen: {', '.join(map(str, template_paths))}"
+            print(f"  ✗ {error_msg}")
+            self.errors.append(error_msg)
+        return clicked
+    
+    def execute_dsl(self, script: List[Dict], scenario_name: str = "test"):
+        """Wykonuje skrypt DSL"""
+        recording_stats = {}
+        
+        self.log(f"Starting scenario: {scenario_name}", "INFO")
+        if self.debug_mode:
+            self.log("Debug mode ENABLED - saving screenshots", "DEBUG")
+        
+        self.settle_stats = {'steps': 0, 'total': 0.0, 'timeouts': 0}
+        recorder_subscription = self._start_capture(scenario_name)
+        
+        open_step = None  # (numer kroku, liczba błędów przed krokiem) - znaczniki w nagraniu
         try:
             for step in script:
+                # Krok kończy się razem z settle, także przy `continue` - znacznik końca przed następnym
+                self._mark_step_end(open_step)
                 self.step_counter += 1
                 action = step.get('action')
+                input_sent = action in INPUT_ACTIONS
+                open_step = (self.step_counter, len(self.errors))
+                if self.recorder:
+                    self.recorder.mark_step_start(self.step_counter, action)
                 
                 self.log(f"Step {self.step_counter}: {action}", "INFO")
                 
                 # Screenshot przed akcją (jeśli debug)
                 if self.debug_mode and action not in ['wait', 'disconnect']:
                     try:
-                        screen = self.controller.capture_screen()
-                        self.save_screenshot(f"before_{action}", screen)
+                        self.save_screenshot(f"before_{action}", self.capture_frame())
                     except Exception as e:
                         self.log(f"Could not save screenshot: {e}", "ERROR")
                 
@@ -425,16 +1576,28 @@ class AutomationEngine:
                     self.log(f"Waiting {seconds}s...", "INFO")
                     time.sleep(seconds)
                 
+                elif action == 'wait_for_change':
+                    self._action_wait_for_change(step)
+                
+                elif action == 'wait_for_stable':
+                    self._action_wait_for_stable(step)
+                
+                elif action == 'wait_for':
+                    self._action_wait_for(step)
+                
                 elif action == 'find_and_click':
                     element = step.get('element')
-                    screen = self.controller.capture_screen()
+                    region = parse_region(step.get('region'))
+                    frame = self.capture_frame(region)
                     print(f"  Searching for: {element}")
-                    print(f"  Screen size: {screen.size}")
+                    print(f"  Screen size: {frame.size}")
+                    if region:
+                        print(f"  Region: {frame.info.get('region')}")
                     
-                    result = self.vision.find_element(screen, element)
+                    result = self.vision.find_element(frame, element)
                     
-                    if result.get('found'):
-                        x, y = result['x'], result['y']
+                    if result and result.get('found'):
+                        x, y = self._to_screen((result['x'], result['y']), frame)
                         confidence = result.get('confidence', 'unknown')
                         print(f"  ✓ Found at ({x}, {y}) - confidence: {confidence}")
                         self.controller.click(x, y)
@@ -444,14 +1607,16 @@ class AutomationEngine:
                         print(f"  Tip: Check if the element is visible on screen")
                         self.errors.append(error_msg)
                 
+                elif action == 'smart_click':
+                    input_sent = self._action_smart_click(step)
+                
                 elif action == 'click':
                     x, y = step.get('x'), step.get('y')
                     self.controller.click(x, y)
                 
                 elif action == 'click_position':
                     # Kliknij w opisaną pozycję (np. "top-left", "center")
-                    screen = self.controller.capture_screen()
-                    width, height = screen.size
+                    width, height = self.capture_frame().size
                     position = step.get('position', 'center').lower()
                     
                     position_map = {
@@ -483,11 +1648,12 @@ class AutomationEngine:
                     self.controller.key_press(key)
                 
                 elif action == 'verify':
-                    screen = self.controller.capture_screen()
+                    frame = self.capture_frame(parse_region(step.get('region')))
                     expected = step.get('expected')
                     response = self.vision.analyze_screen(
-                        screen, 
-                        f"Check if the screen shows: {expected}. Answer only YES or NO."
+                        frame, 
+                        f"Check if the screen shows: {expected}. Answer only YES or NO.",
+                        expect='yes_no'
                     )
                     
                     if 'yes' in response.lower():
@@ -498,9 +1664,9 @@ class AutomationEngine:
                         self.errors.append(error_msg)
                 
                 elif action == 'analyze':
-                    screen = self.controller.capture_screen()
+                    frame = self.capture_frame(parse_region(step.get('region')))
                     question = step.get('question')
-                    response = self.vision.analyze_screen(screen, question)
+                    response = self.vision.analyze_screen(frame, question)
                     print(f"  Analysis: {response}")
                     
                     # Zapisz do zmiennej jeśli podano
@@ -511,8 +1677,7 @@ class AutomationEngine:
                 elif action == 'screenshot':
                     # Manualne zapisanie screenshota
                     name = step.get('name', 'manual')
-                    screen = self.controller.capture_screen()
-                    filepath = self.save_screenshot(name, screen)
+                    filepath = self.save_screenshot(name, self.capture_frame())
                     self.log(f"Screenshot: {filepath}", "SUCCESS")
                 
                 elif action == 'disconnect':
@@ -527,15 +1692,15 @@ class AutomationEngine:
                         print("  ⚠️  CV Detection not available")
                         continue
                     
-                    screen = self.controller.capture_screen()
-                    img_cv = cv2.cvtColor(np.array(screen), cv2.COLOR_RGB2BGR)
+                    frame = self.capture_frame(parse_region(step.get('region')))
                     
                     print("  🔍 CV Detection (fast)...")
                     start = time.time()
-                    results = self.cv_detector.quick_analysis(img_cv)
+                    ctx = self._cv_context(frame, step.get('scale'))
+                    results = self._offset_cv_results(self.cv_detector.quick_analysis(ctx), frame)
                     elapsed = (time.time() - start) * 1000  # ms
                     
-                    print(f"  ✓ Analysis done in {elapsed:.1f}ms")
+                    print(f"  ✓ Analysis done in {elapsed:.1f}ms ({self._cv_analysis_mode(ctx)})")
                     
                     # Pokaż diagnostykę jeśli są problemy
                     diagnostics = results.get('diagnostics', {})
@@ -567,17 +1732,17 @@ class AutomationEngine:
                         print("  ⚠️  CV Detection not available")
                         continue
                     
-                    screen = self.controller.capture_screen()
-                    img_cv = cv2.cvtColor(np.array(screen), cv2.COLOR_RGB2BGR)
+                    frame = self.capture_frame(parse_region(step.get('region')))
                     
-                    dialog = self.cv_detector.detect_dialog_box(img_cv)
+                    dialog = self.cv_detector.detect_dialog_box(frame.bgr)
                     if dialog:
-                        center = dialog['center']
+                        center = self._to_screen(dialog['center'], frame)
                         print(f"  ✓ Dialog found at: {center}")
                         
                         # Auto-click jeśli podano
                         if step.get('click', False):
                             self.controller.click(center[0], center[1])
+                            input_sent = True
                             print(f"  ✓ Clicked dialog center")
                         
                         var_name = step.get('save_to')
@@ -592,11 +1757,10 @@ class AutomationEngine:
                         print("  ⚠️  CV Detection not available")
                         continue
                     
-                    screen = self.controller.capture_screen()
-                    img_cv = cv2.cvtColor(np.array(screen), cv2.COLOR_RGB2BGR)
+                    frame = self.capture_frame(parse_region(step.get('region')))
                     
                     print("  🔍 Looking for Unlock button...")
-                    unlock_pos = self.cv_detector.find_unlock_button(img_cv)
+                    unlock_pos = self._to_screen(self.cv_detector.find_unlock_button(frame.bgr), frame)
                     
                     if unlock_pos:
                         print(f"  ✓ Unlock button found at: {unlock_pos}")
@@ -604,6 +1768,7 @@ class AutomationEngine:
                         # Auto-click jeśli nie podano click=false
                         if step.get('click', True):
                             self.controller.click(unlock_pos[0], unlock_pos[1])
+                            input_sent = True
                             print(f"  ✓ Clicked Unlock button")
                         
                         var_name = step.get('save_to')
@@ -620,10 +1785,9 @@ class AutomationEngine:
                         print("  ⚠️  CV Detection not available")
                         continue
                     
-                    screen = self.controller.capture_screen()
-                    img_cv = cv2.cvtColor(np.array(screen), cv2.COLOR_RGB2BGR)
+                    frame = self.capture_frame(parse_region(step.get('region')))
                     
-                    text_field = self.cv_detector.find_text_field(img_cv)
+                    text_field = self._to_screen(self.cv_detector.find_text_field(frame.bgr), frame)
                     
                     if text_field:
                         print(f"  ✓ Text field found at: {text_field}")
@@ -631,6 +1795,7 @@ class AutomationEngine:
                         # Auto-click jeśli podano
                         if step.get('click', True):
                             self.controller.click(text_field[0], text_field[1])
+                            input_sent = True
                             print(f"  ✓ Clicked text field")
                         
                         var_name = step.get('save_to')
@@ -639,27 +1804,36 @@ class AutomationEngine:
                     else:
                         print(f"  ✗ Text field not found")
                 
+                elif action == 'cv_find_template':
+                    input_sent = self._action_cv_find_template(step)
+                
+                elif action == 'cv_find_templates':
+                    input_sent = self._action_cv_find_templates(step)
+                
                 else:
                     self.log(f"Unknown action: {action}", "ERROR")
                 
                 # Screenshot po akcji (jeśli debug)
                 if self.debug_mode and action not in ['wait', 'disconnect', 'screenshot']:
                     try:
-                        screen = self.controller.capture_screen()
-                        self.save_screenshot(f"after_{action}", screen)
+                        self.save_screenshot(f"after_{action}", self.capture_frame())
                     except Exception as e:
                         self.log(f"Could not save screenshot: {e}", "ERROR")
                 
-                # Krótka przerwa między akcjami
-                time.sleep(0.5)
+                # Czekaj na ustabilizowanie ekranu (tylko po akcjach wejścia lub z `settle` w kroku)
+                if action != 'disconnect':
+                    self.settle_after_step(step, input_sent)
+            
+            self._mark_step_end(open_step)
+            open_step = None
+            self._log_scenario_stats()
+        
+        except Exception as e:
+            self._mark_step_end(open_step, error=str(e) or type(e).__name__)
+            raise
         
         finally:
-            # Zatrzymaj nagrywanie jeśli było aktywne
-            if self.enable_recording and self.recorder:
-                try:
-                    recording_stats = self.recorder.stop_recording()
-                except Exception as e:
-                    print(f"⚠️  Błąd zatrzymania nagrywania: {e}")
+            recording_stats = self._stop_capture(recorder_subscription)
             
             # Zawsze rozłącz połączenie jako zabezpieczenie
             try:
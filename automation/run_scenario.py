@@ -13,7 +13,7 @@ from pathlib import Path
 # Dodaj katalog automation do ścieżki (już jesteśmy w automation/)
 sys.path.insert(0, str(Path(__file__).parent))
 
-from remote_automation import RemoteController, OllamaVision, AutomationEngine
+from remote_automation import RemoteController, OllamaVision, AutomationEngine, DEFAULT_MAX_EDGE
 
 
 def load_scenario(scenario_file: Path):
@@ -73,7 +73,10 @@ def run_scenario(scenario_file: Path, scenario_name: str, enable_recording: bool
         # Inicjalizuj vision
         vision = OllamaVision(
             base_url=ollama_config.get('url', 'http://localhost:11434'),
-            model=ollama_config.get('model', 'llava:7b')
+            model=ollama_config.get('model', 'llava:7b'),
+            image_format=ollama_config.get('image_format', 'png'),
+            image_quality=ollama_config.get('image_quality', 90),
+            max_edge=ollama_config.get('max_edge', DEFAULT_MAX_EDGE)
         )
         
         # Inicjalizuj engine z nagrywaniem i debug mode
@@ -81,7 +84,11 @@ def run_scenario(scenario_file: Path, scenario_name: str, enable_recording: bool
             controller, 
             vision, 
             enable_recording=enable_recording,
-            debug_mode=debug_mode
+            debug_mode=debug_mode,
+            settle=config.get('settle', True),  # Czekanie po akcjach wejścia (patrz parse_settle)
+            cv_analysis_scale=config.get('cv', {}).get('analysis_scale', 1.0),
+            cv_parallel=config.get('cv', {}).get('parallel', False),
+            recording_options=config.get('recording')
         )
         
         # Uruchom scenariusz
@@ -1,28 +1,157 @@
 #!/usr/bin/env python3
 """
 Screen Recorder - nagrywanie ekranu VNC do plików MP4
-Używa OpenCV do kompresji wideo i zachowania historii testów
+Używa OpenCV (lub ffmpeg/libx264) do kompresji wideo i zachowania historii testów
 """
 
 import cv2
+import json
 import numpy as np
 from PIL import Image
+import queue
+import shutil
+import subprocess
+import tempfile
 import threading
 import time
 from pathlib import Path
+from collections import deque
 from datetime import datetime
 from typing import Optional, Callable
 
+from frame import Frame
+
+# Co zrobić z nową klatką, gdy koder nie nadąża i kolejka jest pełna
+DROP_POLICIES = ('oldest', 'newest')
+
+# Kodery: cv2.VideoWriter lub proces ffmpeg (libx264) karmiony surowymi klatkami przez stdin
+BACKENDS = ('opencv', 'ffmpeg')
+
+
+class FfmpegWriter:
+    """
+    Koder libx264 w osobnym procesie ffmpeg - surowe klatki BGR przez stdin
+    
+    Interfejs jak cv2.VideoWriter (isOpened / write / release). Kodowanie
+    odbywa się poza procesem Pythona, w `threads` wątkach ffmpeg.
+    """
+    
+    def __init__(self, path: Path, fps: float, size: tuple, crf: int = 23,
+                 preset: str = 'veryfast', threads: int = 0):
+        """
+        Args:
+            path: Plik wyjściowy (.mp4)
+            fps: Klatki na sekundę
+            size: Rozmiar klatek (width, height)
+            crf: Jakość libx264 (0-51, mniej = lepiej; 23 domyślnie, 28 - mniejsze pliki)
+            preset: Szybkość kodowania libx264 (ultrafast ... veryslow)
+            threads: Wątki kodera (0 = automatycznie)
+        """
+        self.path = Path(path)
+        self.size = tuple(size)
+        width, height = self.size
+        command = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{width}x{height}", '-r', str(fps), '-i', '-',
+            '-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-threads', str(threads),
+            '-g', str(max(1, int(fps * 2))),  # klatka kluczowa co 2s - szybkie przewijanie
+            '-pix_fmt', 'yuv420p',
+        ]
+        if width % 2 or height % 2:
+            # yuv420p wymaga parzystych wymiarów
+            command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+        command += ['-movflags', '+faststart', str(self.path)]
+        
+        self._stderr = tempfile.TemporaryFile()
+        try:
+            self._process: Optional[subprocess.Popen] = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr
+            )
+        except OSError as e:
+            print(f"⚠️  Nie można uruchomić ffmpeg: {e}")
+            self._process = None
+    
+    def isOpened(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+    
+    def write(self, frame: np.ndarray):
+        """Wyślij klatkę BGR do ffmpeg (rozmiar musi zgadzać się z `size`)"""
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            raise ValueError(f"Rozmiar klatki {frame.shape[1]}x{frame.shape[0]} "
+                             f"!= rozmiar wideo {self.size[0]}x{self.size[1]}")
+        try:
+            self._process.stdin.write(np.ascontiguousarray(frame).data)
+        except (BrokenPipeError, ValueError):
+            raise RuntimeError(f"ffmpeg zakończył pracę: {self._error_output()}")
+    
+    def release(self):
+        """Zamknij stdin i poczekaj, aż ffmpeg dokończy plik"""
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            code = self._process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            code = self._process.wait()
+        if code:
+            print(f"⚠️  ffmpeg: kod wyjścia {code}: {self._error_output()}")
+        self._process = None
+        self._stderr.close()
+    
+    def _error_output(self) -> str:
+        self._stderr.seek(0)
+        return self._stderr.read().decode('utf-8', 'replace').strip()[-500:]
+
 
 class ScreenRecorder:
-    """Nagrywa ekran podczas testów automatyzacji"""
+    """
+    Nagrywa ekran podczas testów automatyzacji
+    
+    Dwa wątki połączone ograniczoną kolejką: przechwytywanie (co 1/fps
+    według zegara, klatka + czas przechwycenia) i kodowanie (konwersja
+    + zapis). Wolne przechwytywanie nie przyspiesza filmu: koder powiela
+    ostatnią klatkę w taktach, w których nic nie przyszło, więc czas
+    w filmie odpowiada czasowi rzeczywistemu.
+    
+    W trybie change_aware (VFR) zapisywane są tylko klatki różne od
+    ostatnio zapisanej, a czas każdej zapisanej klatki trafia do pliku
+    <film>.timestamps.txt (format "timestamp format v2" mkvmerge).
+    
+    Rozmiar filmu to geometria pierwszej klatki albo - z `resolution` -
+    zmniejszony do niej obraz (proporcje zachowane, bez powiększania).
+    Skalowanie odbywa się w wątku kodującym.
+    
+    Z segment_seconds nagranie jest dzielone na pliki <nazwa>_000.mp4,
+    <nazwa>_001.mp4, ... po segment_seconds sekund filmu - awaria procesu
+    traci co najwyżej bieżący segment.
+    
+    Znaczniki kroków (mark_step_start / mark_step_end) trafiają do indeksu
+    <nazwa>.steps.json: dla każdego kroku plik, numer klatki i czas w filmie
+    jego początku i końca - bez przeglądania całego nagrania.
+    """
     
     def __init__(
         self, 
         output_dir: str = "results/videos",
         fps: int = 10,
         codec: str = "mp4v",
-        quality: int = 80
+        quality: int = 80,
+        queue_size: int = 30,
+        drop_policy: str = 'oldest',
+        change_aware: bool = False,
+        max_static_gap: float = 10.0,
+        backend: str = 'opencv',
+        crf: int = 23,
+        preset: str = 'veryfast',
+        threads: int = 0,
+        segment_seconds: Optional[float] = None,
+        resolution: Optional[tuple] = None,
+        interpolation: int = cv2.INTER_LINEAR,
+        overlay_steps: bool = False
     ):
         """
         Args:
@@ -30,65 +159,148 @@ class ScreenRecorder:
             fps: Klatki na sekundę (10-30 zalecane)
             codec: Kodek wideo ('mp4v', 'avc1', 'h264')
             quality: Jakość kompresji 0-100
+            queue_size: Maks. liczba klatek czekających na zakodowanie
+            drop_policy: Gdy kolejka jest pełna: 'oldest' - wyrzuć najstarszą
+                czekającą klatkę, 'newest' - pomiń nowo przechwyconą
+            change_aware: Zapisuj tylko zmienione klatki + plik z czasami klatek (VFR)
+            max_static_gap: W trybie change_aware zapisz klatkę co najmniej co
+                tyle sekund, nawet bez zmian (przewijanie, odtwarzacze bez VFR)
+            backend: Koder - 'opencv' (cv2.VideoWriter, `codec`) lub 'ffmpeg'
+                (libx264 w procesie ffmpeg: `crf`, `preset`, `threads`)
+            crf: ffmpeg - jakość libx264 (0-51, mniej = lepiej)
+            preset: ffmpeg - szybkość kodowania libx264 (ultrafast ... veryslow)
+            threads: ffmpeg - wątki kodera (0 = automatycznie)
+            segment_seconds: Dziel nagranie na pliki po tyle sekund (None = jeden plik)
+            resolution: Maks. rozmiar filmu (width, height) - większe ekrany są
+                zmniejszane z zachowaniem proporcji (None = rozmiar ekranu)
+            interpolation: Interpolacja cv2.resize przy zmniejszaniu
+                (INTER_LINEAR - szybka, INTER_AREA - ostrzejszy tekst, ~4x wolniej)
+            overlay_steps: Wypalaj na klatkach napis "Step N: akcja" trwającego kroku
         """
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Nieznana polityka drop_policy: {drop_policy} (dostępne: {', '.join(DROP_POLICIES)})")
+        if backend not in BACKENDS:
+            raise ValueError(f"Nieznany backend: {backend} (dostępne: {', '.join(BACKENDS)})")
+        if backend == 'ffmpeg' and shutil.which('ffmpeg') is None:
+            print(f"⚠️  ffmpeg nie jest zainstalowany - nagrywanie przez OpenCV ({codec})")
+            backend = 'opencv'
+        
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
         self.fps = fps
         self.codec = cv2.VideoWriter_fourcc(*codec)
         self.quality = quality
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.change_aware = change_aware
+        self.max_static_gap = max_static_gap
+        self.backend = backend
+        self.crf = crf
+        self.preset = preset
+        self.threads = threads
+        self.segment_seconds = segment_seconds
+        self.resolution = tuple(resolution) if resolution else None
+        self.interpolation = interpolation
+        self.overlay_steps = overlay_steps
         
         self.video_writer: Optional[cv2.VideoWriter] = None
         self.recording = False
-        self.recording_thread: Optional[threading.Thread] = None
+        self.recording_thread: Optional[threading.Thread] = None  # przechwytywanie
+        self.encode_thread: Optional[threading.Thread] = None
         self.capture_func: Optional[Callable] = None
         
-        self.current_file: Optional[Path] = None
-        self.frame_count = 0
+        self.current_file: Optional[Path] = None     # pierwszy (lub jedyny) plik nagrania
+        self.segments: list = []                     # wszystkie pliki nagrania
+        self.timestamps_file: Optional[Path] = None
+        self.steps_file: Optional[Path] = None       # indeks kroków (mark_step_*)
+        self.steps: list = []
+        self.frame_count = 0      # klatki zapisane do pliku (razem z powielonymi)
+        self.captured = 0         # klatki przechwycone
+        self.dropped = 0          # przechwycone, ale wyrzucone z pełnej kolejki
+        self.late = 0             # przechwycone dla taktu, który jest już zapisany
+        self.duplicated = 0       # powtórzenia ostatniej klatki w pustych taktach
+        self.unchanged = 0        # change_aware: klatki identyczne z ostatnio zapisaną (pominięte)
+        self.capture_errors = 0
         self.start_time: Optional[float] = None
+        
+        self._queue: Optional[queue.Queue] = None
+        self._first_capture: Optional[float] = None  # time.monotonic() pierwszej klatki = 0s filmu
+        self._stop_clock: Optional[float] = None
+        self._timestamps = None       # otwarty plik czasów klatek (change_aware)
+        self._last_screen = None      # ostatnio zapisana klatka (obiekt z capture_func)
+        self._last_frame: Optional[np.ndarray] = None
+        self._last_source: Optional[np.ndarray] = None  # _last_frame przed skalowaniem
+        self._last_written = 0.0      # time.monotonic() ostatnio zapisanej klatki
+        self._base_name = ''
+        self._target_size: Optional[tuple] = None   # resolution bieżącego nagrania
+        self.source_size: Optional[tuple] = None    # (width, height) pierwszej klatki
+        self.frame_size: Optional[tuple] = None     # (width, height) filmu
+        self._segment_index = 0
+        self._segment_frames = 0      # klatki zapisane w bieżącym segmencie
+        self._position: Optional[dict] = None  # ostatnio zapisana klatka: plik, numer, czas
+        self._markers: deque = deque()          # znaczniki kroków czekające na przypisanie klatki
+        self._overlay_text: Optional[str] = None
     
     def start_recording(
         self, 
         scenario_name: str, 
         capture_func: Callable[[], Image.Image],
-        resolution: tuple = (1280, 720)
+        resolution: Optional[tuple] = None
     ) -> Path:
         """
         Rozpocznij nagrywanie
         
         Args:
             scenario_name: Nazwa scenariusza testowego
-            capture_func: Funkcja zwracająca PIL.Image z aktualnym ekranem
-            resolution: Rozdzielczość wideo (width, height)
+            capture_func: Funkcja zwracająca Frame lub PIL.Image z aktualnym ekranem
+            resolution: Maks. rozmiar filmu (width, height); domyślnie
+                `resolution` z konstruktora, bez niego - rozmiar ekranu
         
         Returns:
-            Path do pliku wideo
+            Path do pliku wideo (plik powstaje przy pierwszej klatce, gdy znany jest rozmiar ekranu)
         """
         if self.recording:
             raise RuntimeError("Nagrywanie już trwa!")
         
         # Nazwa pliku z timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{scenario_name}_{timestamp}.mp4"
-        self.current_file = self.output_dir / filename
-        
-        # Inicjalizuj VideoWriter
-        self.video_writer = cv2.VideoWriter(
-            str(self.current_file),
-            self.codec,
-            self.fps,
-            resolution
-        )
+        self._base_name = f"{scenario_name}_{timestamp}"
+        self._target_size = tuple(resolution) if resolution else self.resolution
+        self.source_size = None
+        self.frame_size = None
+        self.segments = []
+        self._segment_index = 0
         
-        if not self.video_writer.isOpened():
-            raise RuntimeError(f"Nie można otworzyć pliku wideo: {self.current_file}")
+        # Koder (pierwszy segment) otwiera wątek kodujący przy pierwszej klatce
+        self.current_file = self._segment_path(0)
+        self.timestamps_file = self.current_file.with_suffix('.timestamps.txt') if self.change_aware else None
+        self.steps_file = None
+        self.steps = []
+        self._markers.clear()
+        self._position = None
+        self._overlay_text = None
         
         self.capture_func = capture_func
         self.recording = True
         self.frame_count = 0
+        self.captured = 0
+        self.dropped = 0
+        self.late = 0
+        self.duplicated = 0
+        self.unchanged = 0
+        self.capture_errors = 0
         self.start_time = time.time()
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._first_capture = None
+        self._stop_clock = None
+        self._last_screen = None
+        self._last_frame = None
+        self._last_source = None
         
-        # Uruchom wątek nagrywania
+        # Uruchom wątki przechwytywania i kodowania
+        self.encode_thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self.encode_thread.start()
         self.recording_thread = threading.Thread(target=self._recording_loop, daemon=True)
         self.recording_thread.start()
         
@@ -96,31 +308,318 @@ class ScreenRecorder:
         return self.current_file
     
     def _recording_loop(self):
-        """Wątek nagrywający klatki"""
+        """Wątek przechwytujący: klatka co 1/fps (takty według zegara, bez dryfu) -> kolejka"""
         frame_interval = 1.0 / self.fps
+        next_tick = time.monotonic()
         
-        while self.recording:
-            loop_start = time.time()
-            
+        # Bez działającego kodera przechwytywanie nie ma sensu
+        while self.recording and self.encode_thread.is_alive():
             try:
-                # Pobierz screenshot
+                # Pobierz screenshot (None = brak klatki, np. przed połączeniem)
+                captured_at = time.monotonic()
                 screen = self.capture_func()
                 
-                # Konwertuj PIL Image -> OpenCV format
-                frame = self._pil_to_opencv(screen)
-                
-                # Zapisz klatkę
-                if frame is not None:
-                    self.video_writer.write(frame)
-                    self.frame_count += 1
+                if screen is not None:
+                    self.captured += 1
+                    self._enqueue((captured_at, screen))
                 
             except Exception as e:
+                self.capture_errors += 1
                 print(f"⚠️  Błąd podczas nagrywania klatki: {e}")
             
-            # Czekaj do następnej klatki
-            elapsed = time.time() - loop_start
-            sleep_time = max(0, frame_interval - elapsed)
-            time.sleep(sleep_time)
+            # Czekaj do następnego taktu; takty przegapione przez wolne przechwytywanie
+            # są pomijane - koder wypełni je powieloną klatką
+            next_tick += frame_interval
+            now = time.monotonic()
+            if now > next_tick:
+                next_tick += ((now - next_tick) // frame_interval + 1) * frame_interval
+            time.sleep(next_tick - now)
+    
+    def _enqueue(self, item: tuple):
+        """Wstaw klatkę do kolejki kodera zgodnie z drop_policy"""
+        try:
+            self._queue.put_nowait(item)
+            return
+        except queue.Full:
+            self.dropped += 1
+        
+        if self.drop_policy == 'newest':
+            return
+        try:
+            self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self._queue.put_nowait(item)
+    
+    def _encode_loop(self):
+        """
+        Wątek kodujący: klatki z kolejki -> plik
+        
+        Klatka trafia do taktu round((czas przechwycenia - pierwsza klatka) * fps).
+        Puste takty przed nią wypełnia powielona poprzednia klatka; klatka
+        dla taktu, który jest już zapisany, jest pomijana. Po zatrzymaniu
+        film jest dopełniany ostatnią klatką do chwili stop_recording.
+        W trybie change_aware - patrz _encode_changed.
+        """
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                
+                try:
+                    captured_at, screen = item
+                    if self.change_aware and self._is_unchanged(screen, captured_at):
+                        self.unchanged += 1
+                        continue
+                    
+                    # Konwertuj PIL Image -> OpenCV format i przeskaluj do rozmiaru filmu
+                    source = self._pil_to_opencv(screen)
+                    if source is None:
+                        continue
+                    frame = self._fit(source)
+                    
+                    if self._first_capture is None:
+                        self._first_capture = captured_at
+                    if self.change_aware:
+                        self._encode_changed(screen, source, frame, captured_at)
+                        continue
+                    
+                    slot = int(round((captured_at - self._first_capture) * self.fps))
+                    if slot < self.frame_count:
+                        self.late += 1
+                        continue
+                    
+                    self._write_duplicates(self._last_frame, slot - self.frame_count)
+                    self._write(frame, self.frame_count / self.fps)
+                    self._last_frame = frame
+                
+                except RuntimeError as e:
+                    # Koder nie działa (nie można otworzyć pliku, ffmpeg zakończył pracę) - koniec zapisu
+                    print(f"❌ Błąd kodera, nagrywanie przerwane: {e}")
+                    return
+                except Exception as e:
+                    print(f"⚠️  Błąd podczas kodowania klatki: {e}")
+            
+            self._finish()
+        finally:
+            self._close_segment()
+            self._save_steps()
+    
+    # ===== Pliki (segmenty) =====
+    
+    def _segment_path(self, index: int) -> Path:
+        if self.segment_seconds:
+            return self.output_dir / f"{self._base_name}_{index:03d}.mp4"
+        return self.output_dir / f"{self._base_name}.mp4"
+    
+    def _open_segment(self, index: int):
+        """Otwórz koder (i plik czasów klatek) segmentu `index`"""
+        path = self._segment_path(index)
+        if self.backend == 'ffmpeg':
+            writer = FfmpegWriter(path, self.fps, self.frame_size, self.crf, self.preset, self.threads)
+        else:
+            writer = cv2.VideoWriter(str(path), self.codec, self.fps, self.frame_size)
+        
+        if not writer.isOpened():
+            raise RuntimeError(f"Nie można otworzyć pliku wideo: {path}")
+        
+        self.video_writer = writer
+        self.segments.append(path)
+        self._segment_index = index
+        self._segment_frames = 0
+        self._timestamps = None
+        if self.change_aware:
+            self._timestamps = open(path.with_suffix('.timestamps.txt'), 'w', encoding='utf-8')
+            self._timestamps.write("# timestamp format v2\n")
+    
+    def _close_segment(self):
+        if self.video_writer:
+            self.video_writer.release()
+            self.video_writer = None
+        if self._timestamps:
+            self._timestamps.close()
+            self._timestamps = None
+    
+    def _write(self, frame: np.ndarray, video_time: float):
+        """
+        Zapisz klatkę, która w filmie wypada w `video_time` sekund
+        
+        Przy segment_seconds klatka z kolejnego przedziału czasu otwiera
+        nowy plik (numer pliku = numer przedziału, także po długiej ciszy VFR).
+        """
+        if self.video_writer is None and not self.segments:
+            self._open_segment(0)
+        segment_time = video_time
+        if self.segment_seconds:
+            index = int(video_time // self.segment_seconds)
+            if index > self._segment_index:
+                self._close_segment()
+                self._open_segment(index)
+                segment_start = index * self.segment_seconds
+                if self.change_aware and self._last_frame is not None and video_time > segment_start:
+                    # Segment VFR zaczyna się od stanu ekranu z poprzedniego - każdy plik jest samodzielny
+                    self._put(self._last_frame, segment_start, 0.0)
+                    self.duplicated += 1
+            segment_time -= self._segment_index * self.segment_seconds
+        
+        self._put(frame, video_time, segment_time)
+        if self._timestamps:
+            self._timestamps.flush()
+    
+    def _put(self, frame: np.ndarray, video_time: float, segment_time: float):
+        """Zapisz jedną klatkę do bieżącego segmentu (znaczniki kroków, napis, czas klatki)"""
+        self._resolve_markers(video_time, segment_time)
+        if self._overlay_text:
+            frame = self.add_text_overlay(frame.copy(), self._overlay_text)
+        
+        self.video_writer.write(frame)
+        self.frame_count += 1
+        if self._timestamps:
+            self._timestamps.write(f"{segment_time * 1000:.1f}\n")
+        self._position = self._frame_position(self._segment_frames, segment_time)
+        self._segment_frames += 1
+    
+    def _frame_position(self, frame_number: int, segment_time: float) -> dict:
+        """
+        Pozycja klatki w bieżącym segmencie
+        
+        `time` to czas w pliku MP4 (stałe fps, frame / fps). W trybie change_aware
+        plik ma mniej klatek niż czasu nagrania - `vfr_time` to czas tej klatki
+        po remuksie z <nazwa>.timestamps.txt (mkvmerge).
+        """
+        position = {
+            'file': self.segments[-1].name,
+            'frame': frame_number,
+            'time': round(frame_number / self.fps, 3),
+        }
+        if self.change_aware:
+            position['vfr_time'] = round(segment_time, 3)
+        return position
+    
+    # ===== Znaczniki kroków =====
+    
+    def mark_step_start(self, index: int, action: str):
+        """Początek kroku scenariusza (wywoływane z wątku wykonującego scenariusz)"""
+        if not self.recording:
+            return
+        step = {'index': index, 'action': action, 'status': None,
+                'started': round(time.time() - self.start_time, 3)}
+        self.steps.append(step)
+        self._markers.append((time.monotonic(), 'start', step))
+    
+    def mark_step_end(self, index: int, status: str = 'ok', error: Optional[str] = None):
+        """Koniec kroku `index` - status 'ok', 'failed' lub 'error' (+ opis błędu)"""
+        if not self.recording:
+            return
+        for step in reversed(self.steps):
+            if step['index'] == index:
+                step['status'] = status
+                step['ended'] = round(time.time() - self.start_time, 3)
+                if error:
+                    step['error'] = error
+                self._markers.append((time.monotonic(), 'end', step))
+                return
+    
+    def _resolve_markers(self, video_time: float, segment_time: float):
+        """
+        Przypisz znacznikom klatki przed zapisem klatki z chwili `video_time`
+        
+        Znacznik dostaje klatkę widoczną w chwili znacznika: ostatnio
+        zapisaną, jeśli znacznik jest wcześniejszy od zapisywanej klatki,
+        albo zapisywaną (znacznik sprzed pierwszej klatki lub równoczesny).
+        """
+        while self._markers:
+            marked_at, kind, step = self._markers[0]
+            marker_time = marked_at - self._first_capture
+            if marker_time > video_time:
+                break
+            self._markers.popleft()
+            if self._position is not None and marker_time < video_time:
+                position = dict(self._position)
+            else:
+                position = self._frame_position(self._segment_frames, segment_time)
+            position['video_time'] = round(max(marker_time, 0.0), 3)
+            step[kind] = position
+            if self.overlay_steps:
+                self._overlay_text = f"Step {step['index']}: {step['action']}" if kind == 'start' else None
+    
+    def _save_steps(self):
+        """Zapisz indeks kroków <nazwa>.steps.json (znaczniki po ostatniej klatce -> ostatnia klatka)"""
+        if not self.steps:
+            return
+        while self._markers:
+            marked_at, kind, step = self._markers.popleft()
+            if self._position is not None:
+                step[kind] = dict(self._position, video_time=round(marked_at - self._first_capture, 3))
+        
+        self.steps_file = self.output_dir / f"{self._base_name}.steps.json"
+        index = {
+            'fps': self.fps,
+            'change_aware': self.change_aware,
+            'segments': [path.name for path in self.segments],
+            'steps': self.steps,
+        }
+        try:
+            with open(self.steps_file, 'w', encoding='utf-8') as f:
+                json.dump(index, f, indent=2, ensure_ascii=False)
+        except OSError as e:
+            print(f"⚠️  Nie można zapisać indeksu kroków: {e}")
+            self.steps_file = None
+    
+    def _finish(self):
+        """Dopełnij film do chwili zatrzymania - długość filmu = czas nagrywania"""
+        if self._last_frame is None or self._stop_clock is None:
+            return
+        if self.change_aware:
+            # Ostatnia klatka jeszcze raz z czasem zatrzymania - inaczej jej czas trwania jest nieznany
+            if self._stop_clock > self._last_written:
+                self._write_timestamped(self._last_frame, self._stop_clock)
+                self.duplicated += 1
+            return
+        end_slot = int((self._stop_clock - self._first_capture) * self.fps)
+        self._write_duplicates(self._last_frame, end_slot - self.frame_count + 1)
+    
+    def _is_unchanged(self, screen, captured_at: float) -> bool:
+        """
+        change_aware: czy klatka jest identyczna z ostatnio zapisaną
+        
+        Ten sam obiekt Frame (mirror VNC zwraca poprzednią klatkę, gdy ekran
+        się nie zmienił) lub te same piksele. Co max_static_gap sekund
+        klatka jest zapisywana mimo braku zmian.
+        """
+        if self._last_frame is None or captured_at - self._last_written >= self.max_static_gap:
+            return False
+        if screen is self._last_screen:
+            return True
+        if isinstance(screen, Frame):
+            frame = screen.bgr
+        else:
+            frame = self._pil_to_opencv(screen)
+            if frame is None:
+                return False
+        # Porównanie przed skalowaniem - drobne zmiany nie giną w zmniejszonym obrazie
+        return frame.shape == self._last_source.shape and cv2.norm(frame, self._last_source, cv2.NORM_INF) == 0
+    
+    def _encode_changed(self, screen, source: np.ndarray, frame: np.ndarray, captured_at: float):
+        """change_aware: zapisz zmienioną klatkę z jej czasem (bez powielania pustych taktów)"""
+        self._write_timestamped(frame, captured_at)
+        self._last_screen = screen
+        self._last_source = source
+        self._last_frame = frame
+    
+    def _write_timestamped(self, frame: np.ndarray, captured_at: float):
+        """Zapisz klatkę z jej czasem (od pierwszej klatki) w pliku czasów"""
+        self._write(frame, captured_at - self._first_capture)
+        self._last_written = captured_at
+    
+    def _write_duplicates(self, frame: Optional[np.ndarray], count: int):
+        """Powtórz klatkę `count` razy (puste takty)"""
+        if frame is None:
+            return
+        for _ in range(count):
+            self._write(frame, self.frame_count / self.fps)
+            self.duplicated += 1
     
     def stop_recording(self) -> dict:
         """
@@ -132,37 +631,69 @@ class ScreenRecorder:
         if not self.recording:
             return {}
         
+        stop_time = time.time()
+        self._stop_clock = time.monotonic()
         self.recording = False
         
-        # Poczekaj na zakończenie wątku
+        # Poczekaj na zakończenie przechwytywania, potem aż koder opróżni kolejkę i zamknie plik
         if self.recording_thread:
             self.recording_thread.join(timeout=5)
+        if self.encode_thread and self.encode_thread.is_alive():
+            try:
+                # Zawieszony koder nie opróżni pełnej kolejki - nie czekamy w nieskończoność
+                self._queue.put(None, timeout=30)
+                self.encode_thread.join(timeout=30)
+            except queue.Full:
+                pass
+            if self.encode_thread.is_alive():
+                print("⚠️  Koder nie zakończył zapisu w 30s - plik może być niekompletny")
         
-        # Zamknij plik wideo
-        if self.video_writer:
-            self.video_writer.release()
-        
-        duration = time.time() - self.start_time if self.start_time else 0
+        duration = stop_time - self.start_time if self.start_time else 0
         
         stats = {
             'file': str(self.current_file),
             'frames': self.frame_count,
+            'captured': self.captured,
+            'dropped': self.dropped + self.late,
+            'duplicated': self.duplicated,
+            'capture_errors': self.capture_errors,
+            'capture_fps': round(self.captured / duration, 2) if duration > 0 else 0.0,
             'duration': f"{duration:.2f}s",
             'fps': self.fps,
-            'size_mb': self.current_file.stat().st_size / (1024 * 1024) if self.current_file.exists() else 0
+            'resolution': f"{self.frame_size[0]}x{self.frame_size[1]}" if self.frame_size else None,
+            'backend': self.backend,
+            'segments': [str(path) for path in self.segments],
+            'steps_file': str(self.steps_file) if self.steps_file else None,
+            'size_mb': sum(path.stat().st_size for path in self.segments if path.exists()) / (1024 * 1024)
         }
+        if self.change_aware:
+            stats['unchanged'] = self.unchanged
+            stats['timestamps'] = str(self.timestamps_file)
         
         print(f"✅ Nagrywanie zakończone:")
         print(f"   📁 Plik: {stats['file']}")
-        print(f"   🎬 Klatki: {stats['frames']}")
+        if stats['resolution']:
+            print(f"   🖥️  Rozdzielczość: {stats['resolution']}")
+        if len(self.segments) > 1:
+            print(f"   🧩 Segmenty: {len(self.segments)} (po {self.segment_seconds:g}s)")
+        print(f"   🎬 Klatki: {stats['frames']} (przechwycone {stats['captured']}, "
+              f"{stats['capture_fps']:.1f}/s; pominięte {stats['dropped']}, powielone {stats['duplicated']})")
+        if self.change_aware:
+            print(f"   🧊 Bez zmian (niezapisane): {stats['unchanged']}, czasy klatek: {stats['timestamps']}")
+        if stats['steps_file']:
+            print(f"   🧭 Indeks kroków: {stats['steps_file']} ({len(self.steps)} kroków)")
         print(f"   ⏱️  Czas: {stats['duration']}")
         print(f"   💾 Rozmiar: {stats['size_mb']:.2f} MB")
         
         return stats
     
-    def _pil_to_opencv(self, pil_image: Image.Image) -> Optional[np.ndarray]:
-        """Konwertuj PIL Image do formatu OpenCV (BGR)"""
+    def _pil_to_opencv(self, pil_image) -> Optional[np.ndarray]:
+        """Konwertuj PIL Image (lub Frame) do formatu OpenCV (BGR)"""
         try:
+            # Frame ma już (współdzielony) widok BGR - bez ponownej konwersji
+            if isinstance(pil_image, Frame):
+                return pil_image.bgr
+            
             # Konwertuj do RGB
             if pil_image.mode != 'RGB':
                 pil_image = pil_image.convert('RGB')
@@ -173,14 +704,36 @@ class ScreenRecorder:
             # RGB -> BGR (OpenCV używa BGR)
             frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
             
-            # Skaluj jeśli potrzeba (opcjonalnie dodaj kompresję)
-            # frame = cv2.resize(frame, (1280, 720))
-            
             return frame
         except Exception as e:
             print(f"⚠️  Błąd konwersji obrazu: {e}")
             return None
     
+    def _fit(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Przeskaluj klatkę do rozmiaru filmu
+        
+        Pierwsza klatka ustala rozmiar: geometria ekranu zmniejszona do
+        resolution (proporcje zachowane, bez powiększania). Klatki o innej
+        geometrii (zmiana rozdzielczości VNC w trakcie) są skalowane do tego
+        samego rozmiaru - koder przyjmuje tylko klatki o rozmiarze pliku.
+        """
+        height, width = frame.shape[:2]
+        if self.frame_size is None:
+            self.source_size = (width, height)
+            self.frame_size = self.source_size
+            if self._target_size:
+                scale = min(self._target_size[0] / width, self._target_size[1] / height, 1.0)
+                self.frame_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            print(f"   🖥️  Ekran {width}x{height} -> film {self.frame_size[0]}x{self.frame_size[1]}")
+        elif (width, height) != self.source_size:
+            print(f"⚠️  Rozmiar ekranu zmienił się: {self.source_size[0]}x{self.source_size[1]} -> {width}x{height}")
+            self.source_size = (width, height)
+        
+        if (width, height) == self.frame_size:
+            return frame
+        return cv2.resize(frame, self.frame_size, interpolation=self.interpolation)
+    
     def add_text_overlay(self, frame: np.ndarray, text: str, position=(10, 30)) -> np.ndarray:
         """Dodaj tekst na klatkę (np. timestamp, action)"""
         font = cv2.FONT_HERSHEY_SIMPLEX
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Smart Locator - kaskadowe wyszukiwanie elementu na ekranie
+Szablony (milisekundy) → heurystyki CV (milisekundy) → model vision (sekundy)
+"""
+
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from frame import Frame
+
+# Kolejność poziomów kaskady
+TIERS = ('template', 'cv', 'vlm')
+
+# Słowa kluczowe w opisie elementu -> heurystyka CV (sprawdzane po kolei)
+CV_HINTS = [
+    ('text_field', ['text field', 'input', 'password', 'username', 'search box', 'address bar']),
+    ('unlock', ['unlock', 'login', 'log in', 'sign in', 'ok button']),
+    ('dialog', ['dialog']),
+    ('button', ['button']),
+]
+
+# Pewność heurystyk CV (0-1) - heurystyki nie wiedzą, CO znalazły, tylko GDZIE coś pasuje
+CV_CONFIDENCE = {
+    'text_field': 0.7,
+    'unlock': 0.7,
+    'dialog': 0.8,
+    'button': 0.9,            # dokładnie jeden przycisk na ekranie (lub w regionie)
+    'button_ambiguous': 0.4,  # wiele przycisków - bierzemy pierwszy od góry
+}
+
+LEARNED_PATCH_SIZE = (64, 40)    # wycinek (w, h) zapamiętywany wokół elementu znalezionego przez VLM
+LEARNED_MIN_SCORE = 0.9          # zapamiętane wycinki muszą pasować prawie idealnie
+LEARNED_MIN_CONTRAST = 8.0       # nie zapamiętuj jednolitych wycinków (pasowałyby wszędzie)
+
+
+def _slug(text: str) -> str:
+    """Nazwa pliku z opisu elementu"""
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')[:80] or 'element'
+
+
+class SmartLocator:
+    """
+    Lokalizator elementów: najtańszy poziom, który da pewną odpowiedź, wygrywa
+
+    1. template - pliki szablonów z kroku oraz wycinki zapamiętane po
+       wcześniejszych trafieniach VLM (results/locator_templates)
+    2. cv       - heurystyki CVDetector wybrane na podstawie opisu elementu
+                  (pole tekstowe, przycisk Unlock/OK, dialog, przycisk)
+    3. vlm      - OllamaVision.find_element, tylko gdy tańsze poziomy nie
+                  znalazły elementu lub ich pewność < min_confidence
+
+    Każde wywołanie zwraca, który poziom odpowiedział i ile trwał każdy z nich.
+    """
+
+    def __init__(self, cv_detector, vision, learned_dir: Optional[str] = '/app/results/locator_templates'):
+        """
+        Args:
+            cv_detector: CVDetector (lub None - tylko VLM)
+            vision: OllamaVision (lub None - bez VLM)
+            learned_dir: Katalog zapamiętanych wycinków (None = tylko w pamięci)
+        """
+        self.cv_detector = cv_detector
+        self.vision = vision
+        self.learned_dir = Path(learned_dir) if learned_dir else None
+        self._learned: Dict[str, Optional[np.ndarray]] = {}
+        self.stats = {tier: {'hits': 0, 'calls': 0, 'time_ms': 0.0} for tier in TIERS}
+
+    def locate(self, frame: Frame, element: str, templates: Optional[List[str]] = None,
+               cv: Optional[str] = None, threshold: float = 0.8,
+               min_confidence: float = 0.6, use_vlm: bool = True, learn: bool = True) -> Dict:
+        """
+        Znajdź element na klatce
+
+        Args:
+            frame: Klatka (pełny ekran lub region)
+            element: Opis elementu (dla VLM i do zapamiętanych wycinków)
+            templates: Ścieżki plików szablonów
+            cv: Heurystyka CV (text_field, unlock, dialog, button, none);
+                domyślnie zgadywana z opisu elementu
+            threshold: Minimalne dopasowanie szablonu (0-1)
+            min_confidence: Minimalna pewność, żeby nie pytać kolejnego poziomu
+            use_vlm: Czy wolno użyć modelu vision
+            learn: Zapamiętaj wycinek wokół elementu znalezionego przez VLM
+                (tylko dokładna pozycja z pewnością >= min_confidence)
+
+        Returns:
+            {'found', 'x', 'y', 'tier', 'confidence', 'learned', 'timings': {poziom: ms}}
+            - współrzędne względem klatki; learned=True, gdy trafił zapamiętany
+            wycinek (patrz forget - gdy kliknięcie w niego nic nie zmienia)
+        """
+        result = {'found': False, 'x': None, 'y': None, 'tier': None, 'confidence': 0.0,
+                  'learned': False, 'timings': {}}
+        best = None  # najlepszy kandydat z niską pewnością (na wypadek porażki VLM)
+
+        for tier in TIERS:
+            if tier == 'vlm' and (not use_vlm or self.vision is None):
+                continue
+            if tier == 'cv' and self.cv_detector is None:
+                continue
+
+            start = time.perf_counter()
+            if tier == 'template':
+                candidate = self._locate_template(frame, element, templates or [], threshold)
+            elif tier == 'cv':
+                candidate = self._locate_cv(frame, element, cv)
+            else:
+                candidate = self._locate_vlm(frame, element, learn, min_confidence)
+            elapsed = (time.perf_counter() - start) * 1000
+
+            result['timings'][tier] = elapsed
+            self.stats[tier]['calls'] += 1
+            self.stats[tier]['time_ms'] += elapsed
+
+            if candidate is None:
+                continue
+            if candidate['confidence'] >= min_confidence or tier == 'vlm':
+                best = candidate
+                break
+            if best is None or candidate['confidence'] > best['confidence']:
+                best = candidate
+
+        if best:
+            result.update(best)
+            result['found'] = True
+            self.stats[best['tier']]['hits'] += 1
+        return result
+
+    # ===== Poziomy kaskady =====
+
+    def _locate_template(self, frame: Frame, element: str, templates: List[str], threshold: float) -> Optional[Dict]:
+        """Pliki szablonów z kroku (biblioteka CVDetector) + zapamiętany wycinek elementu"""
+        if self.cv_detector is None:
+            return None
+
+        best = None
+        ctx = self.cv_detector.context(frame)
+        for path in templates:
+            try:
+                match = self.cv_detector.find_template(ctx, path, threshold)
+            except FileNotFoundError as e:
+                print(f"  ⚠️  {e}")
+                continue
+            if match and (best is None or match['score'] > best['score']):
+                best = match
+
+        from_learned = False
+        learned = self._learned_template(element)
+        if learned is not None:
+            match = self.cv_detector.match_template(ctx.gray, learned, max(threshold, LEARNED_MIN_SCORE))
+            if match and (best is None or match['score'] > best['score']):
+                best, from_learned = match, True
+
+        if best is None:
+            return None
+        return {'x': best['center'][0], 'y': best['center'][1], 'tier': 'template',
+                'confidence': best['score'], 'learned': from_learned}
+
+    def _locate_cv(self, frame: Frame, element: str, cv: Optional[str]) -> Optional[Dict]:
+        """Heurystyka CVDetector dopasowana do opisu elementu"""
+        kind = cv or self._cv_kind(element)
+        if kind in (None, 'none'):
+            return None
+
+        img = self.cv_detector.context(frame)
+        position = None
+        confidence = CV_CONFIDENCE.get(kind, 0.0)
+        if kind == 'text_field':
+            position = self.cv_detector.find_text_field(img)
+        elif kind == 'unlock':
+            position = self.cv_detector.find_unlock_button(img)
+        elif kind == 'dialog':
+            dialog = self.cv_detector.detect_dialog_box(img)
+            position = dialog['center'] if dialog else None
+        elif kind == 'button':
+            buttons = self.cv_detector.detect_buttons(img)
+            if buttons:
+                position = buttons[0]['center']
+                if len(buttons) > 1:
+                    confidence = CV_CONFIDENCE['button_ambiguous']
+        else:
+            raise ValueError(f"Nieznana heurystyka CV: {kind} (dostępne: text_field, unlock, dialog, button, none)")
+
+        if position is None:
+            return None
+        return {'x': position[0], 'y': position[1], 'tier': 'cv', 'confidence': confidence}
+
+    def _locate_vlm(self, frame: Frame, element: str, learn: bool, min_confidence: float) -> Optional[Dict]:
+        """OllamaVision.find_element - najwolniejszy, ostatni poziom"""
+        result = self.vision.find_element(frame, element)
+        if not result or not result.get('found'):
+            return None
+
+        x, y = int(result['x']), int(result['y'])
+        confidence = float(result.get('confidence', 50)) / 100.0
+        # Środek ćwiartki (approximate) lub zgadywanie z niską pewnością nie jest wzorcem elementu
+        if learn and not result.get('approximate') and confidence >= min_confidence:
+            self._learn(element, frame, x, y)
+        return {'x': x, 'y': y, 'tier': 'vlm', 'confidence': confidence}
+
+    @staticmethod
+    def _cv_kind(element: str) -> Optional[str]:
+        """Zgadnij heurystykę CV z opisu elementu"""
+        text = (element or '').lower()
+        for kind, keywords in CV_HINTS:
+            if any(keyword in text for keyword in keywords):
+                return kind
+        return None
+
+    # ===== Zapamiętane wycinki =====
+
+    def _learned_template(self, element: str) -> Optional[np.ndarray]:
+        """Wycinek zapamiętany dla elementu (pamięć, potem dysk)"""
+        if not element:
+            return None
+        key = _slug(element)
+        if key not in self._learned:
+            template = None
+            if self.learned_dir:
+                path = self.learned_dir / f"{key}.png"
+                if path.exists():
+                    template = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+            self._learned[key] = template
+        return self._learned[key]
+
+    def _learn(self, element: str, frame: Frame, x: int, y: int):
+        """Zapamiętaj wycinek wokół elementu znalezionego przez VLM"""
+        if not element:
+            return
+        w, h = LEARNED_PATCH_SIZE
+        x1, y1 = x - w // 2, y - h // 2
+        if x1 < 0 or y1 < 0 or x1 + w > frame.width or y1 + h > frame.height:
+            return  # Przy krawędzi ekranu środek wycinka nie byłby środkiem elementu
+        patch = np.ascontiguousarray(frame.gray[y1:y1 + h, x1:x1 + w])
+        if float(patch.std()) < LEARNED_MIN_CONTRAST:
+            return
+
+        key = _slug(element)
+        self._learned[key] = patch
+        if self.learned_dir:
+            try:
+                self.learned_dir.mkdir(parents=True, exist_ok=True)
+                cv2.imwrite(str(self.learned_dir / f"{key}.png"), patch)
+            except (OSError, cv2.error) as e:
+                print(f"  ⚠️  Cannot save learned template: {e}")
+
+    def forget(self, element: str):
+        """Usuń zapamiętany wycinek elementu (np. gdy UI się zmieniło)"""
+        key = _slug(element)
+        self._learned.pop(key, None)
+        if self.learned_dir:
+            (self.learned_dir / f"{key}.png").unlink(missing_ok=True)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Template Library - szablony wczytywane raz, dopasowanie coarse-to-fine
+Grayscale + piramida (pyrDown) każdego szablonu, unieważnianie po mtime pliku
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+MAX_PYRAMID_LEVEL = 2     # najgrubszy poziom: 1/4 rozdzielczości
+MIN_PYRAMID_SIDE = 12     # szablon na poziomie grubym musi mieć min. 12 px krótszego boku
+COARSE_CANDIDATES = 8     # ilu kandydatów z poziomu grubego sprawdzić w pełnej rozdzielczości
+
+
+class Template:
+    """
+    Wczytany szablon: obraz grayscale + piramidy dla kolejnych skal
+
+    Piramida skali `s` to lista [pełny, 1/2, 1/4, ...] obrazów szablonu
+    przeskalowanego o `s`, liczona przy pierwszym użyciu i zapamiętywana.
+    """
+
+    def __init__(self, path: str, gray: np.ndarray, mtime: int):
+        self.path = path
+        self.gray = gray
+        self.mtime = mtime
+        self._pyramids: Dict[float, List[np.ndarray]] = {}
+        self._color: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """Rozmiar (width, height) w skali 1.0"""
+        return (self.gray.shape[1], self.gray.shape[0])
+
+    @property
+    def color(self) -> np.ndarray:
+        """
+        Obraz BGR szablonu (dopasowanie w kolorze), wczytywany przy pierwszym użyciu
+
+        Raises:
+            FileNotFoundError: Plik zniknął lub nie jest obrazem
+        """
+        if self._color is None:
+            color = cv2.imread(self.path, cv2.IMREAD_COLOR)
+            if color is None:
+                raise FileNotFoundError(f"Template is not a readable image: {self.path}")
+            self._color = color
+        return self._color
+
+    def pyramid(self, scale: float = 1.0) -> List[np.ndarray]:
+        """Piramida szablonu w skali `scale` (poziom 0 = pełna rozdzielczość)"""
+        levels = self._pyramids.get(scale)
+        if levels is None:
+            with self._lock:
+                levels = self._pyramids.get(scale)
+                if levels is None:
+                    levels = self._pyramids[scale] = build_pyramid(self.gray, scale)
+        return levels
+
+
+def build_pyramid(gray: np.ndarray, scale: float = 1.0) -> List[np.ndarray]:
+    """Przeskaluj szablon i zbuduj piramidę, dopóki krótszy bok >= MIN_PYRAMID_SIDE"""
+    if scale != 1.0:
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+        width = max(1, int(round(gray.shape[1] * scale)))
+        height = max(1, int(round(gray.shape[0] * scale)))
+        gray = cv2.resize(gray, (width, height), interpolation=interpolation)
+
+    levels = [gray]
+    while len(levels) <= MAX_PYRAMID_LEVEL and min(levels[-1].shape[:2]) // 2 >= MIN_PYRAMID_SIDE:
+        levels.append(cv2.pyrDown(levels[-1]))
+    return levels
+
+
+def frame_pyramid(gray: np.ndarray, levels: int) -> List[np.ndarray]:
+    """Piramida klatki - te same kroki pyrDown co dla szablonów"""
+    pyramid = [gray]
+    for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+class TemplateLibrary:
+    """
+    Biblioteka szablonów: każdy plik jest czytany z dysku raz
+
+    Przy każdym użyciu sprawdzany jest tylko mtime pliku (os.stat) -
+    zmieniony plik jest wczytywany ponownie, więc podmiana szablonu
+    w trakcie działania nie wymaga restartu.
+
+    Dopasowanie jest coarse-to-fine: szablon i klatka na poziomie piramidy
+    1/2 lub 1/4 (16x mniej pikseli), a w pełnej rozdzielczości sprawdzane
+    jest tylko małe okno wokół najlepszych kandydatów.
+    """
+
+    def __init__(self):
+        self._templates: Dict[str, Template] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def get(self, path: str) -> Template:
+        """
+        Szablon z pliku (z pamięci, jeśli plik się nie zmienił)
+
+        Raises:
+            FileNotFoundError: Brak pliku lub plik nie jest obrazem
+        """
+        key = os.path.abspath(str(path))
+        try:
+            mtime = os.stat(key).st_mtime_ns
+        except OSError:
+            raise FileNotFoundError(f"Template not found: {path}")
+
+        template = self._templates.get(key)
+        if template is not None and template.mtime == mtime:
+            return template
+
+        gray = cv2.imread(key, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise FileNotFoundError(f"Template is not a readable image: {path}")
+        template = Template(key, gray, mtime)
+        with self._lock:
+            self._templates[key] = template
+            self.loads += 1
+        return template
+
+    def clear(self):
+        """Zapomnij wszystkie wczytane szablony"""
+        with self._lock:
+            self._templates.clear()
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def match(self, ctx, path: str, threshold: float = 0.8,
+              scales: Sequence[float] = (1.0,)) -> Optional[Dict]:
+        """
+        Najlepsze dopasowanie szablonu (dowolna z podanych skal)
+
+        Args:
+            ctx: AnalysisContext klatki (gray + piramida współdzielone z detektorami)
+            path: Ścieżka pliku szablonu
+            threshold: Minimalne dopasowanie TM_CCOEFF_NORMED (0-1)
+            scales: Skale szablonu do sprawdzenia (np. [0.8, 1.0, 1.25] dla innego DPI)
+
+        Returns:
+            {'x', 'y', 'width', 'height', 'center', 'score', 'scale'} lub None
+        """
+        hits = self._match_template(ctx, self.get(path), threshold, scales, 1)
+        return hits[0] if hits else None
+
+    def match_all(self, ctx, paths: Sequence[str], threshold: float = 0.8,
+                  scales: Sequence[float] = (1.0,), max_hits: int = 1,
+                  overlap: float = 0.3, executor=None) -> List[Dict]:
+        """
+        Wszystkie dopasowania zestawu szablonów w jednym przebiegu po klatce
+
+        Gray i piramida klatki są liczone raz, przed rozesłaniem zadań;
+        każdy szablon jest dopasowywany w osobnym zadaniu puli wątków
+        (cv2.matchTemplate zwalnia GIL). Na końcu non-max suppression
+        usuwa trafienia nakładające się na lepsze - także między różnymi
+        szablonami (np. "OK" i "Unlock" w tym samym przycisku).
+
+        Args:
+            ctx: AnalysisContext klatki
+            paths: Ścieżki plików szablonów
+            threshold: Minimalne dopasowanie (0-1)
+            scales: Skale szablonów
+            max_hits: Maks. liczba trafień jednego szablonu
+            overlap: Maks. IoU dwóch zachowanych trafień
+            executor: concurrent.futures.Executor (None = po kolei w tym wątku)
+
+        Returns:
+            Lista trafień od najlepszego, każde z kluczem 'template' (ścieżka)
+
+        Raises:
+            FileNotFoundError: Brak pliku któregoś szablonu
+        """
+        templates = [(path, self.get(path)) for path in paths]
+        ctx.pyramid(MAX_PYRAMID_LEVEL)  # gray + piramida klatki liczone tu, nie w wątkach
+
+        def match_one(item):
+            path, template = item
+            hits = self._match_template(ctx, template, threshold, scales, max_hits)
+            for hit in hits:
+                hit['template'] = str(path)
+            return hits
+
+        results = executor.map(match_one, templates) if executor else map(match_one, templates)
+        return non_max_suppression([hit for hits in results for hit in hits], overlap)
+
+    @staticmethod
+    def _match_template(ctx, template: Template, threshold: float,
+                        scales: Sequence[float], max_hits: int) -> List[Dict]:
+        """Trafienia jednego szablonu we wszystkich skalach, od najlepszego"""
+        hits = []
+        for scale in scales:
+            for hit in match_pyramid(ctx, template.pyramid(float(scale)), threshold, max_hits):
+                hit['scale'] = float(scale)
+                hits.append(hit)
+        if len(scales) > 1:
+            hits = non_max_suppression(hits)
+        return hits[:max_hits]
+
+
+def match_pyramid(ctx, levels: List[np.ndarray], threshold: float, max_hits: int = 1) -> List[Dict]:
+    """
+    Dopasowanie coarse-to-fine piramidy szablonu do klatki
+
+    Na najgrubszym poziomie wybieranych jest max(2 * max_hits, COARSE_CANDIDATES)
+    najlepszych lokalnych maksimów - bez progu, bo pomniejszenie obniża score
+    drobnych wzorów (dokładne trafienie przesunięte o nieparzystą liczbę
+    pikseli potrafi mieć ~0.6) - a każde jest doprecyzowane w pełnej
+    rozdzielczości w oknie o kilka pikseli większym niż szablon. `threshold`
+    obowiązuje tylko w pełnej rozdzielczości.
+
+    Returns:
+        Do `max_hits` dopasowań >= threshold, od najlepszego
+    """
+    gray = ctx.gray
+    th, tw = levels[0].shape[:2]
+    if th > gray.shape[0] or tw > gray.shape[1]:
+        return []
+
+    level = len(levels) - 1
+    if level > 0:
+        small = ctx.pyramid(level)
+        if levels[level].shape[0] > small.shape[0] or levels[level].shape[1] > small.shape[1]:
+            level = 0
+
+    if level == 0:
+        result = _match(gray, levels[0])
+        return [_hit(x, y, tw, th, score) for x, y, score in _peaks(result, threshold, max_hits, levels[0].shape)]
+
+    factor = 2 ** level
+    pad = 2 * factor
+    result = _match(ctx.pyramid(level), levels[level])
+    hits = []
+    for cx, cy, _ in _peaks(result, -1.0, max(2 * max_hits, COARSE_CANDIDATES), levels[level].shape):
+        x1 = max(0, cx * factor - pad)
+        y1 = max(0, cy * factor - pad)
+        x2 = min(gray.shape[1], cx * factor + tw + pad)
+        y2 = min(gray.shape[0], cy * factor + th + pad)
+        match = _best_in(gray[y1:y2, x1:x2], levels[0], x1, y1, threshold)
+        if match:
+            hits.append(match)
+    # Kilku kandydatów z poziomu grubego może trafić w to samo miejsce
+    return non_max_suppression(hits)[:max_hits]
+
+
+def non_max_suppression(hits: List[Dict], overlap: float = 0.3) -> List[Dict]:
+    """
+    Usuń dopasowania nakładające się na lepsze (IoU > overlap)
+
+    Returns:
+        Pozostałe dopasowania, od najlepszego
+    """
+    kept = []
+    for hit in sorted(hits, key=lambda h: h['score'], reverse=True):
+        if all(_iou(hit, other) <= overlap for other in kept):
+            kept.append(hit)
+    return kept
+
+
+def _iou(a: Dict, b: Dict) -> float:
+    """Intersection over union prostokątów dopasowań"""
+    w = min(a['x'] + a['width'], b['x'] + b['width']) - max(a['x'], b['x'])
+    h = min(a['y'] + a['height'], b['y'] + b['height']) - max(a['y'], b['y'])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float(a['width'] * a['height'] + b['width'] * b['height'] - inter)
+
+
+def _match(img: np.ndarray, template: np.ndarray) -> np.ndarray:
+    """matchTemplate z NaN (jednolity szablon/obszar) zamienionym na -1"""
+    result = cv2.matchTemplate(img, template, cv2.TM_CCOEFF_NORMED)
+    return np.nan_to_num(result, copy=False, nan=-1.0, posinf=-1.0, neginf=-1.0)
+
+
+def _hit(x: int, y: int, width: int, height: int, score: float) -> Dict:
+    return {
+        'x': x,
+        'y': y,
+        'width': width,
+        'height': height,
+        'center': (x + width // 2, y + height // 2),
+        'score': float(score)
+    }
+
+
+def _best_in(img: np.ndarray, template: np.ndarray, offset_x: int, offset_y: int,
+             threshold: float) -> Optional[Dict]:
+    """Najlepsze dopasowanie w obrazie (wycinku) - współrzędne przesunięte o offset"""
+    th, tw = template.shape[:2]
+    if th > img.shape[0] or tw > img.shape[1]:
+        return None
+    _, max_val, _, max_loc = cv2.minMaxLoc(_match(img, template))
+    if max_val < threshold:
+        return None
+    return _hit(offset_x + max_loc[0], offset_y + max_loc[1], tw, th, max_val)
+
+
+def _peaks(result: np.ndarray, threshold: float, limit: int,
+           template_shape: Tuple[int, ...]) -> List[Tuple[int, int, float]]:
+    """Do `limit` najlepszych lokalnych maksimów (x, y, score) >= threshold (okolica maksimum jest wygaszana)"""
+    th, tw = template_shape[:2]
+    peaks = []
+    while len(peaks) < limit:
+        _, max_val, _, (x, y) = cv2.minMaxLoc(result)
+        if max_val < threshold:
+            break
+        peaks.append((x, y, max_val))
+        result[max(0, y - th // 2):y + th // 2 + 1, max(0, x - tw // 2):x + tw // 2 + 1] = -1.0
+    return peaks
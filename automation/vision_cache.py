@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Vision Cache - cache odpowiedzi modelu vision (Ollama)
+Klucz: hash pikseli screenshotu + model + prompt
+Dwa poziomy: LRU w pamięci + pliki JSON na dysku (results/vision_cache)
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+# Brak wartości w cache (odpowiedź może być np. pustym stringiem)
+MISS = object()
+
+
+def image_digest(image: Image.Image) -> str:
+    """Dokładny hash pikseli obrazu PIL (blake2b) - identyczny ekran = identyczny hash"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode}:{image.width}x{image.height}".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+class VisionCache:
+    """
+    Cache odpowiedzi vision z TTL i limitem rozmiaru
+
+    Poziom 1: OrderedDict w pamięci (LRU, maks. `max_entries` wpisów).
+    Poziom 2: jeden plik JSON na wpis w `disk_dir`; przy przekroczeniu
+    `max_disk_bytes` usuwane są najstarsze pliki. Trafienie na dysku
+    kopiuje wpis do pamięci. Wpisy starsze niż `ttl` sekund są pomijane
+    i usuwane przy odczycie.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 24 * 3600,
+                 disk_dir: Optional[str] = '/app/results/vision_cache',
+                 max_disk_bytes: int = 50 * 1024 * 1024):
+        """
+        Args:
+            max_entries: Maks. liczba wpisów w pamięci
+            ttl: Czas życia wpisu w sekundach (None = bez limitu)
+            disk_dir: Katalog cache na dysku (None = tylko pamięć)
+            max_disk_bytes: Maks. rozmiar cache na dysku
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.max_disk_bytes = max_disk_bytes
+
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+        self._memory: 'OrderedDict[str, tuple]' = OrderedDict()  # klucz -> (czas, wartość)
+        self._disk_index: Optional[Dict[str, tuple]] = None  # klucz -> (czas modyfikacji, rozmiar)
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(digest: str, model: str, prompt: str, variant: str = '') -> str:
+        """Klucz wpisu: hash obrazu + model + prompt (+ wariant, np. oczekiwany format)"""
+        h = hashlib.blake2b(digest_size=20)
+        for part in (digest, model, prompt, variant):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get(self, key: str) -> Any:
+        """
+        Returns:
+            Zapamiętana wartość lub MISS
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._is_expired(entry[0], now):
+                    del self._memory[key]
+                    self.expired += 1
+                else:
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return entry[1]
+
+            value = self._disk_get(key, now)
+            if value is MISS:
+                self.misses += 1
+                return MISS
+
+            self.hits_disk += 1
+            self._memory_put(key, now, value)
+            return value
+
+    def put(self, key: str, value: Any, persist: bool = True):
+        """
+        Zapisz wartość (musi dać się zapisać jako JSON)
+
+        Args:
+            persist: False = tylko pamięć (np. wynik "nie znaleziono", który
+                nie powinien przetrwać restartu)
+        """
+        now = time.time()
+        with self._lock:
+            self._memory_put(key, now, value)
+            if persist:
+                self._disk_put(key, now, value)
+
+    def clear(self):
+        """Usuń wszystkie wpisy (pamięć i dysk)"""
+        with self._lock:
+            self._memory.clear()
+            for key in list(self._load_disk_index()):
+                self._disk_remove(key)
+
+    def stats(self) -> Dict:
+        """Liczniki trafień i rozmiar cache"""
+        with self._lock:
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                'hits_memory': self.hits_memory,
+                'hits_disk': self.hits_disk,
+                'misses': self.misses,
+                'hit_rate': (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'memory_entries': len(self._memory),
+                'disk_entries': len(self._disk_index) if self._disk_index is not None else None,
+                'disk_bytes': self._disk_bytes,
+            }
+
+    # ===== Pamięć =====
+
+    def _is_expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def _memory_put(self, key: str, created: float, value: Any):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    # ===== Dysk =====
+
+    def _path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _load_disk_index(self) -> Dict[str, tuple]:
+        """Indeks plików na dysku (budowany raz, przy pierwszym użyciu)"""
+        if self._disk_index is not None:
+            return self._disk_index
+        if self.disk_dir is None:
+            return {}
+
+        self._disk_index = {}
+        self._disk_bytes = 0
+        try:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            for path in self.disk_dir.glob('*/*.json'):
+                stat = path.stat()
+                self._disk_index[path.stem] = (stat.st_mtime, stat.st_size)
+                self._disk_bytes += stat.st_size
+        except OSError as e:
+            print(f"⚠️  Vision cache: dysk niedostępny ({e}), tylko pamięć")
+            self.disk_dir = None
+        return self._disk_index
+
+    def _disk_get(self, key: str, now: float) -> Any:
+        if key not in self._load_disk_index():
+            return MISS
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._disk_remove(key)
+            return MISS
+
+        if self._is_expired(entry.get('created', 0), now):
+            self._disk_remove(key)
+            self.expired += 1
+            return MISS
+        return entry.get('value')
+
+    def _disk_put(self, key: str, created: float, value: Any):
+        index = self._load_disk_index()
+        if self.disk_dir is None:
+            return
+
+        data = json.dumps({'created': created, 'value': value}, ensure_ascii=False).encode('utf-8')
+        path = self._path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_suffix('.tmp')
+            tmp_path.write_bytes(data)
+            tmp_path.replace(path)
+        except OSError as e:
+            print(f"⚠️  Vision cache: nie można zapisać wpisu: {e}")
+            return
+
+        if key in index:
+            self._disk_bytes -= index[key][1]
+        index[key] = (created, len(data))
+        self._disk_bytes += len(data)
+
+        # Limit rozmiaru - usuń najstarsze wpisy
+        if self._disk_bytes > self.max_disk_bytes:
+            for old_key, _ in sorted(index.items(), key=lambda item: item[1][0]):
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+                if old_key != key:
+                    self._disk_remove(old_key)
+                    self.evictions += 1
+
+    def _disk_remove(self, key: str):
+        entry = self._disk_index.pop(key, None) if self._disk_index is not None else None
+        if entry:
+            self._disk_bytes -= entry[1]
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
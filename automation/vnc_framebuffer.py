@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+VNC Framebuffer Mirror
+Lokalna kopia framebuffera VNC aktualizowana przyrostowo (RFB incremental updates)
+ze śledzeniem zmienionych prostokątów (dirty rectangles)
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Iterable, List, Optional, Tuple
+
+try:
+    from twisted.internet import reactor
+    from vncdotool.client import VNCDoToolClient, VNCDoToolFactory
+    VNCDOTOOL_AVAILABLE = True
+except ImportError:
+    VNCDOTOOL_AVAILABLE = False
+
+Rect = Tuple[int, int, int, int]
+
+
+def union_rects(rects: List[Rect]) -> Optional[Rect]:
+    """Zwraca prostokąt obejmujący wszystkie podane prostokąty (x, y, w, h)"""
+    if not rects:
+        return None
+    x1 = min(r[0] for r in rects)
+    y1 = min(r[1] for r in rects)
+    x2 = max(r[0] + r[2] for r in rects)
+    y2 = max(r[1] + r[3] for r in rects)
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+def rects_intersect(a: Rect, b: Rect) -> bool:
+    """Czy prostokąty (x, y, w, h) mają część wspólną"""
+    return (a[0] < b[0] + b[2] and b[0] < a[0] + a[2]
+            and a[1] < b[1] + b[3] and b[1] < a[1] + a[3])
+
+
+class FramebufferMirror:
+    """
+    Historia zmian framebuffera z numerami sekwencyjnymi klatek
+
+    Każda zatwierdzona aktualizacja RFB, która zmieniła piksele, dostaje
+    kolejny numer sekwencyjny. Konsumenci pamiętają numer ostatnio
+    przetworzonej klatki i pytają "co się zmieniło od klatki N".
+    """
+
+    def __init__(self, history: int = 256):
+        """
+        Args:
+            history: Ile ostatnich aktualizacji przechowywać w historii
+        """
+        self.sequence = 0
+        self.size: Optional[Tuple[int, int]] = None
+        self.last_update: Optional[float] = None
+
+        self._history = deque(maxlen=history)  # [(sequence, [rects]), ...]
+        self._pending: List[Rect] = []
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+
+    def mark_dirty(self, x: int, y: int, width: int, height: int):
+        """Zapamiętaj zmieniony prostokąt (wywoływane z wątku reaktora)"""
+        if width <= 0 or height <= 0:
+            return
+        with self._lock:
+            self._pending.append((x, y, width, height))
+
+    def resize(self, width: int, height: int):
+        """Zmiana rozmiaru pulpitu - cały ekran jest brudny"""
+        with self._lock:
+            self.size = (width, height)
+            self._pending = [(0, 0, width, height)]
+
+    def commit(self, rectangles: Iterable[Rect] = ()) -> int:
+        """
+        Zatwierdź zebrane prostokąty (oraz `rectangles`) jako nową klatkę
+
+        Returns:
+            Aktualny numer sekwencyjny
+        """
+        for rect in rectangles:
+            self.mark_dirty(*rect)
+        with self._updated:
+            if self._pending:
+                self.sequence += 1
+                self._history.append((self.sequence, self._pending))
+                self._pending = []
+                self.last_update = time.time()
+                self._updated.notify_all()
+            return self.sequence
+
+    def changes_since(self, sequence: int) -> Optional[List[Rect]]:
+        """
+        Lista prostokątów zmienionych po klatce `sequence`
+
+        Returns:
+            Lista (x, y, w, h) - pusta jeśli nic się nie zmieniło,
+            None jeśli historia jest za krótka (traktuj jak cały ekran)
+        """
+        with self._lock:
+            if sequence >= self.sequence:
+                return []
+            if not self._history or self._history[0][0] > sequence + 1:
+                return None
+
+            rects = []
+            for seq, seq_rects in self._history:
+                if seq > sequence:
+                    rects.extend(seq_rects)
+            return rects
+
+    def changed_region_since(self, sequence: int) -> Optional[Rect]:
+        """Prostokąt obejmujący wszystkie zmiany po klatce `sequence` (None = brak zmian)"""
+        rects = self.changes_since(sequence)
+        if rects is None:
+            if self.size:
+                return (0, 0, self.size[0], self.size[1])
+            return None
+        return union_rects(rects)
+
+    def has_changed_since(self, sequence: int) -> bool:
+        """Czy framebuffer zmienił się po klatce `sequence`"""
+        with self._lock:
+            return self.sequence > sequence
+
+    def wait_for_update(self, sequence: int, timeout: float) -> bool:
+        """
+        Czekaj aż pojawi się klatka nowsza niż `sequence`
+
+        Returns:
+            True jeśli przyszła nowa klatka przed upływem timeout
+        """
+        with self._updated:
+            return self._updated.wait_for(lambda: self.sequence > sequence, timeout)
+
+
+if VNCDOTOOL_AVAILABLE:
+
+    class MirroringVNCClient(VNCDoToolClient):
+        """
+        Klient vncdotool utrzymujący stale aktualny framebuffer
+
+        Po połączeniu pobiera pełny ekran, a potem po każdej aktualizacji
+        wysyła kolejne żądanie przyrostowe (nie częściej niż co
+        `factory.update_interval` sekund). Serwer odsyła tylko zmienione
+        prostokąty, które trafiają do `factory.mirror`.
+        """
+
+        _incremental_scheduled = False
+        _last_request = 0.0
+
+        def vncConnectionMade(self):
+            super().vncConnectionMade()
+            self.factory.mirror.resize(self.width, self.height)
+            self._last_request = time.time()
+            self.framebufferUpdateRequest(incremental=False)
+
+        def updateDesktopSize(self, width, height):
+            super().updateDesktopSize(width, height)
+            self.factory.mirror.resize(width, height)
+
+        def commitUpdate(self, rectangles=None):
+            # rectangles: tylko prostokąty niosące piksele (bez pseudo-kodowań)
+            super().commitUpdate(rectangles)
+            self.factory.mirror.commit(rectangles or ())
+            self._schedule_incremental()
+
+        def _schedule_incremental(self):
+            if self._incremental_scheduled:
+                return
+            self._incremental_scheduled = True
+            delay = max(0.0, self.factory.update_interval - (time.time() - self._last_request))
+            reactor.callLater(delay, self._request_incremental)
+
+        def _request_incremental(self):
+            self._incremental_scheduled = False
+            if self.transport is None or not self.transport.connected:
+                return
+            self._last_request = time.time()
+            self.framebufferUpdateRequest(incremental=True)
+
+    class MirroringVNCFactory(VNCDoToolFactory):
+        """Fabryka klienta z lokalną kopią framebuffera"""
+
+        protocol = MirroringVNCClient
+        update_interval = 0.05  # maks. 20 żądań przyrostowych na sekundę
+
+        def __init__(self):
+            super().__init__()
+            self.mirror = FramebufferMirror()
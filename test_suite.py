@@ -305,6 +305,51 @@ except Exception as e:
             self.error("Ollama Vision nie działa")
             return False
     
+    def test_streaming_answers(self):
+        """Test 11: Przerywanie strumienia Ollama tylko po pełnej odpowiedzi"""
+        self.info("Test 11: Test kompletności odpowiedzi (streaming)...")
+        
+        test_script = """
+import sys
+sys.path.insert(0, '/app')
+from remote_automation import ANSWER_PATTERNS
+
+is_complete = ANSWER_PATTERNS['yes_no']
+prose = "There is no error dialog, so YES, the login screen is shown."
+failures = []
+for answer in ["YES.", "No, it is not.", "**Yes** ", "  NO\\n"]:
+    if not is_complete(answer):
+        failures.append(f"not complete: {answer!r}")
+# Proza z "no" - żaden fragment nie może przerwać strumienia przed końcem
+for end in range(1, len(prose) + 1):
+    if is_complete(prose[:end]):
+        failures.append(f"cut at {end}: {prose[:end]!r}")
+        break
+for answer in ["Nothing here", "Yesterday"]:
+    if is_complete(answer + " "):
+        failures.append(f"complete: {answer!r}")
+
+if failures:
+    print(f"STREAMING_FAILED: {failures}")
+else:
+    print("STREAMING_OK")
+"""
+        
+        Path("/tmp/test_streaming.py").write_text(test_script)
+        
+        result = self.run_command(
+            "docker cp /tmp/test_streaming.py automation-controller:/tmp/ && "
+            "docker-compose exec -T automation-controller python3 /tmp/test_streaming.py",
+            check=False
+        )
+        
+        if result and "STREAMING_OK" in result.stdout:
+            self.success("Odpowiedzi YES/NO w prozie są odbierane do końca")
+            return True
+        else:
+            self.error(f"Kompletność odpowiedzi: {result.stdout.strip() if result else 'brak wyniku'}")
+            return False
+    
     def run_all_tests(self):
         """Uruchom wszystkie testy"""
         print(f"\n{Colors.BLUE}{'='*50}{Colors.NC}")
@@ -322,6 +367,7 @@ except Exception as e:
             ("Automation Simple", self.test_automation_simple),
             ("Desktop Screenshot", self.test_desktop_screenshot),
             ("Ollama Vision", self.test_ollama_vision),
+            ("Streaming Answers", self.test_streaming_answers),
         ]
         
         passed = 0